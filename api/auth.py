@@ -1,7 +1,10 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 import os
 import logging
+import threading
+import time
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
@@ -22,6 +25,10 @@ SECRET_KEY = os.getenv("SECRET_KEY", "09d25e094faa6ca2556c818166b7a9563b93f7099f
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Verified tokens are cached so polling clients skip JWT verification
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+
 # Password hashing context with fallback schemes
 try:
     # First try with bcrypt
@@ -37,8 +44,13 @@ except Exception as e:
 
 # This will be initialized with users from environment variables
 # Format: username1:password1,username2:password2
+# A password may also be given pre-hashed, e.g. username1:$2b$12$...
 USERS = {}
 
+# Plain-text passwords from the environment, hashed on first use
+PENDING_PASSWORDS = {}
+_users_lock = threading.Lock()
+
 # Load users from environment
 def load_users():
     users_env = os.getenv("AUTH_USERS", "admin:password")
@@ -47,8 +59,29 @@ def load_users():
     for user_pair in user_pairs:
         if ":" in user_pair:
             username, password = user_pair.split(":", 1)
-            # Store hashed password
-            USERS[username] = pwd_context.hash(password)
+            if pwd_context.identify(password):
+                # Already hashed, store as is
+                USERS[username] = password
+            else:
+                # Hashing is deferred to the first login so startup does not
+                # pay one bcrypt round per configured user
+                PENDING_PASSWORDS[username] = password
+
+def user_exists(username: str) -> bool:
+    return username in USERS or username in PENDING_PASSWORDS
+
+def get_hashed_password(username: str) -> Optional[str]:
+    """Return the user's password hash, hashing a pending plain-text password once."""
+    if username in USERS:
+        return USERS[username]
+    password = PENDING_PASSWORDS.get(username)
+    if password is None:
+        return None
+    hashed_password = pwd_context.hash(password)
+    with _users_lock:
+        USERS[username] = hashed_password
+        PENDING_PASSWORDS.pop(username, None)
+    return hashed_password
 
 # OAuth2 password bearer for token retrieval
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -67,15 +100,78 @@ class User(BaseModel):
 class UserInDB(User):
     hashed_password: str
 
+class TokenCache:
+    """Bounded LRU cache of verified tokens and their users.
+
+    An entry is dropped at the token's exp claim or after ttl seconds,
+    whichever comes first, so expired tokens are never accepted from the
+    cache and user changes are picked up within ttl. Tokens without an exp
+    claim are kept for ttl seconds.
+    """
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: int = TOKEN_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, Tuple[float, User]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token: str) -> Optional[User]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                expires_at, user = entry
+                if time.time() < expires_at:
+                    self._entries.move_to_end(token)
+                    self.hits += 1
+                    return user
+                del self._entries[token]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, user: User, exp: Optional[float] = None) -> None:
+        if self.maxsize <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(exp, expires_at)
+        with self._lock:
+            self._entries[token] = (expires_at, user)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+token_cache = TokenCache()
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_user(db, username: str):
-    if username in USERS:
-        return UserInDB(username=username, hashed_password=USERS[username])
+    hashed_password = get_hashed_password(username)
+    if hashed_password is not None:
+        return UserInDB(username=username, hashed_password=hashed_password)
     return None
 
 def authenticate_user(username: str, password: str):
+    """Check credentials; CPU bound, call it from a worker thread in async code."""
     user = get_user(None, username)
     if not user:
         return False
@@ -94,6 +190,10 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -107,9 +207,11 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = get_user(None, username=token_data.username)
-    if user is None:
+    # Token checks only need the user to exist, not the password hash
+    if not user_exists(token_data.username):
         raise credentials_exception
+    user = User(username=token_data.username)
+    token_cache.put(token, user, payload.get("exp"))
     return user
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
@@ -0,0 +1,33 @@
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from fastapi import Response
+
+# Responses need a token, so only the client may keep them, and it revalidates every time
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(versions: Dict[str, str], *parts: Any) -> str:
+    """Strong ETag of a response computed from the versions of its scopes and its parameters."""
+    payload = json.dumps([versions, parts], sort_keys=True, default=str)
+    return '"' + hashlib.sha256(payload.encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header names etag, comparing weakly as RFC 9110 asks for GETs."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def set_etag(response: Response, etag: str) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+
+
+def not_modified(etag: str) -> Response:
+    """Bodyless 304, returned before the handler loads or serializes anything."""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
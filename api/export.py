@@ -0,0 +1,75 @@
+import csv
+import io
+import json
+from typing import AsyncIterable, AsyncIterator, List
+
+from sqlalchemy import Row
+
+# Encoded output is flushed to the client in chunks of roughly this many characters
+CHUNK_SIZE = 64 * 1024
+
+CSV_COLUMNS = [
+    "measurement_id", "template_id", "measured_at", "recorded_at",
+    "notes", "user_id", "definition_name", "value"
+]
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def _encode_measurement(group: List[Row]) -> str:
+    first = group[0]
+    return json.dumps({
+        "id": first[0],
+        "template_id": first[1],
+        "values": [
+            {"definition_name": row[6], "value": row[7]}
+            for row in group
+            if row[6] is not None
+        ],
+        "measured_at": _isoformat(first[2]),
+        "recorded_at": _isoformat(first[3]),
+        "notes": first[4],
+        "user_id": first[5],
+    }) + "\n"
+
+
+async def iter_ndjson(rows: AsyncIterable[Row]) -> AsyncIterator[str]:
+    """Encode rows from iter_measurement_rows as one JSON measurement per line."""
+    buffer = []
+    size = 0
+    group = []
+    async for row in rows:
+        # Rows of one measurement are adjacent, a new id closes the previous group
+        if group and row[0] != group[0][0]:
+            line = _encode_measurement(group)
+            buffer.append(line)
+            size += len(line)
+            group = []
+            if size >= CHUNK_SIZE:
+                yield "".join(buffer)
+                buffer = []
+                size = 0
+        group.append(row)
+    if group:
+        buffer.append(_encode_measurement(group))
+    if buffer:
+        yield "".join(buffer)
+
+
+async def iter_csv(rows: AsyncIterable[Row]) -> AsyncIterator[str]:
+    """Encode rows from iter_measurement_rows as CSV, one line per value."""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(CSV_COLUMNS)
+    async for row in rows:
+        writer.writerow([
+            row[0], row[1], _isoformat(row[2]), _isoformat(row[3]),
+            row[4], row[5], row[6], row[7]
+        ])
+        if output.tell() >= CHUNK_SIZE:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    yield output.getvalue()
@@ -1,17 +1,28 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
 from datetime import datetime, timedelta
 import uuid
-from sqlalchemy.orm import Session
 
-from models.measurement import Measurement, MeasurementTemplate, MeasurementValue
-from db.storage import get_storage, Database
-from db.database import get_db, engine, Base
+from models.measurement import (
+    Measurement, MeasurementTemplate, MeasurementValue, MeasurementPage, BatchResult, BucketSize,
+    SeriesMethod, ExportFormat
+)
+from db.storage import get_storage, AsyncDatabase
+from db.database import async_engine, Base, pool_stats
+from db.registry import template_registry
+from db.stats_cache import statistics_cache
+from db.models import canonical_key, is_valid_key
+from db.partitions import create_upcoming_partitions
+from db.versions import TEMPLATES, measurements_scope, template_scope
+from api.etags import make_etag, etag_matches, set_etag, not_modified
+from api.export import iter_ndjson, iter_csv
 from api.auth import (
     Token, User, authenticate_user, create_access_token, 
-    get_current_active_user, ACCESS_TOKEN_EXPIRE_MINUTES
+    get_current_active_user, token_cache, ACCESS_TOKEN_EXPIRE_MINUTES
 )
 
 app = FastAPI(title="Life Measurements Tracker")
@@ -23,17 +34,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],  # Read by fetchAPI for conditional requests
 )
 
 # Create all tables on startup
 @app.on_event("startup")
 async def startup():
     # Create tables
-    Base.metadata.create_all(bind=engine)
+    async with async_engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+        # Monthly partitions are also created on demand, this avoids the DDL on the first writes
+        await connection.run_sync(create_upcoming_partitions)
 
 @app.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+    # bcrypt verification takes ~200 ms of CPU, keep it off the event loop
+    user = await run_in_threadpool(authenticate_user, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -54,65 +70,107 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
 async def root():
     return {"message": "Welcome to the Life Measurements Tracker API"}
 
+@app.get("/metrics")
+async def get_metrics(current_user: User = Depends(get_current_active_user)):
+    return {
+        "template_cache": template_registry.stats(),
+        "statistics_cache": statistics_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "pool": pool_stats()
+    }
+
 # Template endpoints
+# GETs below answer If-None-Match with 304 from the data versions alone (see db/versions.py);
+# the versions are read before the data, so an ETag is never newer than its body
 @app.get("/templates", response_model=List[MeasurementTemplate])
 async def get_templates(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_active_user),
-    db: Database = Depends(get_storage)
+    db: AsyncDatabase = Depends(get_storage)
 ):
-    return db.get_templates()
+    etag = make_etag(await db.get_data_versions([TEMPLATES]))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    set_etag(response, etag)
+    return await db.get_templates()
 
 @app.get("/templates/{template_id}", response_model=MeasurementTemplate)
 async def get_template(
     template_id: str, 
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_active_user),
-    db: Database = Depends(get_storage)
+    db: AsyncDatabase = Depends(get_storage)
 ):
-    template = db.get_template(template_id)
+    # Data versions are kept under the stored spelling of the id
+    template_id = canonical_key(template_id)
+    etag = make_etag(await db.get_data_versions([template_scope(template_id)]), template_id)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    template = await db.get_template(template_id)
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
+    set_etag(response, etag)
     return template
 
 @app.post("/templates", response_model=MeasurementTemplate)
 async def create_template(
     template: MeasurementTemplate, 
     current_user: User = Depends(get_current_active_user),
-    db: Database = Depends(get_storage)
+    db: AsyncDatabase = Depends(get_storage)
 ):
     if not template.id:
         template.id = str(uuid.uuid4())
+    elif not is_valid_key(template.id):
+        raise HTTPException(status_code=400, detail="Template id must be a UUID")
     template.created_at = datetime.now()
-    return db.create_template(template)
+    return await db.create_template(template)
 
 # Measurement endpoints
-@app.get("/measurements", response_model=List[Measurement])
+@app.get("/measurements", response_model=MeasurementPage)
 async def get_measurements(
     template_id: Optional[str] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_active_user),
-    db: Database = Depends(get_storage)
+    db: AsyncDatabase = Depends(get_storage)
 ):
     if end_date is None:
         end_date = datetime.now()
     if start_date is None:
         start_date = end_date - timedelta(days=365)  # Default to last year
-        
-    return db.get_measurements(template_id, start_date, end_date)
+    
+    try:
+        items, next_cursor = await db.get_measurements_page(
+            template_id, start_date, end_date, limit, cursor, user_id=current_user.username
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {"items": items, "next_cursor": next_cursor}
 
 @app.post("/measurements", response_model=Measurement)
 async def create_measurement(
     measurement: Measurement, 
     current_user: User = Depends(get_current_active_user),
-    db: Database = Depends(get_storage)
+    db: AsyncDatabase = Depends(get_storage)
 ):
     if not measurement.id:
         measurement.id = str(uuid.uuid4())
+    elif not is_valid_key(measurement.id):
+        raise HTTPException(status_code=400, detail="Measurement id must be a UUID")
     if not measurement.recorded_at:
         measurement.recorded_at = datetime.now()
+    # Measurements belong to the user who posts them
+    measurement.user_id = current_user.username
         
     # Validate against template
-    template = db.get_template(measurement.template_id)
+    template = await db.get_template(measurement.template_id)
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
     
@@ -124,61 +182,160 @@ async def create_measurement(
         missing = template_value_names - measurement_value_names
         raise HTTPException(status_code=400, detail=f"Missing required values: {missing}")
     
-    return db.create_measurement(measurement)
+    try:
+        return await db.create_measurement(measurement)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/measurements/batch", response_model=BatchResult)
+async def create_measurements_batch(
+    measurements: List[Measurement],
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncDatabase = Depends(get_storage)
+):
+    for measurement in measurements:
+        if not measurement.id:
+            measurement.id = str(uuid.uuid4())
+        measurement.user_id = current_user.username
+    
+    # Invalid items are reported per item instead of failing the whole batch
+    return await db.create_measurements_bulk(measurements)
+
+@app.get("/measurements/series")
+async def get_measurement_series(
+    template_id: str,
+    response: Response,
+    points: int = Query(500, ge=3, le=10000),
+    method: SeriesMethod = SeriesMethod.lttb,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncDatabase = Depends(get_storage)
+):
+    if end_date is None:
+        end_date = datetime.now()
+    if start_date is None:
+        start_date = end_date - timedelta(days=30)  # Default to last 30 days
+    
+    template_id = canonical_key(template_id)
+    versions = await db.get_data_versions([
+        template_scope(template_id), measurements_scope(template_id, current_user.username)
+    ])
+    etag = make_etag(versions, template_id, current_user.username, points, method.value, start_date, end_date)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    # At most points readings per value definition, reduced while they stream from the database
+    series = await db.get_measurement_series(
+        template_id, start_date, end_date, points, method, user_id=current_user.username
+    )
+    if series is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    
+    set_etag(response, etag)
+    return series
 
 @app.get("/measurements/{measurement_id}", response_model=Measurement)
 async def get_measurement(
     measurement_id: str, 
     current_user: User = Depends(get_current_active_user),
-    db: Database = Depends(get_storage)
+    db: AsyncDatabase = Depends(get_storage)
 ):
-    measurement = db.get_measurement(measurement_id)
+    measurement = await db.get_measurement(measurement_id, user_id=current_user.username)
     if not measurement:
         raise HTTPException(status_code=404, detail="Measurement not found")
     return measurement
 
+# Export endpoints
+@app.get("/export/measurements")
+async def export_measurements(
+    format: ExportFormat = ExportFormat.ndjson,
+    template_id: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncDatabase = Depends(get_storage)
+):
+    # Rows are encoded as they are fetched, nothing is materialized up front
+    rows = db.iter_measurement_rows(template_id, start_date, end_date, user_id=current_user.username)
+    
+    if format == ExportFormat.csv:
+        body, media_type = iter_csv(rows), "text/csv"
+    else:
+        body, media_type = iter_ndjson(rows), "application/x-ndjson"
+    
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=measurements.{format.value}"}
+    )
+
 # Statistics endpoints
 @app.get("/statistics/{template_id}")
 async def get_statistics(
     template_id: str,
+    response: Response,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
+    percentiles: bool = False,
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_active_user),
-    db: Database = Depends(get_storage)
+    db: AsyncDatabase = Depends(get_storage)
 ):
+    # A window ending at "now" is never requested again, caching it would only evict other windows
+    cache = end_date is not None
     if end_date is None:
         end_date = datetime.now()
     if start_date is None:
         start_date = end_date - timedelta(days=30)  # Default to last 30 days
     
-    template = db.get_template(template_id)
-    if not template:
+    template_id = canonical_key(template_id)
+    # A window ending at "now" moves with every request, only explicit windows revalidate
+    versions = await db.get_data_versions([
+        template_scope(template_id), measurements_scope(template_id, current_user.username)
+    ])
+    etag = make_etag(versions, template_id, current_user.username, start_date, end_date, percentiles)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    # percentiles adds approximate p50, p90 and p99 estimated from quantile sketches, see db.sketches
+    stats = await db.get_statistics(
+        template_id, start_date, end_date, user_id=current_user.username, percentiles=percentiles, cache=cache
+    )
+    if stats is None:
         raise HTTPException(status_code=404, detail="Template not found")
     
-    measurements = db.get_measurements(template_id, start_date, end_date)
-    
-    # Calculate statistics for each value definition
-    stats = {}
-    for value_def in template.value_definitions:
-        values = [
-            m.values[i].value 
-            for m in measurements
-            for i, v in enumerate(m.values) 
-            if v.definition_name == value_def.name
-        ]
-        
-        if values:
-            stats[value_def.name] = {
-                "count": len(values),
-                "min": min(values),
-                "max": max(values),
-                "avg": sum(values) / len(values),
-                "unit": value_def.unit.name
-            }
-        else:
-            stats[value_def.name] = {
-                "count": 0,
-                "unit": value_def.unit.name
-            }
-    
-    return stats
\ No newline at end of file
+    set_etag(response, etag)
+    return stats
+
+@app.get("/statistics/{template_id}/series")
+async def get_statistics_series(
+    template_id: str,
+    response: Response,
+    bucket: BucketSize = BucketSize.day,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncDatabase = Depends(get_storage)
+):
+    if end_date is None:
+        end_date = datetime.now()
+    if start_date is None:
+        start_date = end_date - timedelta(days=30)  # Default to last 30 days
+    
+    template_id = canonical_key(template_id)
+    versions = await db.get_data_versions([
+        template_scope(template_id), measurements_scope(template_id, current_user.username)
+    ])
+    etag = make_etag(versions, template_id, current_user.username, bucket.value, start_date, end_date)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    series = await db.get_statistics_series(template_id, bucket, start_date, end_date, user_id=current_user.username)
+    if series is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    
+    set_etag(response, etag)
+    return series
\ No newline at end of file
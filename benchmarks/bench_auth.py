@@ -0,0 +1,46 @@
+"""
+Per-request cost of the authentication dependency with and without the token cache
+
+Usage:
+    python -m benchmarks.bench_auth --requests 20000
+"""
+import argparse
+import asyncio
+import time
+
+from api.auth import create_access_token, get_current_user, get_current_active_user, token_cache
+from benchmarks.common import print_table
+
+
+async def authenticate(token: str, requests: int, cached: bool) -> float:
+    """Resolve the current user requests times, returns microseconds per request."""
+    token_cache.clear()
+    start = time.perf_counter()
+    for _ in range(requests):
+        if not cached:
+            token_cache.clear()
+        await get_current_active_user(await get_current_user(token))
+    return (time.perf_counter() - start) * 1e6 / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the auth dependency overhead per request")
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    token = create_access_token(data={"sub": "admin"})
+    uncached = asyncio.run(authenticate(token, args.requests, cached=False))
+    cached = asyncio.run(authenticate(token, args.requests, cached=True))
+    token_cache.clear()
+
+    print_table(
+        ["mode", "us per request", "speedup"],
+        [
+            ["verify every request", f"{uncached:.1f}", "1.0x"],
+            ["token cache", f"{cached:.1f}", f"{uncached / cached:.1f}x"],
+        ]
+    )
+
+
+if __name__ == "__main__":
+    main()
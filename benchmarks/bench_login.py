@@ -0,0 +1,82 @@
+"""
+Login storm against POST /token with password checks on and off the event loop
+
+Sends concurrent logins through the ASGI app while a probe keeps requesting
+GET /, and reports login throughput and the longest gap between probe
+responses, i.e. how long other requests were stalled.
+The inline mode reproduces the old behaviour of verifying bcrypt hashes on
+the event loop.
+
+Usage:
+    python -m benchmarks.bench_login --logins 64 --concurrency 1 8 32
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+import api.main
+from api.auth import get_hashed_password
+from api.main import app
+from benchmarks.common import print_table
+
+
+async def run_inline(func, *args):
+    return func(*args)
+
+
+async def storm(logins: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    probe_latencies = []
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        async def login():
+            async with semaphore:
+                response = await client.post("/token", data={"username": "admin", "password": "password"})
+                assert response.status_code == 200
+
+        async def probe():
+            # A blocked event loop shows up as a long gap between probe responses
+            last = time.perf_counter()
+            while not done.is_set():
+                await asyncio.sleep(0.005)
+                await client.get("/")
+                now = time.perf_counter()
+                probe_latencies.append((now - last) * 1000)
+                last = now
+
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+
+    return logins / elapsed, max(probe_latencies, default=0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent logins")
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    # Hash the default user's password up front so every login costs one verification
+    get_hashed_password("admin")
+
+    rows = []
+    threadpool = api.main.run_in_threadpool
+    for mode, runner in (("inline", run_inline), ("threadpool", threadpool)):
+        api.main.run_in_threadpool = runner
+        for concurrency in args.concurrency:
+            throughput, probe_max = asyncio.run(storm(args.logins, concurrency))
+            rows.append([mode, concurrency, f"{throughput:.1f}", f"{probe_max:.1f}"])
+    api.main.run_in_threadpool = threadpool
+
+    print_table(["mode", "concurrency", "logins/s", "max GET / gap ms"], rows)
+
+
+if __name__ == "__main__":
+    main()
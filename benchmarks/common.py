@@ -0,0 +1,207 @@
+"""
+Shared helpers for the benchmark scripts
+
+Benchmarks run against BENCH_DATABASE_URL (a local SQLite file by default)
+and drop and recreate every table there, so never point them at a database
+holding real data.
+"""
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from db.database import Base
+from db.ingest import fold_values
+from db.partitions import create_partitions, forget_partitions, month_of, next_month
+from db.rollups import rebuild_rollups
+from db.models import Unit, ValueDefinition, MeasurementTemplate, Measurement, MeasurementValue, uses_wide_layout
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL", "sqlite:///./bench.db")
+
+# Rows per INSERT statement while seeding
+SEED_CHUNK_SIZE = 10000
+
+# Template name -> value definition names
+TEMPLATES = {
+    "Weight": ["weight"],
+    "Blood Pressure": ["systolic", "diastolic", "pulse"],
+}
+
+
+def make_engine(url: str = BENCH_DATABASE_URL) -> Engine:
+    return create_engine(url)
+
+
+def make_session(engine: Engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def reset_schema(engine: Engine, with_indexes: bool = True) -> None:
+    """Drop and recreate all tables, optionally without secondary indexes."""
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    # The dropped partitions have to be created again
+    forget_partitions()
+    if not with_indexes:
+        drop_indexes(engine)
+
+
+def drop_indexes(engine: Engine) -> None:
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(engine)
+
+
+def create_indexes(engine: Engine) -> None:
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine)
+    analyze(engine)
+
+
+def analyze(engine: Engine) -> None:
+    with engine.begin() as connection:
+        connection.execute(text("ANALYZE"))
+
+
+def seed_templates(engine: Engine) -> Dict[str, Dict[str, str]]:
+    """Create the benchmark templates, returns template id -> {definition name: id}."""
+    templates = {}
+    with engine.begin() as connection:
+        unit_id = str(uuid.uuid4())
+        connection.execute(insert(Unit), [{"id": unit_id, "name": "unit", "display_name": "Unit"}])
+        for name, definition_names in TEMPLATES.items():
+            template_id = str(uuid.uuid4())
+            connection.execute(insert(MeasurementTemplate), [{
+                "id": template_id, "name": name, "created_at": datetime.utcnow(), "is_active": True
+            }])
+            definitions = {definition_name: str(uuid.uuid4()) for definition_name in definition_names}
+            connection.execute(insert(ValueDefinition), [
+                {
+                    "id": definition_id,
+                    "name": definition_name,
+                    "display_name": definition_name,
+                    "unit_id": unit_id,
+                    "template_id": template_id,
+                }
+                for definition_name, definition_id in definitions.items()
+            ])
+            templates[template_id] = definitions
+    return templates
+
+
+def make_measurement_rows(
+    rng: random.Random,
+    templates: Dict[str, Dict[str, str]],
+    count: int,
+    users: Sequence[str] = ("bench-user",),
+    days: int = 730
+) -> Tuple[List[dict], List[dict]]:
+    """Generate count random measurement rows and their value rows."""
+    template_ids = list(templates)
+    now = datetime.utcnow()
+    measurement_rows = []
+    value_rows = []
+    for _ in range(count):
+        measurement_id = str(uuid.uuid4())
+        template_id = rng.choice(template_ids)
+        measured_at = now - timedelta(seconds=rng.randrange(days * 86400))
+        measurement_rows.append({
+            "id": measurement_id,
+            "template_id": template_id,
+            "measured_at": measured_at,
+            "recorded_at": measured_at,
+            "notes": None,
+            "user_id": rng.choice(users),
+        })
+        for definition_id in templates[template_id].values():
+            value_rows.append({
+                "id": str(uuid.uuid4()),
+                "definition_id": definition_id,
+                "measurement_id": measurement_id,
+                "measured_at": measured_at,
+                "value": rng.uniform(50, 150),
+            })
+    return measurement_rows, value_rows
+
+
+def seed_measurements(
+    engine: Engine,
+    templates: Dict[str, Dict[str, str]],
+    count: int,
+    users: Sequence[str] = ("bench-user",),
+    days: int = 730,
+    progress: bool = True
+) -> List[str]:
+    """Insert count measurements spread over the last days, returns their ids."""
+    rng = random.Random(42)
+    measurement_ids = []
+
+    with engine.begin() as connection:
+        # Seeded rows bypass the ingestion path, so create their partitions up front
+        now = datetime.utcnow()
+        months = [month_of(now - timedelta(days=days))]
+        while months[-1] < month_of(now):
+            months.append(next_month(months[-1]))
+        create_partitions(connection, months)
+
+        for start in range(0, count, SEED_CHUNK_SIZE):
+            measurement_rows, value_rows = make_measurement_rows(
+                rng, templates, min(SEED_CHUNK_SIZE, count - start), users, days
+            )
+            measurement_ids.extend(row["id"] for row in measurement_rows)
+            if uses_wide_layout():
+                fold_values(measurement_rows, value_rows)
+            connection.execute(insert(Measurement), measurement_rows)
+            if not uses_wide_layout():
+                connection.execute(insert(MeasurementValue), value_rows)
+            if progress:
+                print(f"  seeded {start + len(measurement_rows):,}/{count:,} measurements", flush=True)
+        rebuild_rollups(Session(bind=connection))
+    return measurement_ids
+
+
+def run_in_subprocess(module: str, args: List[str], env: Dict[str, str]) -> dict:
+    """Run a benchmark module with extra environment variables, returns the JSON on its last output line.
+
+    Settings that shape the schema are read at import, so comparing them
+    needs a fresh interpreter per setting.
+    """
+    output = subprocess.run(
+        [sys.executable, "-m", module, *args],
+        env=dict(os.environ, **env), check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def time_call(fn: Callable[[], object], repeat: int = 20) -> Dict[str, float]:
+    """Run fn repeat times and return median and p95 latency in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "median_ms": statistics.median(timings),
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+    }
+
+
+def print_table(headers: List[str], rows: List[List[object]]) -> None:
+    cells = [[str(cell) for cell in row] for row in [headers] + rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(headers))]
+    for i, row in enumerate(cells):
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+        if i == 0:
+            print("  ".join("-" * width for width in widths))
@@ -0,0 +1,165 @@
+"""
+Streaming downsampling of value series for charts
+
+A SeriesSampler takes the (measured_at, value) points of one value
+definition in chronological order and keeps at most `points` of them, so a
+chart never receives more points than it has pixels. Windows with no more
+readings than that are returned unchanged. Larger ones are reduced over
+equal time slices of the window as the rows stream by:
+
+- lttb: Largest-Triangle-Three-Buckets keeps the first and last point and,
+  per slice, the point spanning the largest triangle with the previously
+  kept point and the average of the next slice. Holds two slices at a time.
+- minmax: keeps the lowest and highest point per slice, so spikes always
+  survive. Holds one point pair at a time.
+"""
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from models.measurement import SeriesMethod
+
+# (measured_at, value)
+Point = Tuple[datetime, float]
+
+
+class _Slices:
+    """Maps a timestamp to one of count equal slices of [start, end]."""
+
+    def __init__(self, start: datetime, end: datetime, count: int):
+        self.start = start
+        self.count = count
+        self.span = (end - start).total_seconds()
+
+    def offset(self, measured_at: datetime) -> float:
+        return (measured_at - self.start).total_seconds()
+
+    def index(self, measured_at: datetime) -> int:
+        if self.span <= 0:
+            return 0
+        return min(max(int(self.offset(measured_at) * self.count / self.span), 0), self.count - 1)
+
+
+class LttbSampler:
+    """Largest-Triangle-Three-Buckets over points - 2 time slices."""
+
+    def __init__(self, start: datetime, end: datetime, points: int):
+        self.slices = _Slices(start, end, max(points - 2, 1))
+        self.result: List[Point] = []
+        # A closed slice waiting for the average of the next one
+        self.pending: List[Point] = []
+        self.current: List[Point] = []
+        self.current_index: Optional[int] = None
+
+    def add(self, measured_at: datetime, value: float) -> None:
+        if not self.result:
+            self.result.append((measured_at, value))
+            return
+        index = self.slices.index(measured_at)
+        if index != self.current_index and self.current:
+            self._close()
+        self.current_index = index
+        self.current.append((measured_at, value))
+
+    def finish(self) -> List[Point]:
+        if not self.current and not self.pending:
+            return self.result
+        last = (self.current or self.pending).pop()
+        if self.current:
+            self._close()
+        if self.pending:
+            self._select(self.pending, self.slices.offset(last[0]), last[1])
+        self.result.append(last)
+        return self.result
+
+    def _close(self) -> None:
+        if self.pending:
+            count = len(self.current)
+            self._select(
+                self.pending,
+                sum(self.slices.offset(measured_at) for measured_at, _ in self.current) / count,
+                sum(value for _, value in self.current) / count
+            )
+        self.pending = self.current
+        self.current = []
+
+    def _select(self, candidates: List[Point], next_x: float, next_y: float) -> None:
+        previous_at, previous_y = self.result[-1]
+        previous_x = self.slices.offset(previous_at)
+
+        def area(point: Point) -> float:
+            x = self.slices.offset(point[0])
+            return abs((previous_x - next_x) * (point[1] - previous_y) - (previous_x - x) * (next_y - previous_y))
+
+        self.result.append(max(candidates, key=area))
+
+
+class MinMaxSampler:
+    """Lowest and highest point of each of points // 2 time slices, in time order."""
+
+    def __init__(self, start: datetime, end: datetime, points: int):
+        self.slices = _Slices(start, end, max(points // 2, 1))
+        self.result: List[Point] = []
+        self.current_index: Optional[int] = None
+        self.low: Optional[Point] = None
+        self.high: Optional[Point] = None
+
+    def add(self, measured_at: datetime, value: float) -> None:
+        index = self.slices.index(measured_at)
+        if index != self.current_index:
+            self._flush()
+            self.current_index = index
+            self.low = self.high = (measured_at, value)
+        elif value < self.low[1]:
+            self.low = (measured_at, value)
+        elif value > self.high[1]:
+            self.high = (measured_at, value)
+
+    def finish(self) -> List[Point]:
+        self._flush()
+        return self.result
+
+    def _flush(self) -> None:
+        if self.low is None:
+            return
+        if self.low is self.high:
+            self.result.append(self.low)
+        else:
+            self.result.extend(sorted((self.low, self.high), key=lambda point: point[0]))
+        self.low = self.high = None
+
+
+SAMPLERS = {
+    SeriesMethod.lttb: LttbSampler,
+    SeriesMethod.minmax: MinMaxSampler,
+}
+
+
+class SeriesSampler:
+    """At most `points` points of a chronological series in [start, end].
+
+    Points are buffered until there are more than `points` of them, then
+    replayed into the sampler of `method`, so memory stays bounded by
+    `points` plus what the sampler holds.
+    """
+
+    def __init__(self, method: SeriesMethod, start: datetime, end: datetime, points: int):
+        self.method = method
+        self.start = start
+        self.end = end
+        self.points = points
+        self.raw: Optional[List[Point]] = []
+        self.sampler = None
+
+    def add(self, measured_at: datetime, value: float) -> None:
+        if self.sampler is not None:
+            self.sampler.add(measured_at, value)
+            return
+        self.raw.append((measured_at, value))
+        if len(self.raw) > self.points:
+            self.sampler = SAMPLERS[self.method](self.start, self.end, self.points)
+            for point in self.raw:
+                self.sampler.add(*point)
+            self.raw = None
+
+    def finish(self) -> List[Point]:
+        return self.raw if self.sampler is None else self.sampler.finish()
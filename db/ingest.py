@@ -0,0 +1,152 @@
+"""
+Bulk row writers for measurements and their values
+
+Rows are plain dicts with pre-generated ids and resolved definition ids.
+In the wide value layout the value rows are folded into their measurement
+rows, and only measurements are written. On PostgreSQL they are streamed with COPY FROM STDIN: a CSV buffer through
+psycopg2, or asyncpg's binary copy_records_to_table when the session runs on
+the async engine. Other databases, such as SQLite in tests, use executemany
+INSERTs.
+"""
+import io
+import json
+import os
+from datetime import datetime
+from itertools import chain
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import Table, insert
+from sqlalchemy.orm import Session
+from sqlalchemy.util import await_only
+
+from db.models import Measurement, MeasurementValue, uses_wide_layout
+from db.stats_cache import normalize
+
+# auto: COPY where supported, otherwise INSERT; copy: require COPY; insert: always INSERT
+INGEST_BACKEND = os.getenv("INGEST_BACKEND", "auto")
+INGEST_BACKENDS = ("auto", "copy", "insert")
+
+COPY_DRIVERS = ("psycopg2", "asyncpg")
+
+
+def copy_supported(db: Session) -> bool:
+    dialect = db.get_bind().dialect
+    return dialect.name == "postgresql" and dialect.driver in COPY_DRIVERS
+
+
+def resolve_backend(db: Session, backend: Optional[str] = None) -> str:
+    """Return the backend used for the session's database, either copy or insert."""
+    backend = backend or INGEST_BACKEND
+    if backend not in INGEST_BACKENDS:
+        raise ValueError(f"Unknown ingest backend '{backend}', expected one of {INGEST_BACKENDS}")
+
+    if backend == "copy" and not copy_supported(db):
+        raise ValueError("COPY ingestion requires PostgreSQL with psycopg2 or asyncpg")
+    if backend == "auto":
+        return "copy" if copy_supported(db) else "insert"
+    return backend
+
+
+def fold_values(measurement_rows: List[Dict[str, Any]], value_rows: List[Dict[str, Any]]) -> None:
+    """Set definition_values of each measurement row from its value rows.
+
+    Value rows of measurements that are not in measurement_rows are ignored.
+    """
+    folded = {row["id"]: {} for row in measurement_rows}
+    for row in value_rows:
+        if row["measurement_id"] in folded:
+            folded[row["measurement_id"]][row["definition_id"]] = row["value"]
+    for row in measurement_rows:
+        row["definition_values"] = folded[row["id"]]
+
+
+def write_measurement_rows(
+    db: Session,
+    measurement_rows: List[Dict[str, Any]],
+    value_rows: List[Dict[str, Any]],
+    backend: Optional[str] = None
+) -> str:
+    """
+    Write new measurements and values in the session's transaction.
+
+    The partitions of their months must exist, see ensure_partitions.
+    Aware timestamps are converted to naive UTC in place: asyncpg rejects
+    them, and COPY into a timestamp column drops their offset. The caller
+    commits. Returns the backend that was used.
+    """
+    backend = resolve_backend(db, backend)
+    for row in chain(measurement_rows, value_rows):
+        for key in ("measured_at", "recorded_at"):
+            if key in row:
+                row[key] = normalize(row[key])
+    if uses_wide_layout():
+        fold_values(measurement_rows, value_rows)
+        value_rows = []
+    for table, rows in ((Measurement.__table__, measurement_rows), (MeasurementValue.__table__, value_rows)):
+        if not rows:
+            continue
+        if backend == "copy":
+            _copy_rows(db, table, rows)
+        else:
+            db.execute(insert(table), rows)
+    return backend
+
+
+def _copy_records(table: Table, rows: List[Dict[str, Any]]) -> List[tuple]:
+    # COPY bypasses column defaults, so fill in the client-side ones here
+    defaults = {
+        column.name: column.default.arg
+        for column in table.columns
+        if column.default is not None and column.default.is_callable
+    }
+    columns = [column.name for column in table.columns]
+    records = [
+        tuple(
+            row[name] if name in row else (defaults[name](None) if name in defaults else None)
+            for name in columns
+        )
+        for row in rows
+    ]
+    # Both drivers take JSON columns as text
+    return [
+        tuple(json.dumps(value) if isinstance(value, dict) else value for value in record)
+        for record in records
+    ]
+
+
+def _csv_field(value: Any) -> str:
+    # Unquoted empty fields are NULL, quoted ones are empty strings
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _copy_rows(db: Session, table: Table, rows: List[Dict[str, Any]]) -> None:
+    records = _copy_records(table, rows)
+    columns = [column.name for column in table.columns]
+    connection = db.connection()
+    driver_connection = connection.connection.driver_connection
+
+    if db.get_bind().dialect.driver == "asyncpg":
+        # The adapter begins its transaction with the first statement, COPY has to run inside it
+        if not driver_connection.is_in_transaction():
+            connection.exec_driver_sql("SELECT 1")
+        # Called through AsyncSession.run_sync, so the coroutine can be awaited inline
+        await_only(driver_connection.copy_records_to_table(table.name, records=records, columns=columns))
+        return
+
+    buffer = io.StringIO()
+    for record in records:
+        buffer.write(",".join(_csv_field(value) for value in record))
+        buffer.write("\n")
+    buffer.seek(0)
+    with driver_connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
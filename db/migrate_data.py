@@ -1,45 +1,229 @@
+import argparse
 import json
 import os
+import re
+import time
 from datetime import datetime
 import uuid
-from typing import List, Dict, Any
+from itertools import islice
+from typing import List, Dict, Any, Callable, Iterable, Iterator, NamedTuple, Optional, Set
 
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from db.database import SessionLocal, engine, Base
-from db.models import Unit, ValueDefinition, MeasurementTemplate, Measurement, MeasurementValue
+from db.models import Measurement, Unit, ValueDefinition, MeasurementTemplate
+from db.ingest import INGEST_BACKENDS, write_measurement_rows
+from db.partitions import ensure_partitions, lock_measurement_ids
+from db.rollups import add_to_rollups
+from db.stats_cache import statistics_cache
+from db.storage import ID_CHUNK_SIZE
+from db.versions import TEMPLATES, bump_versions, measurements_scope, template_scope
+
+# Measurements inserted and committed per transaction
+DEFAULT_CHUNK_SIZE = 5000
+
+# Characters read from an input file at a time while streaming records
+READ_SIZE = 64 * 1024
+
+# Files with these extensions hold one JSON record per line
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class MigrationProgress(NamedTuple):
+    """Running totals reported after each committed chunk."""
+    processed: int
+    inserted: int
+    skipped: int
+    elapsed: float
+    # Values without an active definition, and repeated values of one definition in a record
+    dropped_values: int = 0
+
+    @property
+    def rate(self) -> float:
+        return self.processed / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def print_progress(progress: MigrationProgress) -> None:
+    print(
+        f"Migrated {progress.processed:,} measurements "
+        f"({progress.inserted:,} inserted, {progress.skipped:,} skipped, "
+        f"{progress.dropped_values:,} values dropped, {progress.rate:,.0f}/s)"
+    )
+
 
 def load_json_file(file_path: str) -> List[Dict[str, Any]]:
     """Load data from a JSON file."""
     if not os.path.exists(file_path):
         return []
-        
+
     with open(file_path, 'r') as f:
         return json.load(f)
 
+def _iter_json_array(f, read_size: int) -> Iterator[Any]:
+    """Decode the elements of a top-level JSON array one at a time."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def skip_whitespace() -> str:
+        # Returns the next significant character, reading more input as needed
+        nonlocal buffer, pos, eof
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer) or eof:
+                return buffer[pos:pos + 1]
+            data = f.read(read_size)
+            eof = not data
+            buffer = buffer[pos:] + data
+            pos = 0
+
+    if skip_whitespace() != "[":
+        raise json.JSONDecodeError("Expecting '['", buffer, pos)
+    pos += 1
+    if skip_whitespace() == "]":
+        return
+
+    while True:
+        skip_whitespace()
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+            # A number cut off by the read boundary also decodes, so the value
+            # only counts once the following delimiter has been read
+            complete = eof or buffer[_WHITESPACE.match(buffer, end).end():][:1] in (",", "]")
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+        if not complete:
+            data = f.read(read_size)
+            eof = not data
+            buffer = buffer[pos:] + data
+            pos = 0
+            continue
+
+        yield item
+        pos = end
+        delimiter = skip_whitespace()
+        if delimiter == "]":
+            return
+        if delimiter != ",":
+            raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+        pos += 1
+
+        # Drop consumed input so the buffer stays around one read in size
+        if pos > read_size:
+            buffer = buffer[pos:]
+            pos = 0
+
+def iter_json_records(file_path: str, read_size: int = READ_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the records of a JSON array or NDJSON file one at a time.
+
+    NDJSON is used for .ndjson/.jsonl files and for files that do not start
+    with '['. Memory use is bounded by the read size and the largest single
+    record, not by the size of the file. A missing file yields nothing.
+    """
+    if not os.path.exists(file_path):
+        return
+
+    with open(file_path, 'r') as f:
+        head = f.read(read_size)
+        is_array = head.lstrip()[:1] == "[" and not file_path.endswith(NDJSON_EXTENSIONS)
+        f.seek(0)
+
+        if is_array:
+            yield from _iter_json_array(f, read_size)
+        else:
+            for line_number, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError as e:
+                        raise ValueError(f"{file_path}:{line_number}: {e}") from e
+
+def find_data_file(data_dir: str, name: str) -> str:
+    """Return the NDJSON file for name if present, otherwise the JSON array file."""
+    for extension in NDJSON_EXTENSIONS:
+        path = os.path.join(data_dir, f"{name}{extension}")
+        if os.path.exists(path):
+            return path
+    return os.path.join(data_dir, f"{name}.json")
+
+def read_checkpoint(checkpoint_path: Optional[str]) -> int:
+    """Return the number of measurements already committed by a previous run."""
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return 0
+
+    with open(checkpoint_path, 'r') as f:
+        return json.load(f).get('processed', 0)
+
+def write_checkpoint(checkpoint_path: Optional[str], processed: int) -> None:
+    """Record the number of committed measurements, replacing the file atomically."""
+    if not checkpoint_path:
+        return
+
+    temp_path = f"{checkpoint_path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump({'processed': processed, 'updated_at': datetime.utcnow().isoformat()}, f)
+    os.replace(temp_path, checkpoint_path)
+
+def _parse_datetime(value: Any) -> datetime:
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value if value is not None else datetime.utcnow()
+
+def _chunks(items: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _existing_measurement_ids(db: Session, measurement_ids: List[str]) -> Set[str]:
+    """Return the ids that are already stored, locked until the chunk commits."""
+    lock_measurement_ids(db, measurement_ids)
+    existing_ids = set()
+    for start in range(0, len(measurement_ids), ID_CHUNK_SIZE):
+        existing_ids.update(db.scalars(
+            select(Measurement.id).where(Measurement.id.in_(measurement_ids[start:start + ID_CHUNK_SIZE]))
+        ))
+    return existing_ids
+
 def migrate_templates(templates_data: List[Dict[str, Any]], db: Session) -> None:
     """Migrate template data from JSON to PostgreSQL."""
+    # Templates from an earlier, interrupted run are kept as they are
+    existing_ids = set(db.scalars(select(MeasurementTemplate.id)))
+    units = {unit.name: unit for unit in db.query(Unit)}
+    migrated_ids = []
+
     for template_data in templates_data:
+        if template_data.get('id') in existing_ids:
+            continue
+
         # Create template
         template = MeasurementTemplate(
             id=template_data.get('id', str(uuid.uuid4())),
             name=template_data.get('name', ''),
             description=template_data.get('description'),
-            created_at=datetime.fromisoformat(template_data.get('created_at')) if isinstance(template_data.get('created_at'), str) else template_data.get('created_at', datetime.utcnow()),
+            created_at=_parse_datetime(template_data.get('created_at')),
             updated_at=datetime.fromisoformat(template_data.get('updated_at')) if isinstance(template_data.get('updated_at'), str) else template_data.get('updated_at'),
             is_active=template_data.get('is_active', True),
             owner_id=template_data.get('owner_id')
         )
-        
+
         db.add(template)
-        db.flush()  # Get the ID
-        
+
         # Create value definitions and units
         for value_def_data in template_data.get('value_definitions', []):
             unit_data = value_def_data.get('unit', {})
-            
+
             # Look for existing unit
-            unit = db.query(Unit).filter(Unit.name == unit_data.get('name')).first()
-            
+            unit = units.get(unit_data.get('name', ''))
+
             if not unit:
                 unit = Unit(
                     name=unit_data.get('name', ''),
@@ -47,8 +231,8 @@ def migrate_templates(templates_data: List[Dict[str, Any]], db: Session) -> None
                     description=unit_data.get('description')
                 )
                 db.add(unit)
-                db.flush()
-            
+                units[unit.name] = unit
+
             # Create value definition
             value_def = ValueDefinition(
                 name=value_def_data.get('name', ''),
@@ -59,75 +243,169 @@ def migrate_templates(templates_data: List[Dict[str, Any]], db: Session) -> None
                 max_value=value_def_data.get('max_value'),
                 template_id=template.id
             )
-            
+
             db.add(value_def)
-    
+
+        migrated_ids.append(template.id)
+
+    bump_versions(db, [TEMPLATES] + [template_scope(template_id) for template_id in migrated_ids])
     db.commit()
+    for template_id in migrated_ids:
+        statistics_cache.invalidate(template_id)
 
-def migrate_measurements(measurements_data: List[Dict[str, Any]], db: Session) -> None:
-    """Migrate measurement data from JSON to PostgreSQL."""
-    for measurement_data in measurements_data:
-        # Create measurement
-        measurement = Measurement(
-            id=measurement_data.get('id', str(uuid.uuid4())),
-            template_id=measurement_data.get('template_id', ''),
-            measured_at=datetime.fromisoformat(measurement_data.get('measured_at')) if isinstance(measurement_data.get('measured_at'), str) else measurement_data.get('measured_at', datetime.utcnow()),
-            recorded_at=datetime.fromisoformat(measurement_data.get('recorded_at')) if isinstance(measurement_data.get('recorded_at'), str) else measurement_data.get('recorded_at', datetime.utcnow()),
-            notes=measurement_data.get('notes'),
-            user_id=measurement_data.get('user_id', '')
-        )
-        
-        db.add(measurement)
-        db.flush()  # Get the ID
-        
-        # Create measurement values
-        for value_data in measurement_data.get('values', []):
-            # Find value definition
-            value_def = db.query(ValueDefinition).filter(
-                ValueDefinition.name == value_data.get('definition_name'),
-                ValueDefinition.template_id == measurement.template_id
-            ).first()
-            
-            if value_def:
-                # Create measurement value
-                value = MeasurementValue(
-                    definition_id=value_def.id,
-                    measurement_id=measurement.id,
-                    value=value_data.get('value', 0.0)
+def migrate_measurements(
+    measurements_data: Iterable[Dict[str, Any]],
+    db: Session,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    checkpoint_path: Optional[str] = None,
+    progress: Optional[Callable[[MigrationProgress], None]] = None,
+    backend: Optional[str] = None
+) -> MigrationProgress:
+    """
+    Migrate measurement data from JSON to PostgreSQL in chunks.
+
+    Each chunk is written with COPY on PostgreSQL, or multi-row inserts
+    elsewhere (see db.ingest), and committed on its own,
+    after which the number of processed measurements is stored at
+    checkpoint_path. A rerun skips that many input records, and measurements
+    whose id already exists are skipped rather than inserted twice.
+    Values are only kept for active definitions, and only the first value
+    of a definition within one record; the others are counted as dropped.
+    """
+    # Active definition ids per template, each template is queried once
+    definitions: Dict[str, Dict[str, str]] = {}
+
+    def get_definitions(template_id: str) -> Dict[str, str]:
+        if template_id not in definitions:
+            definitions[template_id] = dict(db.execute(
+                select(ValueDefinition.name, ValueDefinition.id).where(
+                    ValueDefinition.template_id == template_id,
+                    ValueDefinition.is_active == True
                 )
-                
-                db.add(value)
-    
-    db.commit()
+            ).all())
+        return definitions[template_id]
+
+    resumed = read_checkpoint(checkpoint_path)
+    processed = resumed
+    inserted = 0
+    skipped = 0
+    dropped_values = 0
+    start = time.perf_counter()
+
+    for chunk in _chunks(islice(measurements_data, resumed, None), chunk_size):
+        for measurement_data in chunk:
+            if not measurement_data.get('id'):
+                measurement_data['id'] = str(uuid.uuid4())
+            measurement_data['measured_at'] = _parse_datetime(measurement_data.get('measured_at'))
+        # Before the chunk's transaction touches the partitioned tables
+        ensure_partitions(db, [m['measured_at'] for m in chunk])
+        existing_ids = _existing_measurement_ids(db, [m['id'] for m in chunk])
 
-def migrate_data(data_dir: str = "./data") -> None:
+        measurement_rows = []
+        value_rows = []
+        for measurement_data in chunk:
+            if measurement_data['id'] in existing_ids:
+                skipped += 1
+                continue
+            # Repeated ids within the input are inserted once
+            existing_ids.add(measurement_data['id'])
+
+            template_id = measurement_data.get('template_id', '')
+            measurement_rows.append({
+                "id": measurement_data['id'],
+                "template_id": template_id,
+                "measured_at": measurement_data['measured_at'],
+                "recorded_at": _parse_datetime(measurement_data.get('recorded_at')),
+                "notes": measurement_data.get('notes'),
+                "user_id": measurement_data.get('user_id', ''),
+            })
+
+            template_definitions = get_definitions(template_id)
+            seen_definitions = set()
+            for value_data in measurement_data.get('values', []):
+                # One value per definition, a second one would violate the unique index of values
+                definition_id = template_definitions.get(value_data.get('definition_name'))
+                if not definition_id or definition_id in seen_definitions:
+                    dropped_values += 1
+                    continue
+                seen_definitions.add(definition_id)
+                value_rows.append({
+                    "id": str(uuid.uuid4()),
+                    "definition_id": definition_id,
+                    "measurement_id": measurement_data['id'],
+                    "measured_at": measurement_rows[-1]["measured_at"],
+                    "value": value_data.get('value', 0.0),
+                })
+
+        try:
+            write_measurement_rows(db, measurement_rows, value_rows, backend=backend)
+            add_to_rollups(db, measurement_rows, value_rows)
+            bump_versions(db, [measurements_scope(row["template_id"], row["user_id"]) for row in measurement_rows])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        for template_id, user_id in {(row["template_id"], row["user_id"]) for row in measurement_rows}:
+            statistics_cache.invalidate(template_id, [
+                row["measured_at"] for row in measurement_rows
+                if row["template_id"] == template_id and row["user_id"] == user_id
+            ], user_id)
+
+        processed += len(chunk)
+        inserted += len(measurement_rows)
+        write_checkpoint(checkpoint_path, processed)
+
+        if progress:
+            progress(MigrationProgress(processed, inserted, skipped, time.perf_counter() - start, dropped_values))
+
+    return MigrationProgress(processed, inserted, skipped, time.perf_counter() - start, dropped_values)
+
+def migrate_data(
+    data_dir: str = "./data",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    checkpoint_path: Optional[str] = None,
+    backend: Optional[str] = None
+) -> None:
     """Migrate all data from JSON files to PostgreSQL."""
     # Make sure the database tables exist
     Base.metadata.create_all(engine)
-    
-    templates_file = os.path.join(data_dir, "templates.json")
-    measurements_file = os.path.join(data_dir, "measurements.json")
-    
-    templates_data = load_json_file(templates_file)
-    measurements_data = load_json_file(measurements_file)
-    
+
+    templates_file = find_data_file(data_dir, "templates")
+    measurements_file = find_data_file(data_dir, "measurements")
+
+    # Templates are few and kept in memory, measurements are streamed
+    templates_data = list(iter_json_records(templates_file))
+    measurements_data = iter_json_records(measurements_file)
+
     # Start a database session
     db = SessionLocal()
-    
+
     try:
         # Migrate templates first (they are referenced by measurements)
         migrate_templates(templates_data, db)
-        
+
         # Then migrate measurements
-        migrate_measurements(measurements_data, db)
-        
+        result = migrate_measurements(
+            measurements_data, db, chunk_size=chunk_size,
+            checkpoint_path=checkpoint_path, progress=print_progress, backend=backend
+        )
+
         print(f"Migration completed successfully.")
-        print(f"Migrated {len(templates_data)} templates and {len(measurements_data)} measurements.")
+        print(f"Migrated {len(templates_data)} templates and {result.inserted} measurements in {result.elapsed:.1f}s.")
     except Exception as e:
         db.rollback()
         print(f"Error during migration: {e}")
+        if checkpoint_path:
+            print(f"Rerun with --checkpoint {checkpoint_path} to resume after the last committed chunk.")
     finally:
         db.close()
 
 if __name__ == "__main__":
-    migrate_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Migrate JSON file storage to the database")
+    parser.add_argument("--data-dir", default="./data")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--checkpoint", help="File recording committed progress, reused to resume a run")
+    parser.add_argument("--backend", choices=INGEST_BACKENDS, help="Row writer, defaults to INGEST_BACKEND")
+    args = parser.parse_args()
+
+    migrate_data(args.data_dir, chunk_size=args.chunk_size, checkpoint_path=args.checkpoint, backend=args.backend)
@@ -1,16 +1,72 @@
-from sqlalchemy import Column, String, Float, Boolean, DateTime, ForeignKey, JSON, Table
+from sqlalchemy import Column, String, Float, Integer, Boolean, Date, DateTime, ForeignKey, ForeignKeyConstraint, JSON, Table, Index, Uuid
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, true
+import os
 import uuid
 from datetime import datetime
 from typing import List
 
 from db.database import Base
 
+# Store ids as native UUIDs (16 bytes on Postgres) instead of strings; the
+# API keeps exchanging them as strings, but they have to be valid UUIDs
+DB_COMPACT_KEYS = os.getenv("DB_COMPACT_KEYS", "false").lower() in ("1", "true", "yes")
+
+# Column type of ids and of the foreign keys pointing at them
+KeyType = Uuid(as_uuid=False) if DB_COMPACT_KEYS else String
+
+
+def is_valid_key(value: str) -> bool:
+    """Whether value can be stored in a KeyType column."""
+    if not DB_COMPACT_KEYS:
+        return True
+    try:
+        uuid.UUID(value)
+    except (TypeError, ValueError, AttributeError):
+        return False
+    return True
+
+
+def canonical_key(value: str) -> str:
+    """The spelling of value as stored in a KeyType column.
+
+    Native UUID columns accept any spelling of a UUID but return it in
+    lowercase with dashes, so with compact keys ids are brought into that
+    form wherever they enter. Other values are returned unchanged.
+    """
+    if not DB_COMPACT_KEYS:
+        return value
+    try:
+        return str(uuid.UUID(value))
+    except (TypeError, ValueError, AttributeError):
+        return value
+
+
+# Where values are stored: eav keeps one measurement_values row per value,
+# wide keeps them in measurements.definition_values keyed by definition id
+VALUE_LAYOUTS = ("eav", "wide")
+DB_VALUE_LAYOUT = os.getenv("DB_VALUE_LAYOUT", "eav")
+if DB_VALUE_LAYOUT not in VALUE_LAYOUTS:
+    raise ValueError(f"Unknown value layout '{DB_VALUE_LAYOUT}', expected one of {VALUE_LAYOUTS}")
+
+
+def uses_wide_layout() -> bool:
+    return DB_VALUE_LAYOUT == "wide"
+
+
+def _unpartitioned(ddl, target, bind, **kwargs) -> bool:
+    # Postgres partitions measurements and values by measured_at, see db/partitions.py
+    return kwargs["dialect"].name != "postgresql"
+
+
 class Unit(Base):
     __tablename__ = "units"
+    __table_args__ = (
+        Index("ix_units_name", "name"),
+    )
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(KeyType, primary_key=True, default=lambda: str(uuid.uuid4()))
     name = Column(String, nullable=False)  # e.g., "kg", "mmHg", "bpm"
     display_name = Column(String, nullable=False)
     description = Column(String, nullable=True)
@@ -26,15 +82,20 @@ class Unit(Base):
 
 class ValueDefinition(Base):
     __tablename__ = "value_definitions"
+    __table_args__ = (
+        Index("ix_value_definitions_template_id", "template_id"),
+    )
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(KeyType, primary_key=True, default=lambda: str(uuid.uuid4()))
     name = Column(String, nullable=False)  # e.g., "weight", "systolic", "diastolic"
     display_name = Column(String, nullable=False)
     description = Column(String, nullable=True)
-    unit_id = Column(String, ForeignKey("units.id"), nullable=False)
+    unit_id = Column(KeyType, ForeignKey("units.id"), nullable=False)
     min_value = Column(Float, nullable=True)
     max_value = Column(Float, nullable=True)
-    template_id = Column(String, ForeignKey("measurement_templates.id"), nullable=False)
+    template_id = Column(KeyType, ForeignKey("measurement_templates.id"), nullable=False)
+    # Definitions removed from their template are kept for the values pointing at them
+    is_active = Column(Boolean, nullable=False, default=True, server_default=true())
     
     # Relationships
     unit = relationship("Unit", back_populates="value_definitions")
@@ -50,7 +111,7 @@ class ValueDefinition(Base):
 class MeasurementTemplate(Base):
     __tablename__ = "measurement_templates"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(KeyType, primary_key=True, default=lambda: str(uuid.uuid4()))
     name = Column(String, nullable=False)  # e.g., "Weight", "Blood Pressure"
     description = Column(String, nullable=True)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -70,10 +131,26 @@ class MeasurementTemplate(Base):
 
 class MeasurementValue(Base):
     __tablename__ = "measurement_values"
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["measurement_id", "measured_at"], ["measurements.id", "measurements.measured_at"]
+        ),
+        # One value per definition and measurement, the conflict target of value upserts
+        Index(
+            "ix_measurement_values_measurement_id_definition_id",
+            "measurement_id", "definition_id", "measured_at", unique=True
+        ),
+        Index("ix_measurement_values_definition_id", "definition_id"),
+        # The primary key includes the partition key, ids are unique on their own where possible
+        Index("ix_measurement_values_id", "id", unique=True).ddl_if(callable_=_unpartitioned),
+        {"postgresql_partition_by": "RANGE (measured_at)"},
+    )
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    definition_id = Column(String, ForeignKey("value_definitions.id"), nullable=False)
-    measurement_id = Column(String, ForeignKey("measurements.id"), nullable=False)
+    id = Column(KeyType, primary_key=True, default=lambda: str(uuid.uuid4()))
+    definition_id = Column(KeyType, ForeignKey("value_definitions.id"), nullable=False)
+    measurement_id = Column(KeyType, nullable=False)
+    # Copy of the measurement's measured_at, partitions values like their measurements
+    measured_at = Column(DateTime, primary_key=True)
     value = Column(Float, nullable=False)
     
     # Relationships
@@ -88,13 +165,29 @@ class MeasurementValue(Base):
 
 class Measurement(Base):
     __tablename__ = "measurements"
+    __table_args__ = (
+        # Serve template/window filters and the (measured_at, id) keyset ordering
+        Index("ix_measurements_template_id_measured_at_id", "template_id", "measured_at", "id"),
+        Index("ix_measurements_measured_at_id", "measured_at", "id"),
+        # The same for the queries of one user, which never scan other users' rows
+        Index("ix_measurements_user_id_template_id_measured_at_id", "user_id", "template_id", "measured_at", "id"),
+        Index("ix_measurements_user_id_measured_at_id", "user_id", "measured_at", "id"),
+        # Unique ids, on Postgres writers hold db.partitions.lock_measurement_ids instead
+        Index("ix_measurements_id", "id", unique=True).ddl_if(callable_=_unpartitioned),
+        # Monthly partitions on Postgres, see db/partitions.py
+        {"postgresql_partition_by": "RANGE (measured_at)"},
+    )
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    template_id = Column(String, ForeignKey("measurement_templates.id"), nullable=False)
-    measured_at = Column(DateTime, nullable=False)  # Real time when measurement was taken
+    # The partition key has to be part of the primary key. A partitioned table
+    # cannot have a unique index on id alone, so only other databases enforce it
+    id = Column(KeyType, primary_key=True, default=lambda: str(uuid.uuid4()))
+    template_id = Column(KeyType, ForeignKey("measurement_templates.id"), nullable=False)
+    measured_at = Column(DateTime, primary_key=True)  # Real time when measurement was taken
     recorded_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # Time when measurement was recorded
     notes = Column(String, nullable=True)
     user_id = Column(String, nullable=False)
+    # Definition id -> value in the wide layout, NULL in the eav layout
+    definition_values = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)
     
     # Relationships
     template = relationship("MeasurementTemplate", back_populates="measurements")
@@ -103,4 +196,33 @@ class Measurement(Base):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         if not self.id:
-            self.id = str(uuid.uuid4())
\ No newline at end of file
+            self.id = str(uuid.uuid4())
+
+
+class MeasurementDailyRollup(Base):
+    """Per-day aggregates of one value definition and user, maintained on every write."""
+    __tablename__ = "measurement_daily_rollups"
+    __table_args__ = (
+        Index("ix_measurement_daily_rollups_template_id_day", "template_id", "day"),
+        Index("ix_measurement_daily_rollups_user_id_template_id_day", "user_id", "template_id", "day"),
+    )
+    
+    definition_id = Column(KeyType, ForeignKey("value_definitions.id"), primary_key=True)
+    user_id = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)  # UTC day of measured_at
+    template_id = Column(KeyType, ForeignKey("measurement_templates.id"), nullable=False)
+    count = Column(Integer, nullable=False)
+    total = Column(Float, nullable=False)
+    total_sq = Column(Float, nullable=False)
+    minimum = Column(Float, nullable=False)
+    maximum = Column(Float, nullable=False)
+    # db.sketches.DDSketch of the values, NULL for rollups written before sketches were kept
+    sketch = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)
+
+
+class DataVersion(Base):
+    """Opaque version of a scope of data, replaced by every write to it (see db.versions)."""
+    __tablename__ = "data_versions"
+    
+    scope = Column(String, primary_key=True)
+    version = Column(String, nullable=False)
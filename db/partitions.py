@@ -0,0 +1,124 @@
+"""
+Monthly range partitions of measurements and measurement_values
+
+On PostgreSQL both tables are partitioned by RANGE (measured_at), with one
+partition per calendar month, e.g. measurements_y2024m01. Partitions are
+created a few months ahead on startup, and on demand in a short transaction
+of their own before rows for another month are written. Other databases use plain tables and every
+function here is a no-op for them.
+
+The primary keys of partitioned tables have to include measured_at, and
+Postgres cannot enforce a unique id across partitions. Writers that look
+up stored ids before inserting take lock_measurement_ids first, so two
+transactions cannot both insert the same id at different times.
+"""
+import threading
+from datetime import date, datetime
+from typing import Iterable, List, Set
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from db.stats_cache import normalize
+
+PARTITIONED_TABLES = ("measurements", "measurement_values")
+
+# Months created ahead of the current one on startup
+PARTITION_MONTHS_AHEAD = 3
+
+# Months whose partitions were committed by this process; creation itself is idempotent
+_known_months: Set[date] = set()
+_known_lock = threading.Lock()
+
+# How long ensure_partitions waits for the lock on the parent tables
+PARTITION_LOCK_TIMEOUT = "5s"
+
+# First key of the advisory locks on measurement ids, keeps them apart from other advisory locks
+MEASUREMENT_LOCK_SPACE = 0x6D656173
+
+
+def month_of(value: datetime) -> date:
+    return date(value.year, value.month, 1)
+
+
+def next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+
+def create_partitions(connection: Connection, months: Iterable[date]) -> None:
+    """Create the monthly partitions of both tables, skipping existing ones."""
+    if connection.dialect.name != "postgresql":
+        return
+
+    for month in sorted(set(months)):
+        for table in PARTITIONED_TABLES:
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+            ))
+
+
+def create_upcoming_partitions(connection: Connection, today: date = None) -> None:
+    """Create partitions for the current month and PARTITION_MONTHS_AHEAD months after it."""
+    months = [month_of(today or datetime.utcnow())]
+    for _ in range(PARTITION_MONTHS_AHEAD):
+        months.append(next_month(months[-1]))
+    create_partitions(connection, months)
+
+
+def ensure_partitions(db: Session, timestamps: Iterable[datetime]) -> None:
+    """Create missing partitions for rows measured at the given times.
+
+    The partitions are created and committed on a separate connection, in
+    a short transaction of their own: CREATE TABLE ... PARTITION OF takes an
+    ACCESS EXCLUSIVE lock on the parent table, which would block every reader
+    and writer of it until an ingest transaction commits. Call it before the
+    session reads or writes the partitioned tables, the lock would otherwise
+    wait on the session itself; PARTITION_LOCK_TIMEOUT turns that into an
+    error instead of a hang.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+
+    months = {month_of(normalize(timestamp)) for timestamp in timestamps}
+    with _known_lock:
+        months -= _known_months
+    if not months:
+        return
+
+    with db.get_bind().begin() as connection:
+        connection.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+        create_partitions(connection, months)
+    with _known_lock:
+        _known_months.update(months)
+
+
+def lock_measurement_ids(db: Session, measurement_ids: List[str]) -> None:
+    """Serialize writers of the same measurement ids until the transaction ends.
+
+    Takes a transaction-scoped advisory lock per id, in sorted order so that
+    concurrent batches cannot deadlock. Call it before looking up which ids
+    are stored, the lookup then sees every committed insert of those ids.
+    """
+    if not measurement_ids or db.get_bind().dialect.name != "postgresql":
+        return
+
+    db.execute(text(
+        "SELECT pg_advisory_xact_lock(:space, hashtext(id)) "
+        "FROM (SELECT DISTINCT unnest(:ids) AS id ORDER BY 1) AS ids"
+    ).bindparams(bindparam("ids", type_=postgresql.ARRAY(postgresql.TEXT))), {
+        "space": MEASUREMENT_LOCK_SPACE,
+        "ids": [str(measurement_id) for measurement_id in measurement_ids],
+    })
+
+
+def forget_partitions() -> None:
+    """Drop the cache of known months, e.g. after partitions were detached."""
+    with _known_lock:
+        _known_months.clear()
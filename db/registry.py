@@ -0,0 +1,82 @@
+import threading
+from typing import Callable, Dict, NamedTuple, Optional
+
+from models.measurement import MeasurementTemplate as MeasurementTemplateSchema
+
+
+class DefinitionInfo(NamedTuple):
+    id: str
+    unit: str
+
+
+class TemplateEntry(NamedTuple):
+    schema: MeasurementTemplateSchema
+    definitions: Dict[str, DefinitionInfo]  # value definition name -> id and unit name
+
+
+class TemplateRegistry:
+    """In-process cache of active templates and their value definitions.
+
+    Templates are loaded on first use and kept until Database.create_template
+    invalidates them. Each template has a generation counter so that a load
+    racing with an invalidation never stores the stale result. The cache is
+    per process; other workers pick up template edits after their own
+    create_template call or a restart.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, TemplateEntry] = {}
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_or_load(
+        self,
+        template_id: str,
+        loader: Callable[[str], Optional[TemplateEntry]]
+    ) -> Optional[TemplateEntry]:
+        with self._lock:
+            entry = self._entries.get(template_id)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            generation = self._generations.get(template_id, 0)
+
+        entry = loader(template_id)
+
+        # Missing templates are not cached, they may be created later
+        if entry is not None:
+            with self._lock:
+                if self._generations.get(template_id, 0) == generation:
+                    self._entries[template_id] = entry
+        return entry
+
+    def invalidate(self, template_id: str) -> None:
+        with self._lock:
+            self._entries.pop(template_id, None)
+            self._generations[template_id] = self._generations.get(template_id, 0) + 1
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+# Process-wide registry shared by all Database instances
+template_registry = TemplateRegistry()
@@ -0,0 +1,292 @@
+"""
+Daily rollups of measurement values
+
+measurement_daily_rollups holds count, sum, sum of squares, min and max per
+value definition, user and UTC day. New values are merged in with an upsert, while
+days touched by replaced measurements are recomputed from the raw values,
+since min and max cannot be taken back out of an aggregate. Each rollup also
+keeps a quantile sketch of its values (see db.sketches), merged in Python
+while the upsert holds the row.
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import Date, Float, and_, bindparam, cast, delete, func, or_, select, true, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from db.models import Measurement, MeasurementValue, MeasurementDailyRollup, uses_wide_layout
+from db.sketches import DDSketch
+from db.stats_cache import normalize
+
+# (template_id, day)
+RollupKey = Tuple[str, date]
+
+# Days recomputed per statement, keeps the OR lists below the bound parameter limits
+REFRESH_CHUNK_SIZE = 200
+
+
+def day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min)
+
+
+def split_window(
+    start_date: Optional[datetime],
+    end_date: Optional[datetime]
+) -> Tuple[Optional[Tuple[Optional[date], Optional[date]]], List[Tuple[Optional[datetime], Optional[datetime], bool]]]:
+    """Split the window start_date <= measured_at <= end_date into full and partial days.
+
+    Returns the full days as (first, stop) with first <= day < stop, either
+    bound None for open windows, or None if the window covers no full day.
+    The partial days at the edges are returned as (lower, upper, inclusive)
+    ranges with lower <= measured_at < upper, or <= upper if inclusive.
+    Aware bounds are converted to naive UTC, like measured_at in the database.
+    """
+    start_date, end_date = normalize(start_date), normalize(end_date)
+    first = None
+    if start_date is not None:
+        first = start_date.date() if start_date.time() == time.min else start_date.date() + timedelta(days=1)
+    stop = end_date.date() if end_date is not None else None
+
+    if first is not None and stop is not None and first >= stop:
+        return None, [(start_date, end_date, True)]
+
+    edges = []
+    if start_date is not None and start_date < day_start(first):
+        edges.append((start_date, day_start(first), False))
+    if end_date is not None:
+        edges.append((day_start(stop), end_date, True))
+    return (first, stop), edges
+
+
+def day_of(db: Session, column):
+    """SQL expression for the UTC day of a timestamp column."""
+    if db.get_bind().dialect.name == "postgresql":
+        return cast(column, Date)
+    return func.date(column)
+
+
+def wide_entries(db: Session):
+    """Table-valued (key, value) rows of measurements.definition_values, as text.
+
+    Join it to measurements ON true, the function reads the joined row.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return func.jsonb_each_text(Measurement.definition_values).table_valued("key", "value")
+    return func.json_each(Measurement.definition_values).table_valued("key", "value")
+
+
+def _as_date(value: Any) -> date:
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _upsert(db: Session, rows: List[Dict[str, Any]]) -> List[Tuple[Any, str, Any, int, Optional[Dict[str, Any]]]]:
+    """Merge rows into the rollups, returns (definition_id, user_id, day, count, sketch) as stored."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(MeasurementDailyRollup)
+        smaller, larger = func.least, func.greatest
+    else:
+        # SQLite's two-argument min() and max() are scalar functions
+        statement = sqlite.insert(MeasurementDailyRollup)
+        smaller, larger = func.min, func.max
+
+    table = MeasurementDailyRollup.__table__
+    excluded = statement.excluded
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.definition_id, table.c.user_id, table.c.day],
+        set_={
+            "count": table.c.count + excluded.count,
+            "total": table.c.total + excluded.total,
+            "total_sq": table.c.total_sq + excluded.total_sq,
+            "minimum": smaller(table.c.minimum, excluded.minimum),
+            "maximum": larger(table.c.maximum, excluded.maximum),
+        }
+    ).returning(table.c.definition_id, table.c.user_id, table.c.day, table.c.count, table.c.sketch)
+    return db.execute(statement, rows).all()
+
+
+def add_to_rollups(
+    db: Session,
+    measurement_rows: Iterable[Dict[str, Any]],
+    value_rows: Iterable[Dict[str, Any]]
+) -> None:
+    """Merge newly inserted values into the daily rollups.
+
+    Takes the row dicts written for measurements and measurement_values.
+    Values of measurements that are not in measurement_rows are ignored,
+    replaced measurements are handled by refresh_rollups. Days are UTC days,
+    also for rows with an aware measured_at.
+    """
+    measurements = {
+        row["id"]: (row["template_id"], row["user_id"], normalize(row["measured_at"]).date())
+        for row in measurement_rows
+    }
+
+    aggregates: Dict[Tuple[str, str, date], Dict[str, Any]] = {}
+    sketches: Dict[Tuple[str, str, date], DDSketch] = {}
+    for row in value_rows:
+        if row["measurement_id"] not in measurements:
+            continue
+        template_id, user_id, day = measurements[row["measurement_id"]]
+        value = row["value"]
+        aggregate = aggregates.get((row["definition_id"], user_id, day))
+        if aggregate is None:
+            aggregates[(row["definition_id"], user_id, day)] = {
+                "definition_id": row["definition_id"],
+                "user_id": user_id,
+                "day": day,
+                "template_id": template_id,
+                "count": 1,
+                "total": value,
+                "total_sq": value * value,
+                "minimum": value,
+                "maximum": value,
+            }
+        else:
+            aggregate["count"] += 1
+            aggregate["total"] += value
+            aggregate["total_sq"] += value * value
+            aggregate["minimum"] = min(aggregate["minimum"], value)
+            aggregate["maximum"] = max(aggregate["maximum"], value)
+        sketches.setdefault((row["definition_id"], user_id, day), DDSketch()).add(value)
+
+    if aggregates:
+        # New rollups are inserted with the sketch of this batch, existing ones merge it below
+        for key, aggregate in aggregates.items():
+            aggregate["sketch"] = sketches[key].to_dict()
+        stored = _upsert(db, list(aggregates.values()))
+        _merge_sketches(db, aggregates, sketches, stored)
+
+
+def _merge_sketches(
+    db: Session,
+    aggregates: Dict[Tuple[str, str, date], Dict[str, Any]],
+    sketches: Dict[Tuple[str, str, date], DDSketch],
+    stored: Iterable[Tuple[Any, str, Any, int, Optional[Dict[str, Any]]]]
+) -> None:
+    """Merge the sketches of a batch into the rollups that existed before its upsert.
+
+    Takes the rows returned by the upsert, which locks them until commit, so
+    writing back their sketches cannot race with another write. A rollup
+    whose count is the batch's own was inserted by it and already has the
+    right sketch; one without a sketch stays without, its earlier values are
+    unknown.
+    """
+    table = MeasurementDailyRollup.__table__
+    merged = []
+    for definition_id, user_id, day, count, stored_sketch in stored:
+        key = (definition_id, user_id, _as_date(day))
+        if key not in aggregates or count == aggregates[key]["count"] or stored_sketch is None:
+            continue
+        sketch = DDSketch.from_dict(stored_sketch)
+        sketch.merge(sketches[key])
+        merged.append({
+            "b_definition_id": definition_id, "b_user_id": user_id, "b_day": key[2], "b_sketch": sketch.to_dict()
+        })
+
+    if merged:
+        db.execute(
+            update(table).where(
+                table.c.definition_id == bindparam("b_definition_id"),
+                table.c.user_id == bindparam("b_user_id"),
+                table.c.day == bindparam("b_day")
+            ).values(sketch=bindparam("b_sketch")),
+            merged
+        )
+
+
+def _raw_values(db: Session):
+    """(definition_id, value) columns of the raw values and a function selecting them from their measurements."""
+    if uses_wide_layout():
+        entries = wide_entries(db)
+        return entries.c.key, cast(entries.c.value, Float), lambda query: query.select_from(Measurement).join(entries, true())
+
+    def select_from(query):
+        return query.select_from(MeasurementValue).join(
+            Measurement, and_(
+                Measurement.id == MeasurementValue.measurement_id,
+                Measurement.measured_at == MeasurementValue.measured_at
+            )
+        )
+    return MeasurementValue.definition_id, MeasurementValue.value, select_from
+
+
+def _recompute(db: Session, condition) -> List[Dict[str, Any]]:
+    day = day_of(db, Measurement.measured_at)
+    definition_id, value, select_from = _raw_values(db)
+
+    query = select_from(select(
+        definition_id,
+        Measurement.user_id,
+        day,
+        Measurement.template_id,
+        func.count(value),
+        func.sum(value),
+        func.sum(value * value),
+        func.min(value),
+        func.max(value),
+    ).where(condition).group_by(definition_id, Measurement.user_id, day, Measurement.template_id))
+
+    # Sketches cannot be aggregated in SQL, they are built from the values in a second pass
+    sketches: Dict[Tuple[Any, str, date], DDSketch] = {}
+    for row_definition_id, user_id, row_day, row_value in db.execute(
+        select_from(select(definition_id, Measurement.user_id, day, value).where(condition))
+    ):
+        if row_value is not None:
+            sketches.setdefault((row_definition_id, user_id, _as_date(row_day)), DDSketch()).add(row_value)
+
+    return [
+        {
+            "definition_id": definition_id,
+            "user_id": user_id,
+            "day": _as_date(row_day),
+            "template_id": template_id,
+            "count": count,
+            "total": total,
+            "total_sq": total_sq,
+            "minimum": minimum,
+            "maximum": maximum,
+            "sketch": sketches.get((definition_id, user_id, _as_date(row_day)), DDSketch()).to_dict(),
+        }
+        for definition_id, user_id, row_day, template_id, count, total, total_sq, minimum, maximum in db.execute(query)
+    ]
+
+
+def refresh_rollups(db: Session, keys: Set[RollupKey]) -> None:
+    """Recompute the rollups of the given (template_id, day) pairs, for all users, from the raw values.
+
+    Pending changes must be flushed first.
+    """
+    keys = sorted(keys)
+    for start in range(0, len(keys), REFRESH_CHUNK_SIZE):
+        chunk = keys[start:start + REFRESH_CHUNK_SIZE]
+        db.execute(delete(MeasurementDailyRollup).where(or_(*(
+            and_(MeasurementDailyRollup.template_id == template_id, MeasurementDailyRollup.day == day)
+            for template_id, day in chunk
+        ))))
+
+        rows = _recompute(db, or_(*(
+            and_(
+                Measurement.template_id == template_id,
+                Measurement.measured_at >= day_start(day),
+                Measurement.measured_at < day_start(day + timedelta(days=1))
+            )
+            for template_id, day in chunk
+        )))
+        if rows:
+            db.execute(MeasurementDailyRollup.__table__.insert(), rows)
+
+
+def rebuild_rollups(db: Session, template_id: Optional[str] = None) -> None:
+    """Recompute all rollups, or those of one template, from the raw values."""
+    statement = delete(MeasurementDailyRollup)
+    condition = Measurement.template_id.is_not(None)
+    if template_id is not None:
+        statement = statement.where(MeasurementDailyRollup.template_id == template_id)
+        condition = Measurement.template_id == template_id
+    db.execute(statement)
+
+    rows = _recompute(db, condition)
+    if rows:
+        db.execute(MeasurementDailyRollup.__table__.insert(), rows)
@@ -0,0 +1,139 @@
+"""
+Mergeable quantile sketches of measurement values
+
+A DDSketch counts values in logarithmic bins: bin i holds the values in
+(gamma^(i-1), gamma^i] with gamma = (1 + a) / (1 - a), mirrored for negative
+values, and values within MIN_INDEXABLE of zero are counted apart. Two
+sketches merge by adding their bin counts, so the sketches of the daily
+rollups add up to the sketch of a whole window, exactly as if it had been
+built from the window's raw values.
+
+Error bounds: quantile(q) estimates the value of rank floor(q * (n - 1))
+among the n values (0 being the lowest) with a relative error of at most
+RELATIVE_ACCURACY, 1%, and values within MIN_INDEXABLE of zero are reported
+as 0. A sketch keeps at most MAX_BINS bins, which at 1% covers about 18
+orders of magnitude per sign; beyond that the lowest bins are folded
+together, and only quantiles that fall into those lowest bins lose the
+guarantee.
+
+RELATIVE_ACCURACY must not change once sketches are stored, rebuild the
+rollups with db.rollups.rebuild_rollups after changing it.
+"""
+import math
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+RELATIVE_ACCURACY = 0.01
+MAX_BINS = 2048
+MIN_INDEXABLE = 1e-9
+
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+# Fields added to statistics entries and the quantiles they estimate
+PERCENTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99}
+
+
+def _index(magnitude: float) -> int:
+    return math.ceil(math.log(magnitude) / LOG_GAMMA)
+
+
+def _estimate(index: int) -> float:
+    # Within RELATIVE_ACCURACY of every value of the bin
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+def _fold(bins: Dict[int, int], order: List[int], count: int) -> None:
+    """Fold the first count bins of order into the next one."""
+    if count <= 0:
+        return
+    target = order[count]
+    for index in order[:count]:
+        bins[target] += bins.pop(index)
+
+
+class DDSketch:
+    """Quantile sketch with relative error guarantees, see the module docstring."""
+
+    def __init__(self):
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zero = 0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        if value > MIN_INDEXABLE:
+            index = _index(value)
+            self.positive[index] = self.positive.get(index, 0) + 1
+        elif value < -MIN_INDEXABLE:
+            index = _index(-value)
+            self.negative[index] = self.negative.get(index, 0) + 1
+        else:
+            self.zero += 1
+        self.count += 1
+        self._collapse()
+
+    def merge(self, other: "DDSketch") -> None:
+        for bins, other_bins in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in other_bins.items():
+                bins[index] = bins.get(index, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+        self._collapse()
+
+    def quantiles(self, qs: Sequence[float]) -> List[Optional[float]]:
+        """Estimate the quantiles qs, each in [0, 1], in one pass over the bins."""
+        if not self.count:
+            return [None] * len(qs)
+        ranks = sorted((q * (self.count - 1), position) for position, q in enumerate(qs))
+        estimates: List[Optional[float]] = [None] * len(qs)
+        seen = 0
+        pending = iter(ranks)
+        rank, position = next(pending)
+        for value, count in self._bins():
+            seen += count
+            while seen > rank:
+                estimates[position] = value
+                try:
+                    rank, position = next(pending)
+                except StopIteration:
+                    return estimates
+        return estimates
+
+    def quantile(self, q: float) -> Optional[float]:
+        return self.quantiles([q])[0]
+
+    def _bins(self) -> Iterator[Tuple[float, int]]:
+        """(estimate, count) of all bins from the lowest value to the highest."""
+        for index in sorted(self.negative, reverse=True):
+            yield -_estimate(index), self.negative[index]
+        if self.zero:
+            yield 0.0, self.zero
+        for index in sorted(self.positive):
+            yield _estimate(index), self.positive[index]
+
+    def _collapse(self) -> None:
+        excess = len(self.positive) + len(self.negative) - MAX_BINS
+        if excess <= 0:
+            return
+        # The lowest values go first, so the upper quantiles keep their accuracy.
+        # Negative values are lowest at their largest index.
+        folded = min(excess, max(len(self.negative) - 1, 0))
+        _fold(self.negative, sorted(self.negative, reverse=True), folded)
+        _fold(self.positive, sorted(self.positive), excess - folded)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON representation, as stored in measurement_daily_rollups.sketch."""
+        return {
+            "positive": sorted(self.positive.items()),
+            "negative": sorted(self.negative.items()),
+            "zero": self.zero,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DDSketch":
+        sketch = cls()
+        sketch.positive = {int(index): count for index, count in data["positive"]}
+        sketch.negative = {int(index): count for index, count in data["negative"]}
+        sketch.zero = data["zero"]
+        sketch.count = sketch.zero + sum(sketch.positive.values()) + sum(sketch.negative.values())
+        return sketch
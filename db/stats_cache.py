@@ -0,0 +1,274 @@
+"""
+Result cache of Database.get_statistics
+
+Results are cached per template, user and window. A write invalidates only
+the windows of its template that contain the measured_at it wrote or
+replaced, so the common dashboard windows of other templates and of older
+periods stay cached; a template edit invalidates all windows of the
+template. Each template also has a generation, bumped by every
+invalidation: a result computed while a write committed is dropped again
+instead of being served stale.
+
+The default backend is an in-process LRU, which only sees the writes of
+its own process. Deployments with several workers set STATS_CACHE_URL to a
+Redis URL so that all of them share one cache and its invalidations.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+STATS_CACHE_URL = os.getenv("STATS_CACHE_URL", "")
+# Cached windows in the in-process backend, 0 disables the cache
+STATS_CACHE_SIZE = int(os.getenv("STATS_CACHE_SIZE", "1024"))
+# Lifetime of a template's windows in the shared backend, Redis evicts by LRU before that
+STATS_CACHE_TTL_SECONDS = int(os.getenv("STATS_CACHE_TTL_SECONDS", "3600"))
+
+Statistics = Dict[str, Dict[str, Any]]
+
+
+class StatisticsKey(NamedTuple):
+    user_id: Optional[str]  # None for the statistics of all users
+    start: Optional[datetime]
+    end: Optional[datetime]
+    percentiles: bool = False
+
+    def contains(self, measured_at: datetime) -> bool:
+        return (self.start is None or self.start <= measured_at) and (self.end is None or measured_at <= self.end)
+
+    def encode(self) -> str:
+        return json.dumps([self.user_id, _isoformat(self.start), _isoformat(self.end), self.percentiles])
+
+    @classmethod
+    def decode(cls, field: str) -> "StatisticsKey":
+        # Fields cached before percentiles were added have three items
+        user_id, start, end, *percentiles = json.loads(field)
+        return cls(user_id, _parse(start), _parse(end), *percentiles)
+
+
+def normalize(value: Optional[datetime]) -> Optional[datetime]:
+    """Naive UTC, the representation of measured_at in the database."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def _parse(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+class MemoryBackend:
+    """Bounded LRU of cached windows in this process."""
+
+    def __init__(self, maxsize: int = STATS_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Tuple[str, StatisticsKey], Statistics] = OrderedDict()
+        self._keys: Dict[str, Set[StatisticsKey]] = {}
+        self._generations: Dict[str, int] = {}
+        self.evictions = 0
+
+    def get(self, template_id: str, key: StatisticsKey) -> Optional[Statistics]:
+        stats = self._entries.get((template_id, key))
+        if stats is not None:
+            self._entries.move_to_end((template_id, key))
+        return stats
+
+    def put(self, template_id: str, key: StatisticsKey, stats: Statistics) -> None:
+        if self.maxsize <= 0:
+            return
+        self._entries[(template_id, key)] = stats
+        self._entries.move_to_end((template_id, key))
+        self._keys.setdefault(template_id, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            (evicted_template_id, evicted_key), _ = self._entries.popitem(last=False)
+            self._discard_key(evicted_template_id, evicted_key)
+            self.evictions += 1
+
+    def keys(self, template_id: str) -> List[StatisticsKey]:
+        return list(self._keys.get(template_id, ()))
+
+    def delete(self, template_id: str, keys: Iterable[StatisticsKey]) -> int:
+        deleted = 0
+        for key in keys:
+            if self._entries.pop((template_id, key), None) is not None:
+                deleted += 1
+            self._discard_key(template_id, key)
+        return deleted
+
+    def generation(self, template_id: str) -> int:
+        return self._generations.get(template_id, 0)
+
+    def bump_generation(self, template_id: str) -> None:
+        self._generations[template_id] = self._generations.get(template_id, 0) + 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._keys.clear()
+        self._generations.clear()
+        self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "evictions": self.evictions}
+
+    def _discard_key(self, template_id: str, key: StatisticsKey) -> None:
+        keys = self._keys.get(template_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys[template_id]
+
+
+class RedisBackend:
+    """Cached windows shared by all workers, one Redis hash per template.
+
+    Takes a redis-py client or anything with the same get, incr, hget, hset,
+    hkeys, hdel, expire, delete and info methods, e.g. a local stand-in in
+    development.
+    """
+
+    def __init__(self, client, ttl: int = STATS_CACHE_TTL_SECONDS, prefix: str = "measure:stats:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _windows(self, template_id: str) -> str:
+        return f"{self.prefix}windows:{template_id}"
+
+    def _generation(self, template_id: str) -> str:
+        return f"{self.prefix}generation:{template_id}"
+
+    def get(self, template_id: str, key: StatisticsKey) -> Optional[Statistics]:
+        value = self.client.hget(self._windows(template_id), key.encode())
+        return json.loads(value) if value is not None else None
+
+    def put(self, template_id: str, key: StatisticsKey, stats: Statistics) -> None:
+        name = self._windows(template_id)
+        self.client.hset(name, key.encode(), json.dumps(stats))
+        self.client.expire(name, self.ttl)
+
+    def keys(self, template_id: str) -> List[StatisticsKey]:
+        return [StatisticsKey.decode(_text(field)) for field in self.client.hkeys(self._windows(template_id))]
+
+    def delete(self, template_id: str, keys: Iterable[StatisticsKey]) -> int:
+        fields = [key.encode() for key in keys]
+        return self.client.hdel(self._windows(template_id), *fields) if fields else 0
+
+    def generation(self, template_id: str) -> int:
+        return int(self.client.get(self._generation(template_id)) or 0)
+
+    def bump_generation(self, template_id: str) -> None:
+        self.client.incr(self._generation(template_id))
+
+    def clear(self) -> None:
+        # Entries expire on their own, flushing a shared server is not ours to do
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        # Evictions of the whole server, Redis does not count them per key prefix
+        return {"evictions": int(self.client.info("stats").get("evicted_keys", 0))}
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class StatisticsCache:
+    """Statistics results keyed by template, user and normalized window."""
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_or_compute(
+        self,
+        template_id: str,
+        user_id: Optional[str],
+        start_date: Optional[datetime],
+        end_date: Optional[datetime],
+        compute: Callable[[Optional[datetime], Optional[datetime]], Optional[Statistics]],
+        percentiles: bool = False
+    ) -> Optional[Statistics]:
+        """Return the cached statistics of the window, or compute them with the normalized bounds.
+
+        Results with and without percentiles are cached apart.
+        """
+        key = StatisticsKey(user_id, normalize(start_date), normalize(end_date), percentiles)
+        with self._lock:
+            stats = self.backend.get(template_id, key)
+            if stats is not None:
+                self.hits += 1
+                return stats
+            self.misses += 1
+            generation = self.backend.generation(template_id)
+
+        stats = compute(key.start, key.end)
+
+        # Missing templates are not cached, they may be created later
+        if stats is not None:
+            with self._lock:
+                self.backend.put(template_id, key, stats)
+                # Checked after storing, so a write that committed meanwhile either
+                # sees the entry and deletes it, or has bumped the generation
+                if self.backend.generation(template_id) != generation:
+                    self.backend.delete(template_id, [key])
+        return stats
+
+    def invalidate(
+        self,
+        template_id: str,
+        measured_at: Optional[Iterable[datetime]] = None,
+        user_id: Optional[str] = None
+    ) -> None:
+        """Drop the windows of the template containing any of measured_at, or all of them if None.
+
+        With a user_id only the windows of that user and of all users are
+        dropped. Called after the write committed.
+        """
+        timestamps = None if measured_at is None else [normalize(value) for value in measured_at]
+        with self._lock:
+            self.backend.bump_generation(template_id)
+            keys = [
+                key for key in self.backend.keys(template_id)
+                if (user_id is None or key.user_id in (None, user_id))
+                and (timestamps is None or any(key.contains(value) for value in timestamps))
+            ]
+            self.invalidations += self.backend.delete(template_id, keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.backend.clear()
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                **self.backend.stats(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+
+def make_statistics_cache(url: str = STATS_CACHE_URL) -> StatisticsCache:
+    if not url:
+        return StatisticsCache(MemoryBackend())
+    # redis is only needed when a shared cache is configured
+    import redis
+    return StatisticsCache(RedisBackend(redis.Redis.from_url(url)))
+
+
+# Process-wide cache shared by all Database instances
+statistics_cache = make_statistics_cache()
@@ -1,82 +1,179 @@
-from typing import List, Optional, Dict, Any
-from datetime import datetime
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc
+from typing import List, Optional, Dict, Any, AsyncIterator, Iterable, Iterator, Set, Tuple
+from datetime import date, datetime
+import base64
+import json
+import math
+import uuid
+from itertools import groupby
+from operator import itemgetter
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy import DateTime, Float, and_, bindparam, cast, desc, false, func, select, true, update, delete, tuple_, Select, Row
 from fastapi import Depends
 
-from db.database import get_db
-from db.models import Unit, ValueDefinition, MeasurementTemplate, Measurement, MeasurementValue
+from db.database import get_async_db
+from db.ingest import write_measurement_rows
+from db.partitions import ensure_partitions, lock_measurement_ids
+from db.rollups import RollupKey, add_to_rollups, refresh_rollups, split_window, wide_entries
+from db.models import (
+    Unit, ValueDefinition, MeasurementTemplate, Measurement, MeasurementValue, MeasurementDailyRollup,
+    canonical_key, is_valid_key, uses_wide_layout
+)
+from db.registry import DefinitionInfo, TemplateEntry, TemplateRegistry, template_registry
+from db.downsample import SeriesSampler
+from db.sketches import PERCENTILES, DDSketch
+from db.stats_cache import StatisticsCache, normalize, statistics_cache
+from db.versions import TEMPLATES, bump_versions, get_versions, measurements_scope, template_scope
 from models.measurement import (
     Unit as UnitSchema,
     ValueDefinition as ValueDefinitionSchema,
     MeasurementTemplate as MeasurementTemplateSchema,
     Measurement as MeasurementSchema,
     MeasurementValue as MeasurementValueSchema,
+    BatchItemResult,
+    BatchResult,
+    BucketSize,
+    SeriesMethod,
 )
 
+# Keeps IN lists below the bound parameter limits of SQLite and Postgres
+ID_CHUNK_SIZE = 500
+
+# SQLite has no date_trunc, these strftime formats truncate to the same bucket starts
+SQLITE_BUCKET_FORMATS = {
+    BucketSize.hour: ("%Y-%m-%d %H:00:00",),
+    BucketSize.day: ("%Y-%m-%d 00:00:00",),
+    BucketSize.week: ("%Y-%m-%d 00:00:00", "weekday 0", "-6 days"),  # ISO weeks start on Monday
+    BucketSize.month: ("%Y-%m-01 00:00:00",),
+}
+
+
+def encode_cursor(measured_at: datetime, measurement_id: str) -> str:
+    """Encode a (measured_at, id) keyset position as an opaque URL-safe cursor."""
+    payload = json.dumps([measured_at.isoformat(), measurement_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        measured_at, measurement_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not is_valid_key(measurement_id):
+            raise ValueError(measurement_id)
+        return normalize(datetime.fromisoformat(measured_at)), canonical_key(measurement_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def summarize_values(
+    count: int,
+    total: Optional[float],
+    total_sq: Optional[float],
+    minimum: Optional[float],
+    maximum: Optional[float],
+    unit: str
+) -> Dict[str, Any]:
+    """Build a statistics entry from count, sum, sum of squares, min and max.
+
+    These aggregates can be computed by any SQL backend and combined across
+    groups, avg and sample standard deviation are derived from them.
+    """
+    if not count:
+        return {"count": 0, "unit": unit}
+    
+    stddev = None
+    if count > 1:
+        variance = (total_sq - total * total / count) / (count - 1)
+        stddev = math.sqrt(max(variance, 0.0))
+    
+    return {
+        "count": count,
+        "min": minimum,
+        "max": maximum,
+        "avg": total / count,
+        "sum": total,
+        "stddev": stddev,
+        "unit": unit
+    }
+
 class Database:
-    def __init__(self, db: Session):
+    def __init__(
+        self,
+        db: Session,
+        registry: Optional[TemplateRegistry] = None,
+        stats_cache: Optional[StatisticsCache] = None
+    ):
         self.db = db
+        self.registry = registry if registry is not None else template_registry
+        self.stats_cache = stats_cache if stats_cache is not None else statistics_cache
+    
+    def get_data_versions(self, scopes: List[str]) -> Dict[str, str]:
+        """Current versions of the scopes in db.versions, read before the data they describe."""
+        return get_versions(self.db, scopes)
     
     def get_templates(self) -> List[MeasurementTemplateSchema]:
-        templates = self.db.query(MeasurementTemplate).filter(MeasurementTemplate.is_active == True).all()
+        templates = self.db.query(MeasurementTemplate).options(
+            selectinload(MeasurementTemplate.value_definitions).joinedload(ValueDefinition.unit)
+        ).filter(MeasurementTemplate.is_active == True).all()
         return [self._convert_template_to_schema(template) for template in templates]
     
     def get_template(self, template_id: str) -> Optional[MeasurementTemplateSchema]:
-        template = self.db.query(MeasurementTemplate).filter(
+        entry = self.get_template_entry(template_id)
+        
+        if not entry:
+            return None
+            
+        return entry.schema
+    
+    def get_template_entry(self, template_id: str) -> Optional[TemplateEntry]:
+        """Return the cached template with its definition lookup table."""
+        if not is_valid_key(template_id):
+            return None
+        return self.registry.get_or_load(canonical_key(template_id), self._load_template_entry)
+    
+    def _load_template_entry(self, template_id: str) -> Optional[TemplateEntry]:
+        template = self.db.query(MeasurementTemplate).options(
+            selectinload(MeasurementTemplate.value_definitions).joinedload(ValueDefinition.unit)
+        ).filter(
             MeasurementTemplate.id == template_id,
             MeasurementTemplate.is_active == True
         ).first()
         
         if not template:
             return None
-            
-        return self._convert_template_to_schema(template)
+        
+        definitions = {
+            value_def.name: DefinitionInfo(id=value_def.id, unit=value_def.unit.name)
+            for value_def in template.value_definitions
+            if value_def.is_active
+        }
+        
+        return TemplateEntry(schema=self._convert_template_to_schema(template), definitions=definitions)
     
     def create_template(self, template_schema: MeasurementTemplateSchema) -> MeasurementTemplateSchema:
+        """Create a template, or update the stored one with the same ID.
+
+        Value definitions are matched by name, so an edit keeps the ids of the
+        definitions it does not remove and existing values stay attached.
+        Removed definitions are deactivated rather than deleted, and adding
+        one with the same name again reactivates it.
+        """
+        if not is_valid_key(template_schema.id):
+            raise ValueError(f"Invalid template id '{template_schema.id}', expected a UUID")
+        template_schema.id = canonical_key(template_schema.id)
+        
         # Check if template with this ID already exists
-        existing_template = self.db.query(MeasurementTemplate).filter(
+        template = self.db.query(MeasurementTemplate).filter(
             MeasurementTemplate.id == template_schema.id
         ).first()
         
-        if existing_template:
+        if template:
             # Update existing template
-            existing_template.name = template_schema.name
-            existing_template.description = template_schema.description
-            existing_template.updated_at = datetime.utcnow()
-            existing_template.is_active = template_schema.is_active
-            existing_template.owner_id = template_schema.owner_id
-            
-            # Remove existing value definitions
-            for value_def in existing_template.value_definitions:
-                self.db.delete(value_def)
-            
-            # Add new value definitions
-            for value_def_schema in template_schema.value_definitions:
-                # Create unit if it doesn't exist
-                unit = self.db.query(Unit).filter(Unit.name == value_def_schema.unit.name).first()
-                if not unit:
-                    unit = Unit(
-                        name=value_def_schema.unit.name,
-                        display_name=value_def_schema.unit.display_name,
-                        description=value_def_schema.unit.description
-                    )
-                    self.db.add(unit)
-                    self.db.flush()
-                
-                # Create value definition
-                value_def = ValueDefinition(
-                    name=value_def_schema.name,
-                    display_name=value_def_schema.display_name,
-                    description=value_def_schema.description,
-                    unit_id=unit.id,
-                    min_value=value_def_schema.min_value,
-                    max_value=value_def_schema.max_value,
-                    template_id=existing_template.id
-                )
-                self.db.add(value_def)
-            
-            template = existing_template
+            template.name = template_schema.name
+            template.description = template_schema.description
+            template.updated_at = datetime.utcnow()
+            template.is_active = template_schema.is_active
+            template.owner_id = template_schema.owner_id
         else:
             # Create new template
             template = MeasurementTemplate(
@@ -90,150 +187,939 @@ class Database:
             )
             self.db.add(template)
             self.db.flush()
+        
+        stored = {value_def.name: value_def for value_def in template.value_definitions}
+        units = {}
+        for value_def_schema in template_schema.value_definitions:
+            unit = units.get(value_def_schema.unit.name)
+            if unit is None:
+                unit = units[value_def_schema.unit.name] = self._get_or_create_unit(value_def_schema.unit)
             
-            # Add value definitions
-            for value_def_schema in template_schema.value_definitions:
-                # Create unit if it doesn't exist
-                unit = self.db.query(Unit).filter(Unit.name == value_def_schema.unit.name).first()
-                if not unit:
-                    unit = Unit(
-                        name=value_def_schema.unit.name,
-                        display_name=value_def_schema.unit.display_name,
-                        description=value_def_schema.unit.description
-                    )
-                    self.db.add(unit)
-                    self.db.flush()
-                
-                # Create value definition
-                value_def = ValueDefinition(
-                    name=value_def_schema.name,
-                    display_name=value_def_schema.display_name,
-                    description=value_def_schema.description,
-                    unit_id=unit.id,
-                    min_value=value_def_schema.min_value,
-                    max_value=value_def_schema.max_value,
-                    template_id=template.id
-                )
-                self.db.add(value_def)
+            fields = {
+                "display_name": value_def_schema.display_name,
+                "description": value_def_schema.description,
+                "unit_id": unit.id,
+                "min_value": value_def_schema.min_value,
+                "max_value": value_def_schema.max_value,
+                "is_active": True,
+            }
+            value_def = stored.pop(value_def_schema.name, None)
+            if value_def is None:
+                self.db.add(ValueDefinition(name=value_def_schema.name, template_id=template.id, **fields))
+            else:
+                # Only changed columns end up in the UPDATE
+                for key, value in fields.items():
+                    setattr(value_def, key, value)
+        
+        for value_def in stored.values():
+            value_def.is_active = False
         
+        bump_versions(self.db, [TEMPLATES, template_scope(template.id)])
         self.db.commit()
+        self.registry.invalidate(template.id)
+        self.stats_cache.invalidate(template.id)
         
         return self._convert_template_to_schema(template)
     
+    def _get_or_create_unit(self, unit_schema: UnitSchema) -> Unit:
+        unit = self.db.query(Unit).filter(Unit.name == unit_schema.name).first()
+        if not unit:
+            unit = Unit(
+                name=unit_schema.name,
+                display_name=unit_schema.display_name,
+                description=unit_schema.description
+            )
+            self.db.add(unit)
+            self.db.flush()
+        return unit
+    
     def get_measurements(
         self, 
         template_id: Optional[str] = None,
         start_date: Optional[datetime] = None,
-        end_date: Optional[datetime] = None
+        end_date: Optional[datetime] = None,
+        user_id: Optional[str] = None
     ) -> List[MeasurementSchema]:
-        query = self.db.query(Measurement)
+        query = self._filter_measurements(
+            self._measurement_rows_query(start_date, end_date), template_id, start_date, end_date, user_id
+        )
+        
+        # Order by measured_at descending (most recent first); the id tie-breaker
+        # keeps the rows of one measurement adjacent for folding
+        query = query.order_by(desc(Measurement.measured_at), desc(Measurement.id))
+        
+        rows = self._execute_rows(query)
+        
+        return list(self._fold_measurement_rows(rows))
+    
+    def get_measurements_page(
+        self,
+        template_id: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        user_id: Optional[str] = None
+    ) -> Tuple[List[MeasurementSchema], Optional[str]]:
+        """Return one page of measurements, most recent first, and the cursor of the next page.
+
+        Pages are keyed on (measured_at, id) instead of an offset, so fetching
+        a deep page costs the same as fetching the first one. Raises
+        ValueError for a malformed cursor.
+        """
+        page = self._filter_measurements(
+            select(Measurement.id), template_id, start_date, end_date, user_id
+        )
+        
+        if cursor:
+            measured_at, measurement_id = decode_cursor(cursor)
+            page = page.where(
+                tuple_(Measurement.measured_at, Measurement.id) < tuple_(measured_at, measurement_id)
+            )
+        
+        # Fetch one extra measurement to know whether there is a next page
+        page = page.order_by(
+            desc(Measurement.measured_at), desc(Measurement.id)
+        ).limit(limit + 1).subquery()
+        
+        query = self._measurement_rows_query(start_date, end_date).join(
+            page, page.c.id == Measurement.id
+        ).order_by(desc(Measurement.measured_at), desc(Measurement.id))
+        
+        measurements = list(self._fold_measurement_rows(self._execute_rows(query)))
+        
+        next_cursor = None
+        if len(measurements) > limit:
+            measurements = measurements[:limit]
+            next_cursor = encode_cursor(measurements[-1].measured_at, measurements[-1].id)
+        
+        return measurements, next_cursor
+    
+    @classmethod
+    def _export_rows_query(
+        cls,
+        template_id: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        user_id: Optional[str] = None
+    ) -> Select:
+        return cls._filter_measurements(
+            cls._measurement_rows_query(start_date, end_date), template_id, start_date, end_date, user_id
+        ).order_by(Measurement.measured_at, Measurement.id)
+    
+    @staticmethod
+    def _filter_measurements(
+        query: Select,
+        template_id: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        user_id: Optional[str] = None
+    ) -> Select:
+        """Restrict a measurements query to a template, window and user, None meaning all."""
+        start_date, end_date = normalize(start_date), normalize(end_date)
+        if user_id is not None:
+            query = query.where(Measurement.user_id == user_id)
         
-        # Apply filters
         if template_id:
-            query = query.filter(Measurement.template_id == template_id)
+            if not is_valid_key(template_id):
+                # Cannot match any stored id, and native UUID columns reject it
+                return query.where(false())
+            query = query.where(Measurement.template_id == canonical_key(template_id))
         
         if start_date:
-            query = query.filter(Measurement.measured_at >= start_date)
+            query = query.where(Measurement.measured_at >= start_date)
             
         if end_date:
-            query = query.filter(Measurement.measured_at <= end_date)
+            query = query.where(Measurement.measured_at <= end_date)
+        
+        return query
+    
+    def get_statistics(
+        self,
+        template_id: str,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        user_id: Optional[str] = None,
+        percentiles: bool = False,
+        cache: bool = True
+    ) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Aggregate the values of a template per definition in the database.
+
+        Full days are read from the daily rollups, partial days at the window
+        edges from the raw values, both restricted to user_id unless it is
+        None. With percentiles, entries with values also get the estimates
+        named in db.sketches.PERCENTILES, merged from the rollup sketches and
+        within their documented error bounds; they are left out if a rollup
+        of the window has no sketch. Results are cached per window until a
+        write lands in it, see db.stats_cache, unless cache is False, e.g.
+        for windows ending at the current time that are never asked for
+        again. Returns None if the template does not exist. Definitions
+        without values in the window are reported with a count of 0.
+        """
+        template_id = canonical_key(template_id)
+        if not cache:
+            return self._compute_statistics(
+                template_id, normalize(start_date), normalize(end_date), user_id, percentiles
+            )
+        return self.stats_cache.get_or_compute(
+            template_id, user_id, start_date, end_date,
+            lambda start, end: self._compute_statistics(template_id, start, end, user_id, percentiles),
+            percentiles=percentiles
+        )
+    
+    def _compute_statistics(
+        self,
+        template_id: str,
+        start_date: Optional[datetime],
+        end_date: Optional[datetime],
+        user_id: Optional[str],
+        percentiles: bool = False
+    ) -> Optional[Dict[str, Dict[str, Any]]]:
+        entry = self.get_template_entry(template_id)
+        if not entry:
+            return None
+        
+        aggregates = self._value_aggregates(template_id, start_date, end_date, user_id=user_id)
+        sketches = self._value_sketches(template_id, start_date, end_date, user_id) if percentiles else {}
+        
+        stats = {}
+        for name, definition in entry.definitions.items():
+            count, total, total_sq, minimum, maximum = aggregates.get((name,), (0, None, None, None, None))
+            stats[name] = summarize_values(count, total, total_sq, minimum, maximum, definition.unit)
+            
+            sketch = sketches.get(name)
+            if count and sketch is not None:
+                # Estimates are kept within the exact range
+                estimates = sketch.quantiles(list(PERCENTILES.values()))
+                for field, estimate in zip(PERCENTILES, estimates):
+                    stats[name][field] = min(max(estimate, minimum), maximum)
+        
+        return stats
+    
+    def get_statistics_series(
+        self,
+        template_id: str,
+        bucket: BucketSize,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        user_id: Optional[str] = None
+    ) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Aggregate the values of a template per definition and time bucket.
+
+        Buckets are computed with date_trunc in the database, so the result
+        size depends on the number of buckets, not on the number of readings.
+        Day, week and month buckets use the daily rollups for full days.
+        Returns None if the template does not exist.
+        """
+        template_id = canonical_key(template_id)
+        entry = self.get_template_entry(template_id)
+        if not entry:
+            return None
+        
+        start_date, end_date = normalize(start_date), normalize(end_date)
+        aggregates = self._value_aggregates(template_id, start_date, end_date, bucket, user_id)
         
-        # Order by measured_at descending (most recent first)
-        query = query.order_by(desc(Measurement.measured_at))
+        series = {
+            name: {"unit": definition.unit, "buckets": []}
+            for name, definition in entry.definitions.items()
+        }
         
-        measurements = query.all()
+        for (start, name), (count, total, _, minimum, maximum) in sorted(aggregates.items()):
+            if name not in series:
+                continue
+            series[name]["buckets"].append({
+                "start": start,
+                "count": count,
+                "min": minimum,
+                "max": maximum,
+                "avg": total / count
+            })
         
-        return [self._convert_measurement_to_schema(measurement) for measurement in measurements]
+        return series
     
-    def get_measurement(self, measurement_id: str) -> Optional[MeasurementSchema]:
-        measurement = self.db.query(Measurement).filter(Measurement.id == measurement_id).first()
+    def get_measurement_series(
+        self,
+        template_id: str,
+        start_date: datetime,
+        end_date: datetime,
+        points: int,
+        method: SeriesMethod = SeriesMethod.lttb,
+        user_id: Optional[str] = None,
+        batch_size: int = 1000
+    ) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Return at most points readings per definition, downsampled for charts.
         
-        if not measurement:
+        The values of the window are streamed in chronological order from a
+        server-side cursor and reduced as they arrive, see db.downsample, so
+        memory use depends on points, not on the number of readings.
+        Returns None if the template does not exist.
+        """
+        template_id = canonical_key(template_id)
+        entry = self.get_template_entry(template_id)
+        if not entry:
             return None
-            
-        return self._convert_measurement_to_schema(measurement)
+        
+        start_date, end_date = normalize(start_date), normalize(end_date)
+        names = {definition.id: name for name, definition in entry.definitions.items()}
+        samplers = {name: SeriesSampler(method, start_date, end_date, points) for name in entry.definitions}
+        
+        query = self._series_points_query(template_id, start_date, end_date, user_id)
+        result = self.db.execute(query.execution_options(stream_results=True, yield_per=batch_size))
+        try:
+            for measured_at, definition_id, value in self._expand_series_rows(result):
+                name = names.get(definition_id)
+                if name is not None and value is not None:
+                    samplers[name].add(measured_at, value)
+        finally:
+            result.close()
+        
+        return {
+            name: {
+                "unit": definition.unit,
+                "points": [
+                    {"measured_at": measured_at, "value": value}
+                    for measured_at, value in samplers[name].finish()
+                ]
+            }
+            for name, definition in entry.definitions.items()
+        }
     
-    def create_measurement(self, measurement_schema: MeasurementSchema) -> MeasurementSchema:
-        # Check if measurement with this ID already exists
-        existing_measurement = self.db.query(Measurement).filter(
-            Measurement.id == measurement_schema.id
-        ).first()
+    @classmethod
+    def _series_points_query(
+        cls,
+        template_id: str,
+        start_date: datetime,
+        end_date: datetime,
+        user_id: Optional[str]
+    ) -> Select:
+        """(measured_at, definition id, value) of a template in chronological order.
         
-        if existing_measurement:
-            # Update existing measurement
-            existing_measurement.template_id = measurement_schema.template_id
-            existing_measurement.measured_at = measurement_schema.measured_at
-            existing_measurement.notes = measurement_schema.notes
-            existing_measurement.user_id = measurement_schema.user_id
+        In the wide layout the last two columns are definition_values instead,
+        _expand_series_rows splits them.
+        """
+        if uses_wide_layout():
+            query = select(Measurement.measured_at, Measurement.definition_values)
+        else:
+            query = select(
+                Measurement.measured_at, MeasurementValue.definition_id, MeasurementValue.value
+            ).join(MeasurementValue, and_(
+                MeasurementValue.measurement_id == Measurement.id,
+                MeasurementValue.measured_at == Measurement.measured_at,
+                # Repeated on the value side so Postgres prunes its partitions too
+                MeasurementValue.measured_at >= start_date,
+                MeasurementValue.measured_at <= end_date
+            ))
+        return cls._filter_measurements(query, template_id, start_date, end_date, user_id).order_by(
+            Measurement.measured_at
+        )
+    
+    @staticmethod
+    def _expand_series_rows(rows: Iterable[Row]) -> Iterator[tuple]:
+        if not uses_wide_layout():
+            yield from rows
+            return
+        for measured_at, definition_values in rows:
+            for definition_id, value in (definition_values or {}).items():
+                yield measured_at, definition_id, value
+    
+    def _value_aggregates(
+        self,
+        template_id: str,
+        start_date: Optional[datetime],
+        end_date: Optional[datetime],
+        bucket: Optional[BucketSize] = None,
+        user_id: Optional[str] = None
+    ) -> Dict[Tuple, List]:
+        """Count, sum, sum of squares, min and max per ([bucket start,] definition name)."""
+        full_days, edges = split_window(start_date, end_date)
+        if bucket == BucketSize.hour:
+            full_days, edges = None, [(start_date, end_date, True)]
+        
+        aggregates = {}
+        
+        def merge(rows):
+            for *key, count, total, total_sq, minimum, maximum in rows:
+                if key and isinstance(key[0], str) and bucket is not None:
+                    key[0] = datetime.fromisoformat(key[0])
+                current = aggregates.get(tuple(key))
+                if current is None:
+                    aggregates[tuple(key)] = [count, total, total_sq, minimum, maximum]
+                else:
+                    current[0] += count
+                    current[1] += total
+                    current[2] += total_sq
+                    current[3] = min(current[3], minimum)
+                    current[4] = max(current[4], maximum)
+        
+        if full_days is not None:
+            first, stop = full_days
+            rollup = MeasurementDailyRollup
+            keys = [ValueDefinition.name]
+            if bucket is not None:
+                day = rollup.day
+                if self.db.get_bind().dialect.name == "postgresql":
+                    day = cast(day, DateTime)
+                keys.insert(0, self._truncate_time(day, bucket))
             
-            # Remove existing values
-            for value in existing_measurement.values:
-                self.db.delete(value)
+            query = self._restrict_rollups(select(
+                *keys,
+                func.sum(rollup.count),
+                func.sum(rollup.total),
+                func.sum(rollup.total_sq),
+                func.min(rollup.minimum),
+                func.max(rollup.maximum),
+            ), template_id, first, stop, user_id).group_by(*keys)
             
-            # Add new values
-            for value_schema in measurement_schema.values:
-                # Find value definition
-                value_def = self.db.query(ValueDefinition).join(
-                    MeasurementTemplate
-                ).filter(
-                    ValueDefinition.name == value_schema.definition_name,
-                    MeasurementTemplate.id == measurement_schema.template_id
-                ).first()
-                
-                if not value_def:
-                    raise ValueError(f"Value definition '{value_schema.definition_name}' not found for template '{measurement_schema.template_id}'")
-                
-                # Create measurement value
-                value = MeasurementValue(
-                    definition_id=value_def.id,
-                    measurement_id=existing_measurement.id,
-                    value=value_schema.value
-                )
-                self.db.add(value)
+            merge(self.db.execute(query))
+        
+        wide = uses_wide_layout()
+        if wide:
+            # Values are grouped by definition id and renamed here
+            names = self._definition_ids(template_id)
+        
+        for lower, upper, inclusive in edges:
+            entries, key, value = self._raw_value_columns()
+            keys = [key]
+            if bucket is not None:
+                keys.insert(0, self._truncate_time(Measurement.measured_at, bucket))
             
-            measurement = existing_measurement
+            query = self._restrict_raw_values(select(
+                *keys,
+                func.count(value),
+                func.sum(value),
+                func.sum(value * value),
+                func.min(value),
+                func.max(value),
+            ), template_id, lower, upper, inclusive, user_id, entries).group_by(*keys)
+            
+            rows = self.db.execute(query)
+            if wide:
+                rows = [
+                    (*row[:-6], names[row[-6]], *row[-5:])
+                    for row in rows
+                    if row[-6] in names
+                ]
+            merge(rows)
+        
+        return aggregates
+    
+    def _value_sketches(
+        self,
+        template_id: str,
+        start_date: Optional[datetime],
+        end_date: Optional[datetime],
+        user_id: Optional[str] = None
+    ) -> Dict[str, Optional[DDSketch]]:
+        """Quantile sketch per definition name, merged from the rollups and the partial days.
+
+        A definition with a rollup in the window that has no sketch maps to
+        None, its percentiles cannot be estimated.
+        """
+        full_days, edges = split_window(start_date, end_date)
+        sketches: Dict[str, Optional[DDSketch]] = {}
+        
+        if full_days is not None:
+            first, stop = full_days
+            rollup = MeasurementDailyRollup
+            query = self._restrict_rollups(
+                select(ValueDefinition.name, rollup.sketch), template_id, first, stop, user_id
+            )
+            for name, stored in self.db.execute(query):
+                if stored is None:
+                    sketches[name] = None
+                elif name not in sketches:
+                    sketches[name] = DDSketch.from_dict(stored)
+                elif sketches[name] is not None:
+                    sketches[name].merge(DDSketch.from_dict(stored))
+        
+        names = self._definition_ids(template_id) if uses_wide_layout() else None
+        for lower, upper, inclusive in edges:
+            entries, key, value = self._raw_value_columns()
+            query = self._restrict_raw_values(
+                select(key, value), template_id, lower, upper, inclusive, user_id, entries
+            )
+            for key, value in self.db.execute(query):
+                name = names.get(key) if names is not None else key
+                if name is None or value is None:
+                    continue
+                sketch = sketches.setdefault(name, DDSketch())
+                if sketch is not None:
+                    sketch.add(value)
+        
+        return sketches
+    
+    def _definition_ids(self, template_id: str) -> Dict[str, str]:
+        """Map the definition ids of a template to their names."""
+        entry = self.get_template_entry(template_id)
+        return {definition.id: name for name, definition in entry.definitions.items()} if entry else {}
+    
+    @staticmethod
+    def _restrict_rollups(
+        query: Select,
+        template_id: str,
+        first: Optional[date],
+        stop: Optional[date],
+        user_id: Optional[str]
+    ) -> Select:
+        """Select a rollups query from the rollups of a template with first <= day < stop, joined to their definitions."""
+        rollup = MeasurementDailyRollup
+        query = query.select_from(rollup).join(
+            ValueDefinition, ValueDefinition.id == rollup.definition_id
+        ).where(
+            rollup.template_id == template_id
+        )
+        
+        if user_id is not None:
+            query = query.where(rollup.user_id == user_id)
+        if first is not None:
+            query = query.where(rollup.day >= first)
+        if stop is not None:
+            query = query.where(rollup.day < stop)
+        return query
+    
+    def _raw_value_columns(self) -> Tuple[Any, Any, Any]:
+        """(entries, key, value) of the raw values for _restrict_raw_values.
+
+        The key is the definition name, or the definition id in the wide
+        layout, where entries is the table of the measurement's values.
+        """
+        if uses_wide_layout():
+            entries = wide_entries(self.db)
+            return entries, entries.c.key, cast(entries.c.value, Float)
+        return None, ValueDefinition.name, MeasurementValue.value
+    
+    @staticmethod
+    def _restrict_raw_values(
+        query: Select,
+        template_id: str,
+        lower: Optional[datetime],
+        upper: Optional[datetime],
+        inclusive: bool,
+        user_id: Optional[str],
+        entries=None
+    ) -> Select:
+        """Select a query from the raw values of a template with lower <= measured_at < upper, or <= if inclusive."""
+        query = query.where(Measurement.template_id == template_id)
+        
+        if user_id is not None:
+            query = query.where(Measurement.user_id == user_id)
+        if entries is not None:
+            query = query.select_from(Measurement).join(entries, true())
+            bounded = [Measurement.measured_at]
         else:
-            # Create new measurement
-            measurement = Measurement(
-                id=measurement_schema.id,
-                template_id=measurement_schema.template_id,
-                measured_at=measurement_schema.measured_at,
-                recorded_at=measurement_schema.recorded_at,
-                notes=measurement_schema.notes,
-                user_id=measurement_schema.user_id
+            query = query.select_from(MeasurementValue).join(
+                ValueDefinition, ValueDefinition.id == MeasurementValue.definition_id
+            ).join(
+                Measurement, and_(
+                    Measurement.id == MeasurementValue.measurement_id,
+                    Measurement.measured_at == MeasurementValue.measured_at
+                )
             )
-            self.db.add(measurement)
-            self.db.flush()
+            bounded = [Measurement.measured_at, MeasurementValue.measured_at]
+        
+        # Bound both sides so each scan only touches the partitions of the window
+        for column in bounded:
+            if lower is not None:
+                query = query.where(column >= lower)
+            if upper is not None:
+                query = query.where(column <= upper if inclusive else column < upper)
+        return query
+    
+    def _truncate_time(self, column, bucket: BucketSize):
+        if self.db.get_bind().dialect.name == "postgresql":
+            return func.date_trunc(bucket.value, column)
+        
+        bucket_format, *modifiers = SQLITE_BUCKET_FORMATS[bucket]
+        return func.strftime(bucket_format, column, *modifiers)
+    
+    def iter_measurement_rows(
+        self,
+        template_id: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        batch_size: int = 1000,
+        user_id: Optional[str] = None
+    ) -> Iterator[Row]:
+        """Stream flat measurement/value rows in chronological order.
+
+        Rows come from a server-side cursor in batches of batch_size, so memory
+        use does not depend on the size of the result. Each row is (id,
+        template_id, measured_at, recorded_at, notes, user_id, definition_name,
+        value) and the rows of one measurement are adjacent.
+        """
+        query = self._export_rows_query(template_id, start_date, end_date, user_id)
+        
+        names = self._definition_names() if uses_wide_layout() else None
+        result = self.db.execute(
+            query.execution_options(stream_results=True, yield_per=batch_size)
+        )
+        try:
+            if names is None:
+                yield from result
+            else:
+                for row in result:
+                    yield from self._expand_wide_row(row, names)
+        finally:
+            result.close()
+    
+    def get_measurement(self, measurement_id: str, user_id: Optional[str] = None) -> Optional[MeasurementSchema]:
+        if not is_valid_key(measurement_id):
+            return None
+        
+        query = self._filter_measurements(self._measurement_rows_query(), user_id=user_id).where(
+            Measurement.id == canonical_key(measurement_id)
+        )
+        
+        measurements = list(self._fold_measurement_rows(self._execute_rows(query)))
+        
+        if not measurements:
+            return None
+            
+        return measurements[0]
+    
+    def create_measurement(self, measurement_schema: MeasurementSchema) -> MeasurementSchema:
+        """Store a measurement, or update the stored one with the same ID.
+
+        Updates only write what changed, see _store_measurements. Raises
+        ValueError if the stored measurement belongs to another user.
+        """
+        if not is_valid_key(measurement_schema.id):
+            raise ValueError(f"Invalid measurement id '{measurement_schema.id}', expected a UUID")
+        
+        self._canonicalize_keys(measurement_schema)
+        definitions = self._resolve_definitions(measurement_schema)
+        ensure_partitions(self.db, [measurement_schema.measured_at])
+        stored = self._stored_measurements([measurement_schema.id])
+        self._check_owner(measurement_schema, stored)
+        
+        try:
+            _, changes = self._store_measurements([(measurement_schema, definitions)], stored)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        self._invalidate_statistics(changes)
+        
+        # The stored values are exactly the validated input, no need to reload them
+        return measurement_schema
+    
+    def create_measurements_bulk(self, measurement_schemas: List[MeasurementSchema]) -> BatchResult:
+        """Validate and store a batch of measurements in one transaction.
+
+        Invalid items are reported in the result and skipped, the remaining
+        items are written with multi-row INSERTs. Items whose ID already
+        exists replace the stored measurement, like create_measurement, and
+        are rejected if it belongs to another user.
+        """
+        results = []
+        valid = []
+        seen_ids = set()
+        
+        for index, measurement_schema in enumerate(measurement_schemas):
+            self._canonicalize_keys(measurement_schema)
+            try:
+                if measurement_schema.id in seen_ids:
+                    raise ValueError(f"Duplicate measurement id '{measurement_schema.id}' in batch")
+                if not is_valid_key(measurement_schema.id):
+                    raise ValueError(f"Invalid measurement id '{measurement_schema.id}', expected a UUID")
+                definitions = self._validate_measurement(measurement_schema)
+            except ValueError as e:
+                results.append(BatchItemResult(index=index, id=measurement_schema.id, status="error", detail=str(e)))
+                continue
             
-            # Add values
-            for value_schema in measurement_schema.values:
-                # Find value definition
-                value_def = self.db.query(ValueDefinition).join(
-                    MeasurementTemplate
-                ).filter(
-                    ValueDefinition.name == value_schema.definition_name,
-                    MeasurementTemplate.id == measurement_schema.template_id
-                ).first()
-                
-                if not value_def:
-                    raise ValueError(f"Value definition '{value_schema.definition_name}' not found for template '{measurement_schema.template_id}'")
-                
-                # Create measurement value
-                value = MeasurementValue(
-                    definition_id=value_def.id,
-                    measurement_id=measurement.id,
-                    value=value_schema.value
+            seen_ids.add(measurement_schema.id)
+            valid.append((index, measurement_schema, definitions))
+        
+        ensure_partitions(self.db, [measurement_schema.measured_at for _, measurement_schema, _ in valid])
+        stored = self._stored_measurements([measurement_schema.id for _, measurement_schema, _ in valid])
+        owned = []
+        for index, measurement_schema, definitions in valid:
+            try:
+                self._check_owner(measurement_schema, stored)
+            except ValueError as e:
+                results.append(BatchItemResult(index=index, id=measurement_schema.id, status="error", detail=str(e)))
+                continue
+            owned.append((index, measurement_schema, definitions))
+        valid = owned
+        
+        try:
+            statuses, changes = self._store_measurements([(m, definitions) for _, m, definitions in valid], stored)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        self._invalidate_statistics(changes)
+        
+        for index, measurement_schema, _ in valid:
+            results.append(BatchItemResult(index=index, id=measurement_schema.id, status=statuses[measurement_schema.id]))
+        results.sort(key=lambda result: result.index)
+        
+        created = sum(1 for status in statuses.values() if status == "created")
+        return BatchResult(
+            created=created,
+            updated=len(statuses) - created,
+            failed=len(measurement_schemas) - len(valid),
+            results=results
+        )
+    
+    @staticmethod
+    def _canonicalize_keys(measurement_schema: MeasurementSchema) -> None:
+        """Spell the ids as they are stored, so that lookups and locks match them."""
+        measurement_schema.id = canonical_key(measurement_schema.id)
+        measurement_schema.template_id = canonical_key(measurement_schema.template_id)
+    
+    @staticmethod
+    def _normalize_times(measurement_schema: MeasurementSchema) -> None:
+        """Store timestamps as naive UTC, async drivers reject aware values for timestamp columns."""
+        measurement_schema.measured_at = normalize(measurement_schema.measured_at)
+        measurement_schema.recorded_at = normalize(measurement_schema.recorded_at)
+    
+    @staticmethod
+    def _check_owner(measurement_schema: MeasurementSchema, stored: Dict[str, Row]) -> None:
+        previous = stored.get(measurement_schema.id)
+        if previous is not None and previous.user_id != measurement_schema.user_id:
+            raise ValueError(f"Measurement '{measurement_schema.id}' belongs to another user")
+    
+    def _store_measurements(
+        self,
+        items: List[Tuple[MeasurementSchema, List[DefinitionInfo]]],
+        stored: Optional[Dict[str, Row]] = None
+    ) -> Tuple[Dict[str, str], Set[Tuple[str, str, datetime]]]:
+        """Write validated measurements in the session's transaction.
+
+        Takes the _stored_measurements of the items if the caller already
+        has them. Returns id -> created or updated, and the (template_id,
+        user_id, measured_at) of the values that were added, changed or
+        removed.
+
+        New measurements are inserted. A stored measurement with an unchanged
+        measured_at is diffed against the input: only changed columns are
+        updated, changed and new values are upserted with ON CONFLICT and
+        values that are gone are deleted, and its rollups are only
+        recomputed if a value or its template changed. A new measured_at
+        changes the (id, measured_at) key of all its rows, so such a
+        measurement is rewritten as a whole. Timestamps of the items are
+        converted to naive UTC in place first, like the stored ones, so an
+        unchanged measurement sent with a UTC offset is not taken as moved.
+        The caller creates the partitions of the items' months beforehand
+        with ensure_partitions, and commits.
+        """
+        for measurement_schema, _ in items:
+            self._normalize_times(measurement_schema)
+        wide = uses_wide_layout()
+        if stored is None:
+            stored = self._stored_measurements([measurement_schema.id for measurement_schema, _ in items])
+        stored_values = {} if wide else self._stored_values([
+            measurement_schema.id for measurement_schema, _ in items
+            if measurement_schema.id in stored
+            and stored[measurement_schema.id].measured_at == measurement_schema.measured_at
+        ])
+        
+        statuses = {}
+        touched: Set[RollupKey] = set()
+        changes: Set[Tuple[str, str, datetime]] = set()
+        measurement_rows = []  # New measurements
+        updated_rows = []      # Stored measurements whose columns change
+        moved_ids = []         # Stored measurements with a new measured_at
+        value_rows = []        # Values of new and moved measurements
+        upserted_values = []
+        deleted_values = []
+        for measurement_schema, definitions in items:
+            values = {
+                definition.id: value_schema.value
+                for value_schema, definition in zip(measurement_schema.values, definitions)
+            }
+            rows = [
+                {
+                    "id": str(uuid.uuid4()),
+                    "definition_id": definition_id,
+                    "measurement_id": measurement_schema.id,
+                    "measured_at": measurement_schema.measured_at,
+                    "value": value,
+                }
+                for definition_id, value in values.items()
+            ]
+            row = {
+                "id": measurement_schema.id,
+                "template_id": measurement_schema.template_id,
+                "measured_at": measurement_schema.measured_at,
+                "notes": measurement_schema.notes,
+                "user_id": measurement_schema.user_id,
+            }
+            if wide:
+                row["definition_values"] = values
+            
+            previous = stored.get(measurement_schema.id)
+            if previous is None:
+                row["recorded_at"] = measurement_schema.recorded_at
+                measurement_rows.append(row)
+                value_rows.extend(rows)
+                changes.add((measurement_schema.template_id, measurement_schema.user_id, measurement_schema.measured_at))
+                statuses[measurement_schema.id] = "created"
+                continue
+            
+            statuses[measurement_schema.id] = "updated"
+            replaced = {
+                (previous.template_id, previous.user_id, previous.measured_at),
+                (measurement_schema.template_id, measurement_schema.user_id, measurement_schema.measured_at),
+            }
+            keys = {(template_id, measured_at.date()) for template_id, _, measured_at in replaced}
+            if previous.measured_at != measurement_schema.measured_at:
+                moved_ids.append(measurement_schema.id)
+                updated_rows.append(row)
+                value_rows.extend(rows)
+                touched |= keys
+                changes |= replaced
+                continue
+            
+            if wide:
+                values_changed = previous.definition_values != values
+            else:
+                current = stored_values.get(measurement_schema.id, {})
+                changed = [value_row for value_row in rows if current.get(value_row["definition_id"]) != value_row["value"]]
+                removed = [
+                    {"measurement_id": measurement_schema.id, "definition_id": definition_id}
+                    for definition_id in current if definition_id not in values
+                ]
+                upserted_values.extend(changed)
+                deleted_values.extend(removed)
+                values_changed = bool(changed or removed)
+            
+            # The wide layout keeps the values in the measurement row
+            if (wide and values_changed) or any(
+                row[column] != getattr(previous, column) for column in ("template_id", "notes", "user_id")
+            ):
+                updated_rows.append(row)
+            if values_changed or previous.template_id != measurement_schema.template_id:
+                touched |= keys
+                changes |= replaced
+        
+        if moved_ids and not wide:
+            # The values reference the old (id, measured_at) key and are written again below
+            for start in range(0, len(moved_ids), ID_CHUNK_SIZE):
+                self.db.execute(
+                    delete(MeasurementValue).where(MeasurementValue.measurement_id.in_(moved_ids[start:start + ID_CHUNK_SIZE]))
                 )
-                self.db.add(value)
+        if updated_rows:
+            # Match on id alone, measured_at is part of the key and may change
+            measurements = Measurement.__table__
+            self.db.execute(
+                update(measurements).where(measurements.c.id == bindparam("measurement_id")),
+                [
+                    {"measurement_id": row["id"], **{key: value for key, value in row.items() if key != "id"}}
+                    for row in updated_rows
+                ]
+            )
+        if deleted_values:
+            values = MeasurementValue.__table__
+            self.db.execute(
+                delete(values).where(
+                    values.c.measurement_id == bindparam("measurement_id"),
+                    values.c.definition_id == bindparam("definition_id")
+                ),
+                deleted_values
+            )
+        if upserted_values:
+            self._upsert_values(upserted_values)
         
-        self.db.commit()
+        write_measurement_rows(self.db, measurement_rows, value_rows)
+        add_to_rollups(self.db, measurement_rows, value_rows)
+        refresh_rollups(self.db, touched)
+        bump_versions(self.db, [measurements_scope(template_id, user_id) for template_id, user_id, _ in changes])
+        return statuses, changes
+    
+    def _invalidate_statistics(self, changes: Set[Tuple[str, str, datetime]]) -> None:
+        """Drop the cached statistics windows the committed changes fall into."""
+        by_user: Dict[Tuple[str, str], List[datetime]] = {}
+        for template_id, user_id, measured_at in changes:
+            by_user.setdefault((template_id, user_id), []).append(measured_at)
+        for (template_id, user_id), timestamps in by_user.items():
+            self.stats_cache.invalidate(template_id, timestamps, user_id)
+    
+    def _upsert_values(self, value_rows: List[Dict[str, Any]]) -> None:
+        """Insert values, or overwrite the value stored for the same measurement and definition."""
+        if self.db.get_bind().dialect.name == "postgresql":
+            statement = postgresql.insert(MeasurementValue)
+        else:
+            statement = sqlite.insert(MeasurementValue)
+        
+        table = MeasurementValue.__table__
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.measurement_id, table.c.definition_id, table.c.measured_at],
+            set_={"value": statement.excluded.value}
+        )
+        self.db.execute(statement, value_rows)
+    
+    def _validate_measurement(self, measurement_schema: MeasurementSchema) -> List[DefinitionInfo]:
+        """Check a measurement against its template and return its value definitions."""
+        entry = self.get_template_entry(measurement_schema.template_id)
+        if not entry:
+            raise ValueError(f"Template '{measurement_schema.template_id}' not found")
+        
+        definitions = self._resolve_definitions(measurement_schema)
+        
+        missing = set(entry.definitions) - {v.definition_name for v in measurement_schema.values}
+        if missing:
+            raise ValueError(f"Missing required values: {missing}")
         
-        return self._convert_measurement_to_schema(measurement)
+        return definitions
+    
+    def _stored_measurements(self, measurement_ids: List[str]) -> Dict[str, Row]:
+        """Map the ids that are already stored to their current columns.
+
+        Locks the ids for the rest of the transaction on Postgres, where the
+        partitioned tables cannot enforce unique ids, see db/partitions.py.
+        """
+        lock_measurement_ids(self.db, measurement_ids)
+        stored = {}
+        for start in range(0, len(measurement_ids), ID_CHUNK_SIZE):
+            query = select(
+                Measurement.id,
+                Measurement.template_id,
+                Measurement.measured_at,
+                Measurement.notes,
+                Measurement.user_id,
+                Measurement.definition_values,
+            ).where(Measurement.id.in_(measurement_ids[start:start + ID_CHUNK_SIZE]))
+            for row in self.db.execute(query):
+                stored[row.id] = row
+        return stored
+    
+    def _stored_values(self, measurement_ids: List[str]) -> Dict[str, Dict[str, float]]:
+        """Map measurement ids to their stored definition id -> value."""
+        values: Dict[str, Dict[str, float]] = {}
+        for start in range(0, len(measurement_ids), ID_CHUNK_SIZE):
+            query = select(
+                MeasurementValue.measurement_id, MeasurementValue.definition_id, MeasurementValue.value
+            ).where(MeasurementValue.measurement_id.in_(measurement_ids[start:start + ID_CHUNK_SIZE]))
+            for measurement_id, definition_id, value in self.db.execute(query):
+                values.setdefault(measurement_id, {})[definition_id] = value
+        return values
+    
+    def _resolve_definitions(self, measurement_schema: MeasurementSchema) -> List[DefinitionInfo]:
+        """Map each value of the measurement to its definition via the template registry."""
+        entry = self.get_template_entry(measurement_schema.template_id)
+        
+        definitions = []
+        for value_schema in measurement_schema.values:
+            definition = entry.definitions.get(value_schema.definition_name) if entry else None
+            
+            if not definition:
+                raise ValueError(f"Value definition '{value_schema.definition_name}' not found for template '{measurement_schema.template_id}'")
+            if definition in definitions:
+                raise ValueError(f"Duplicate value for definition '{value_schema.definition_name}'")
+            
+            definitions.append(definition)
+        
+        return definitions
     
     def _convert_template_to_schema(self, template: MeasurementTemplate) -> MeasurementTemplateSchema:
         value_definitions = []
         
         for value_def in template.value_definitions:
+            if not value_def.is_active:
+                continue
+            
             unit_schema = UnitSchema(
                 name=value_def.unit.name,
                 display_name=value_def.unit.display_name,
@@ -262,28 +1148,225 @@ class Database:
             owner_id=template.owner_id
         )
     
-    def _convert_measurement_to_schema(self, measurement: Measurement) -> MeasurementSchema:
-        values = []
+    @staticmethod
+    def _measurement_rows_query(
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> Select:
+        """Flat measurement/value/definition-name join, one row per value.
+
+        Measurements without values still yield a single row with NULL value
+        columns, so the result can be folded back into schemas in one pass.
+        Values are joined on (measurement_id, measured_at) and the window is
+        repeated on their side, so Postgres prunes the value partitions too.
+        In the wide layout the last column is definition_values instead, and
+        _execute_rows expands each row into the same shape.
+        """
+        columns = [
+            Measurement.id,
+            Measurement.template_id,
+            Measurement.measured_at,
+            Measurement.recorded_at,
+            Measurement.notes,
+            Measurement.user_id,
+        ]
+        if uses_wide_layout():
+            return select(*columns, Measurement.definition_values)
         
-        for value in measurement.values:
-            value_schema = MeasurementValueSchema(
-                definition_name=value.definition.name,
-                value=value.value
-            )
-            
-            values.append(value_schema)
-        
-        return MeasurementSchema(
-            id=measurement.id,
-            template_id=measurement.template_id,
-            values=values,
-            measured_at=measurement.measured_at,
-            recorded_at=measurement.recorded_at,
-            notes=measurement.notes,
-            user_id=measurement.user_id
+        value_join = and_(
+            MeasurementValue.measurement_id == Measurement.id,
+            MeasurementValue.measured_at == Measurement.measured_at
         )
+        start_date, end_date = normalize(start_date), normalize(end_date)
+        if start_date:
+            value_join = and_(value_join, MeasurementValue.measured_at >= start_date)
+        if end_date:
+            value_join = and_(value_join, MeasurementValue.measured_at <= end_date)
+        
+        return select(
+            *columns,
+            ValueDefinition.name,
+            MeasurementValue.value,
+        ).outerjoin(
+            MeasurementValue, value_join
+        ).outerjoin(
+            ValueDefinition, ValueDefinition.id == MeasurementValue.definition_id
+        )
+    
+    def _execute_rows(self, query: Select) -> Iterable[tuple]:
+        """Run a _measurement_rows_query, one row per value in either layout."""
+        if not uses_wide_layout():
+            return self.db.execute(query)
+        
+        names = self._definition_names()
+        return [
+            value_row
+            for row in self.db.execute(query)
+            for value_row in self._expand_wide_row(row, names)
+        ]
+    
+    def _definition_names(self) -> Dict[str, str]:
+        """Map every value definition id to its name."""
+        return dict(self.db.execute(select(ValueDefinition.id, ValueDefinition.name)).all())
+    
+    @staticmethod
+    def _expand_wide_row(row: Row, names: Dict[str, str]) -> List[tuple]:
+        """Split a wide row into rows shaped like the eav join, one per value."""
+        *measurement, definition_values = row
+        if not definition_values:
+            return [(*measurement, None, None)]
+        return [
+            (*measurement, names.get(definition_id), value)
+            for definition_id, value in definition_values.items()
+        ]
+    
+    @staticmethod
+    def _fold_measurement_rows(rows: Iterable[Row]) -> Iterator[MeasurementSchema]:
+        """Fold rows from _measurement_rows_query into measurement schemas.
+
+        Rows belonging to the same measurement must be adjacent.
+        """
+        for _, group in groupby(rows, key=itemgetter(0)):
+            group = list(group)
+            first = group[0]
+            
+            values = [
+                MeasurementValueSchema(definition_name=row[6], value=row[7])
+                for row in group
+                if row[6] is not None
+            ]
+            
+            yield MeasurementSchema(
+                id=first[0],
+                template_id=first[1],
+                values=values,
+                measured_at=first[2],
+                recorded_at=first[3],
+                notes=first[4],
+                user_id=first[5]
+            )
+
+
+class AsyncDatabase:
+    """Async storage API used by the FastAPI handlers.
+
+    Each method runs the corresponding Database method through
+    AsyncSession.run_sync, so the storage logic is shared with the sync path
+    while every round-trip awaits the async driver instead of blocking the
+    event loop.
+    """
+    def __init__(
+        self,
+        db: AsyncSession,
+        registry: Optional[TemplateRegistry] = None,
+        stats_cache: Optional[StatisticsCache] = None
+    ):
+        self.db = db
+        self.registry = registry if registry is not None else template_registry
+        self.stats_cache = stats_cache if stats_cache is not None else statistics_cache
+    
+    async def _run(self, method: str, *args, **kwargs):
+        def call(session: Session):
+            return getattr(Database(session, self.registry, self.stats_cache), method)(*args, **kwargs)
+        return await self.db.run_sync(call)
+    
+    async def get_data_versions(self, scopes: List[str]) -> Dict[str, str]:
+        return await self._run("get_data_versions", scopes)
+    
+    async def get_templates(self) -> List[MeasurementTemplateSchema]:
+        return await self._run("get_templates")
+    
+    async def get_template(self, template_id: str) -> Optional[MeasurementTemplateSchema]:
+        return await self._run("get_template", template_id)
+    
+    async def create_template(self, template_schema: MeasurementTemplateSchema) -> MeasurementTemplateSchema:
+        return await self._run("create_template", template_schema)
+    
+    async def get_measurements(
+        self,
+        template_id: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        user_id: Optional[str] = None
+    ) -> List[MeasurementSchema]:
+        return await self._run("get_measurements", template_id, start_date, end_date, user_id)
+    
+    async def get_measurements_page(
+        self,
+        template_id: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        user_id: Optional[str] = None
+    ) -> Tuple[List[MeasurementSchema], Optional[str]]:
+        return await self._run("get_measurements_page", template_id, start_date, end_date, limit, cursor, user_id)
+    
+    async def iter_measurement_rows(
+        self,
+        template_id: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        batch_size: int = 1000,
+        user_id: Optional[str] = None
+    ) -> AsyncIterator[Row]:
+        """Async counterpart of Database.iter_measurement_rows."""
+        query = Database._export_rows_query(template_id, start_date, end_date, user_id)
+        names = await self._run("_definition_names") if uses_wide_layout() else None
+        
+        result = await self.db.stream(query.execution_options(yield_per=batch_size))
+        try:
+            async for row in result:
+                if names is None:
+                    yield row
+                else:
+                    for value_row in Database._expand_wide_row(row, names):
+                        yield value_row
+        finally:
+            await result.close()
+    
+    async def get_measurement(self, measurement_id: str, user_id: Optional[str] = None) -> Optional[MeasurementSchema]:
+        return await self._run("get_measurement", measurement_id, user_id)
+    
+    async def create_measurement(self, measurement_schema: MeasurementSchema) -> MeasurementSchema:
+        return await self._run("create_measurement", measurement_schema)
+    
+    async def create_measurements_bulk(self, measurement_schemas: List[MeasurementSchema]) -> BatchResult:
+        return await self._run("create_measurements_bulk", measurement_schemas)
+    
+    async def get_statistics(
+        self,
+        template_id: str,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        user_id: Optional[str] = None,
+        percentiles: bool = False,
+        cache: bool = True
+    ) -> Optional[Dict[str, Dict[str, Any]]]:
+        return await self._run("get_statistics", template_id, start_date, end_date, user_id, percentiles, cache)
+    
+    async def get_statistics_series(
+        self,
+        template_id: str,
+        bucket: BucketSize,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        user_id: Optional[str] = None
+    ) -> Optional[Dict[str, Dict[str, Any]]]:
+        return await self._run("get_statistics_series", template_id, bucket, start_date, end_date, user_id)
+    
+    async def get_measurement_series(
+        self,
+        template_id: str,
+        start_date: datetime,
+        end_date: datetime,
+        points: int,
+        method: SeriesMethod = SeriesMethod.lttb,
+        user_id: Optional[str] = None
+    ) -> Optional[Dict[str, Dict[str, Any]]]:
+        return await self._run("get_measurement_series", template_id, start_date, end_date, points, method, user_id)
 
 
 # Dependency for FastAPI
-def get_storage(db: Session = Depends(get_db)):
-    return Database(db)
\ No newline at end of file
+def get_storage(db: AsyncSession = Depends(get_async_db)):
+    return AsyncDatabase(db)
\ No newline at end of file
@@ -0,0 +1,58 @@
+"""
+Data versions behind the API's ETags
+
+data_versions holds one opaque version per scope, replaced in the
+transaction of every write that changes what the scope's responses return.
+Reading the versions is a primary key lookup, so a conditional GET whose
+ETag is still current is answered without loading or serializing anything.
+Versions are random rather than counters, so a recreated database never
+repeats the ETags of an earlier one.
+"""
+import uuid
+from typing import Dict, Iterable
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from db.models import DataVersion
+
+# Active templates as returned by GET /templates
+TEMPLATES = "templates"
+
+
+def template_scope(template_id: str) -> str:
+    """One template and its value definitions."""
+    return f"template:{template_id}"
+
+
+def measurements_scope(template_id: str, user_id: str) -> str:
+    """The measurements and values of one user and template, and so their statistics."""
+    return f"measurements:{template_id}:{user_id}"
+
+
+def bump_versions(db: Session, scopes: Iterable[str]) -> None:
+    """Give the scopes new versions in the session's transaction, the caller commits."""
+    # Sorted, so concurrent writers lock the rows in the same order
+    rows = [{"scope": scope, "version": uuid.uuid4().hex} for scope in sorted(set(scopes))]
+    if not rows:
+        return
+    
+    if db.get_bind().dialect.name == "postgresql":
+        statement = postgresql.insert(DataVersion)
+    else:
+        statement = sqlite.insert(DataVersion)
+    statement = statement.on_conflict_do_update(
+        index_elements=[DataVersion.__table__.c.scope],
+        set_={"version": statement.excluded.version}
+    )
+    db.execute(statement, rows)
+
+
+def get_versions(db: Session, scopes: Iterable[str]) -> Dict[str, str]:
+    """Map each scope to its version, "" for scopes that were never written."""
+    scopes = list(scopes)
+    versions = dict.fromkeys(scopes, "")
+    table = DataVersion.__table__
+    versions.update(db.execute(select(table.c.scope, table.c.version).where(table.c.scope.in_(scopes))).all())
+    return versions
@@ -0,0 +1,42 @@
+"""Add indexes for the hot query shapes
+
+Revision ID: 3f1c2a7b9d10
+Revises:
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7b9d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ("ix_measurements_template_id_measured_at_id", "measurements", ["template_id", "measured_at", "id"]),
+    ("ix_measurements_measured_at_id", "measurements", ["measured_at", "id"]),
+    ("ix_measurement_values_measurement_id", "measurement_values", ["measurement_id"]),
+    ("ix_measurement_values_definition_id", "measurement_values", ["definition_id"]),
+    ("ix_value_definitions_template_id", "value_definitions", ["template_id"]),
+    ("ix_units_name", "units", ["name"]),
+]
+
+
+def upgrade() -> None:
+    # Tables created by Base.metadata.create_all already have these indexes,
+    # so only missing ones are built. CONCURRENTLY keeps Postgres tables
+    # writable while the indexes are built and requires running outside a
+    # transaction.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, if_not_exists=True, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
@@ -0,0 +1,54 @@
+"""Add measurement_daily_rollups and backfill it from the raw values
+
+Revision ID: 8b2d4e6f1a37
+Revises: 3f1c2a7b9d10
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2d4e6f1a37'
+down_revision = '3f1c2a7b9d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Databases created by Base.metadata.create_all already have the table
+    if not sa.inspect(op.get_bind()).has_table('measurement_daily_rollups'):
+        op.create_table(
+            'measurement_daily_rollups',
+            sa.Column('definition_id', sa.String(), sa.ForeignKey('value_definitions.id'), primary_key=True),
+            sa.Column('day', sa.Date(), primary_key=True),
+            sa.Column('template_id', sa.String(), sa.ForeignKey('measurement_templates.id'), nullable=False),
+            sa.Column('count', sa.Integer(), nullable=False),
+            sa.Column('total', sa.Float(), nullable=False),
+            sa.Column('total_sq', sa.Float(), nullable=False),
+            sa.Column('minimum', sa.Float(), nullable=False),
+            sa.Column('maximum', sa.Float(), nullable=False),
+        )
+    op.create_index(
+        'ix_measurement_daily_rollups_template_id_day', 'measurement_daily_rollups',
+        ['template_id', 'day'], if_not_exists=True
+    )
+
+    # Rebuild from the raw values, an existing table may be empty or stale
+    day = 'CAST(m.measured_at AS DATE)' if op.get_bind().dialect.name == 'postgresql' else 'date(m.measured_at)'
+    op.execute('DELETE FROM measurement_daily_rollups')
+    op.execute(f"""
+        INSERT INTO measurement_daily_rollups
+            (definition_id, day, template_id, count, total, total_sq, minimum, maximum)
+        SELECT v.definition_id, {day}, m.template_id,
+               COUNT(v.value), SUM(v.value), SUM(v.value * v.value), MIN(v.value), MAX(v.value)
+        FROM measurement_values v
+        JOIN measurements m ON m.id = v.measurement_id
+        GROUP BY v.definition_id, {day}, m.template_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_measurement_daily_rollups_template_id_day', table_name='measurement_daily_rollups', if_exists=True)
+    op.drop_table('measurement_daily_rollups')
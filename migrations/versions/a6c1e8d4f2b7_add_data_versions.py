@@ -0,0 +1,31 @@
+"""Add data_versions for the ETags of templates and statistics
+
+Revision ID: a6c1e8d4f2b7
+Revises: f3a7d2c9b4e1
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6c1e8d4f2b7'
+down_revision = 'f3a7d2c9b4e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Databases created by Base.metadata.create_all already have the table.
+    # Scopes without a row have the version "", the first write gives them one.
+    if not sa.inspect(op.get_bind()).has_table('data_versions'):
+        op.create_table(
+            'data_versions',
+            sa.Column('scope', sa.String(), primary_key=True),
+            sa.Column('version', sa.String(), nullable=False),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('data_versions')
@@ -0,0 +1,97 @@
+"""Index measurements by user and keep daily rollups per user
+
+Revision ID: b8d3f5a7c9e2
+Revises: a6c1e8d4f2b7
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d3f5a7c9e2'
+down_revision = 'a6c1e8d4f2b7'
+branch_labels = None
+depends_on = None
+
+
+ROLLUPS = 'measurement_daily_rollups'
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, 'false').lower() in ('1', 'true', 'yes')
+
+
+def _recreate_rollups(by_user: bool) -> None:
+    # The primary key changes, so the table is recreated and rebuilt from the raw values
+    bind = op.get_bind()
+    postgres = bind.dialect.name == 'postgresql'
+    types = {column['name']: column['type'] for column in sa.inspect(bind).get_columns(ROLLUPS)}
+
+    op.drop_index('ix_measurement_daily_rollups_template_id_day', table_name=ROLLUPS, if_exists=True)
+    op.drop_index('ix_measurement_daily_rollups_user_id_template_id_day', table_name=ROLLUPS, if_exists=True)
+    op.drop_table(ROLLUPS)
+
+    user_column = [sa.Column('user_id', sa.String(), primary_key=True)] if by_user else []
+    op.create_table(
+        ROLLUPS,
+        sa.Column('definition_id', types['definition_id'], sa.ForeignKey('value_definitions.id'), primary_key=True),
+        *user_column,
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('template_id', types['template_id'], sa.ForeignKey('measurement_templates.id'), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Float(), nullable=False),
+        sa.Column('total_sq', sa.Float(), nullable=False),
+        sa.Column('minimum', sa.Float(), nullable=False),
+        sa.Column('maximum', sa.Float(), nullable=False),
+    )
+    op.create_index('ix_measurement_daily_rollups_template_id_day', ROLLUPS, ['template_id', 'day'])
+    if by_user:
+        op.create_index(
+            'ix_measurement_daily_rollups_user_id_template_id_day', ROLLUPS, ['user_id', 'template_id', 'day']
+        )
+
+    day = 'CAST(m.measured_at AS DATE)' if postgres else 'date(m.measured_at)'
+    if os.getenv('DB_VALUE_LAYOUT', 'eav') == 'wide':
+        if postgres:
+            definition_id = f"e.key::{'uuid' if _env_flag('DB_COMPACT_KEYS') else 'text'}"
+            value, source = 'e.value::float', 'measurements m, jsonb_each_text(m.definition_values) e'
+        else:
+            definition_id = "replace(e.key, '-', '')" if _env_flag('DB_COMPACT_KEYS') else 'e.key'
+            value, source = 'e.value', 'measurements m, json_each(m.definition_values) e'
+    else:
+        definition_id, value = 'v.definition_id', 'v.value'
+        source = 'measurement_values v JOIN measurements m ON m.id = v.measurement_id AND m.measured_at = v.measured_at'
+
+    keys = f"{definition_id}, {'m.user_id, ' if by_user else ''}{day}, m.template_id"
+    op.execute(f"""
+        INSERT INTO {ROLLUPS} (definition_id, {'user_id, ' if by_user else ''}day, template_id,
+                               count, total, total_sq, minimum, maximum)
+        SELECT {keys}, COUNT({value}), SUM({value}), SUM({value} * {value}), MIN({value}), MAX({value})
+        FROM {source}
+        GROUP BY {keys}
+    """)
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_measurements_user_id_template_id_measured_at_id', 'measurements',
+        ['user_id', 'template_id', 'measured_at', 'id'], if_not_exists=True
+    )
+    op.create_index(
+        'ix_measurements_user_id_measured_at_id', 'measurements',
+        ['user_id', 'measured_at', 'id'], if_not_exists=True
+    )
+
+    # Databases created by Base.metadata.create_all already have the per-user rollups
+    if 'user_id' not in {column['name'] for column in sa.inspect(op.get_bind()).get_columns(ROLLUPS)}:
+        _recreate_rollups(by_user=True)
+
+
+def downgrade() -> None:
+    _recreate_rollups(by_user=False)
+    op.drop_index('ix_measurements_user_id_measured_at_id', table_name='measurements', if_exists=True)
+    op.drop_index('ix_measurements_user_id_template_id_measured_at_id', table_name='measurements', if_exists=True)
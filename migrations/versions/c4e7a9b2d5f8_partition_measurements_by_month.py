@@ -0,0 +1,166 @@
+"""Partition measurements and measurement_values by month of measured_at
+
+Revision ID: c4e7a9b2d5f8
+Revises: 8b2d4e6f1a37
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e7a9b2d5f8'
+down_revision = '8b2d4e6f1a37'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ("ix_measurements_template_id_measured_at_id", "measurements", ["template_id", "measured_at", "id"]),
+    ("ix_measurements_measured_at_id", "measurements", ["measured_at", "id"]),
+    ("ix_measurement_values_measurement_id", "measurement_values", ["measurement_id"]),
+    ("ix_measurement_values_definition_id", "measurement_values", ["definition_id"]),
+]
+
+# Months created after the current one, later months are created on demand
+MONTHS_AHEAD = 3
+
+
+def _month_of(value: datetime) -> date:
+    return date(value.year, value.month, 1)
+
+
+def _next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _create_partitioned_tables() -> None:
+    op.create_table(
+        'measurements',
+        sa.Column('id', sa.String(), primary_key=True),
+        sa.Column('template_id', sa.String(), sa.ForeignKey('measurement_templates.id'), nullable=False),
+        sa.Column('measured_at', sa.DateTime(), primary_key=True),
+        sa.Column('recorded_at', sa.DateTime(), nullable=False),
+        sa.Column('notes', sa.String(), nullable=True),
+        sa.Column('user_id', sa.String(), nullable=False),
+        postgresql_partition_by='RANGE (measured_at)'
+    )
+    op.create_table(
+        'measurement_values',
+        sa.Column('id', sa.String(), primary_key=True),
+        sa.Column('definition_id', sa.String(), sa.ForeignKey('value_definitions.id'), nullable=False),
+        sa.Column('measurement_id', sa.String(), nullable=False),
+        sa.Column('measured_at', sa.DateTime(), primary_key=True),
+        sa.Column('value', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['measurement_id', 'measured_at'], ['measurements.id', 'measurements.measured_at']),
+        postgresql_partition_by='RANGE (measured_at)'
+    )
+
+
+def _rename_tables(suffix: str) -> None:
+    # Primary key indexes share the schema namespace and have to move out of the way
+    for table in ('measurement_values', 'measurements'):
+        op.execute(f'ALTER TABLE {table} RENAME TO {table}{suffix}')
+        op.execute(f'ALTER TABLE {table}{suffix} RENAME CONSTRAINT {table}_pkey TO {table}{suffix}_pkey')
+    for name, _, _ in INDEXES:
+        op.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        # No partitioning elsewhere, values only gain their copy of measured_at
+        if 'measured_at' in {column['name'] for column in sa.inspect(bind).get_columns('measurement_values')}:
+            return
+        with op.batch_alter_table('measurement_values') as batch:
+            batch.add_column(sa.Column('measured_at', sa.DateTime(), nullable=True))
+        op.execute("""
+            UPDATE measurement_values SET measured_at = (
+                SELECT measured_at FROM measurements WHERE measurements.id = measurement_values.measurement_id
+            )
+        """)
+        return
+
+    if bind.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'measurements'::regclass"
+    )).first():
+        # Created partitioned by Base.metadata.create_all
+        return
+
+    _rename_tables('_unpartitioned')
+    _create_partitioned_tables()
+
+    # One partition per month from the oldest measurement to a few months ahead
+    now = datetime.utcnow()
+    oldest, newest = bind.execute(sa.text(
+        'SELECT MIN(measured_at), MAX(measured_at) FROM measurements_unpartitioned'
+    )).one()
+    month = _month_of(oldest or now)
+    last = _month_of(now)
+    for _ in range(MONTHS_AHEAD):
+        last = _next_month(last)
+    if newest is not None:
+        last = max(last, _month_of(newest))
+    while month <= last:
+        for table in ('measurements', 'measurement_values'):
+            op.execute(
+                f"CREATE TABLE {table}_y{month.year:04d}m{month.month:02d} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+            )
+        month = _next_month(month)
+
+    op.execute("""
+        INSERT INTO measurements (id, template_id, measured_at, recorded_at, notes, user_id)
+        SELECT id, template_id, measured_at, recorded_at, notes, user_id FROM measurements_unpartitioned
+    """)
+    op.execute("""
+        INSERT INTO measurement_values (id, definition_id, measurement_id, measured_at, value)
+        SELECT v.id, v.definition_id, v.measurement_id, m.measured_at, v.value
+        FROM measurement_values_unpartitioned v
+        JOIN measurements_unpartitioned m ON m.id = v.measurement_id
+    """)
+    op.execute('DROP TABLE measurement_values_unpartitioned')
+    op.execute('DROP TABLE measurements_unpartitioned')
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        with op.batch_alter_table('measurement_values') as batch:
+            batch.drop_column('measured_at')
+        return
+
+    _rename_tables('_partitioned')
+    op.create_table(
+        'measurements',
+        sa.Column('id', sa.String(), primary_key=True),
+        sa.Column('template_id', sa.String(), sa.ForeignKey('measurement_templates.id'), nullable=False),
+        sa.Column('measured_at', sa.DateTime(), nullable=False),
+        sa.Column('recorded_at', sa.DateTime(), nullable=False),
+        sa.Column('notes', sa.String(), nullable=True),
+        sa.Column('user_id', sa.String(), nullable=False),
+    )
+    op.create_table(
+        'measurement_values',
+        sa.Column('id', sa.String(), primary_key=True),
+        sa.Column('definition_id', sa.String(), sa.ForeignKey('value_definitions.id'), nullable=False),
+        sa.Column('measurement_id', sa.String(), sa.ForeignKey('measurements.id'), nullable=False),
+        sa.Column('value', sa.Float(), nullable=False),
+    )
+    op.execute("""
+        INSERT INTO measurements (id, template_id, measured_at, recorded_at, notes, user_id)
+        SELECT id, template_id, measured_at, recorded_at, notes, user_id FROM measurements_partitioned
+    """)
+    op.execute("""
+        INSERT INTO measurement_values (id, definition_id, measurement_id, value)
+        SELECT id, definition_id, measurement_id, value FROM measurement_values_partitioned
+    """)
+    # Dropping the partitioned parents drops their partitions
+    op.execute('DROP TABLE measurement_values_partitioned')
+    op.execute('DROP TABLE measurements_partitioned')
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
@@ -0,0 +1,91 @@
+"""Keep a quantile sketch in every daily rollup
+
+Revision ID: c4e9a1b7d3f6
+Revises: b8d3f5a7c9e2
+Create Date: 2026-10-18 22:00:00.000000
+
+"""
+import json
+import os
+from itertools import groupby
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from db.sketches import DDSketch
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e9a1b7d3f6'
+down_revision = 'b8d3f5a7c9e2'
+branch_labels = None
+depends_on = None
+
+
+ROLLUPS = 'measurement_daily_rollups'
+
+# Rollups updated per statement while backfilling
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, 'false').lower() in ('1', 'true', 'yes')
+
+
+def _backfill_sketches() -> None:
+    # Sketches are built in Python from the raw values, one rollup at a time
+    bind = op.get_bind()
+    postgres = bind.dialect.name == 'postgresql'
+
+    day = 'CAST(m.measured_at AS DATE)' if postgres else 'date(m.measured_at)'
+    if os.getenv('DB_VALUE_LAYOUT', 'eav') == 'wide':
+        if postgres:
+            definition_id = f"e.key::{'uuid' if _env_flag('DB_COMPACT_KEYS') else 'text'}"
+            value, source = 'e.value::float', 'measurements m, jsonb_each_text(m.definition_values) e'
+        else:
+            definition_id = "replace(e.key, '-', '')" if _env_flag('DB_COMPACT_KEYS') else 'e.key'
+            value, source = 'e.value', 'measurements m, json_each(m.definition_values) e'
+    else:
+        definition_id, value = 'v.definition_id', 'v.value'
+        source = 'measurement_values v JOIN measurements m ON m.id = v.measurement_id AND m.measured_at = v.measured_at'
+
+    rows = bind.execute(sa.text(f"""
+        SELECT {definition_id}, m.user_id, {day}, {value}
+        FROM {source}
+        ORDER BY 1, 2, 3
+    """).execution_options(stream_results=True, yield_per=10000))
+
+    statement = sa.text(f"""
+        UPDATE {ROLLUPS} SET sketch = :sketch
+        WHERE definition_id = :definition_id AND user_id = :user_id AND day = :day
+    """)
+    if postgres:
+        statement = statement.bindparams(sa.bindparam('sketch', type_=postgresql.JSONB()))
+
+    updates = []
+    for (row_definition_id, user_id, row_day), group in groupby(rows, key=lambda row: tuple(row[:3])):
+        sketch = DDSketch()
+        for *_, row_value in group:
+            if row_value is not None:
+                sketch.add(float(row_value))
+        sketch_value = sketch.to_dict() if postgres else json.dumps(sketch.to_dict())
+        updates.append({'definition_id': row_definition_id, 'user_id': user_id, 'day': row_day, 'sketch': sketch_value})
+        if len(updates) >= BACKFILL_CHUNK_SIZE:
+            bind.execute(statement, updates)
+            updates = []
+    if updates:
+        bind.execute(statement, updates)
+
+
+def upgrade() -> None:
+    # Databases created by Base.metadata.create_all already have the column and fill it on write
+    if 'sketch' in {column['name'] for column in sa.inspect(op.get_bind()).get_columns(ROLLUPS)}:
+        return
+    op.add_column(ROLLUPS, sa.Column('sketch', sa.JSON().with_variant(postgresql.JSONB(), 'postgresql'), nullable=True))
+    _backfill_sketches()
+
+
+def downgrade() -> None:
+    with op.batch_alter_table(ROLLUPS) as batch:
+        batch.drop_column('sketch')
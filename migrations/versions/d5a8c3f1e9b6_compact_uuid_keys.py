@@ -0,0 +1,111 @@
+"""Store ids as native UUIDs when DB_COMPACT_KEYS is set
+
+Revision ID: d5a8c3f1e9b6
+Revises: c4e7a9b2d5f8
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+import os
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a8c3f1e9b6'
+down_revision = 'c4e7a9b2d5f8'
+branch_labels = None
+depends_on = None
+
+
+# Ids and the foreign keys pointing at them, user and owner ids stay strings
+KEY_COLUMNS = {
+    'units': ['id'],
+    'measurement_templates': ['id'],
+    'value_definitions': ['id', 'unit_id', 'template_id'],
+    'measurements': ['id', 'template_id'],
+    'measurement_values': ['id', 'definition_id', 'measurement_id'],
+    'measurement_daily_rollups': ['definition_id', 'template_id'],
+}
+
+
+def _compact_keys() -> bool:
+    return os.getenv('DB_COMPACT_KEYS', 'false').lower() in ('1', 'true', 'yes')
+
+
+def _is_uuid_column(bind, table: str, column: str) -> bool:
+    for info in sa.inspect(bind).get_columns(table):
+        if info['name'] == column:
+            return isinstance(info['type'], sa.Uuid)
+    return False
+
+
+def _check_uuids(bind) -> None:
+    # Fail before changing anything rather than halfway through
+    for table, columns in KEY_COLUMNS.items():
+        for column in columns:
+            for (value,) in bind.execute(sa.text(f'SELECT DISTINCT {column} FROM {table}')):
+                try:
+                    uuid.UUID(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f'{table}.{column} holds {value!r}, compact keys need UUID ids')
+
+
+def _convert_postgresql(bind, column_type: str, using: str) -> None:
+    # Foreign keys are dropped while both of their ends change type
+    inspector = sa.inspect(bind)
+    foreign_keys = [(table, fk) for table in KEY_COLUMNS for fk in inspector.get_foreign_keys(table)]
+    for table, fk in foreign_keys:
+        op.drop_constraint(fk['name'], table, type_='foreignkey')
+
+    for table, columns in KEY_COLUMNS.items():
+        op.execute(f'ALTER TABLE {table} ' + ', '.join(
+            f'ALTER COLUMN {column} TYPE {column_type} USING {column}{using}' for column in columns
+        ))
+
+    for table, fk in foreign_keys:
+        op.create_foreign_key(
+            fk['name'], table, fk['referred_table'], fk['constrained_columns'], fk['referred_columns']
+        )
+
+
+def upgrade() -> None:
+    if not _compact_keys():
+        return
+
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        # SQLite has no UUID type, SQLAlchemy stores them as 32 hex digits
+        _check_uuids(bind)
+        for table, columns in KEY_COLUMNS.items():
+            op.execute(f'UPDATE {table} SET ' + ', '.join(
+                f"{column} = replace({column}, '-', '')" for column in columns
+            ))
+        return
+
+    if _is_uuid_column(bind, 'measurements', 'id'):
+        # Created with native UUIDs by Base.metadata.create_all
+        return
+    _check_uuids(bind)
+    _convert_postgresql(bind, 'uuid', '::uuid')
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        # Only ids compacted by upgrade, string keys may be 32 characters long on their own
+        if not _compact_keys():
+            return
+        for table, columns in KEY_COLUMNS.items():
+            for column in columns:
+                op.execute(
+                    f"UPDATE {table} SET {column} = substr({column}, 1, 8) || '-' || substr({column}, 9, 4) "
+                    f"|| '-' || substr({column}, 13, 4) || '-' || substr({column}, 17, 4) || '-' || substr({column}, 21) "
+                    f"WHERE length({column}) = 32"
+                )
+        return
+
+    if not _is_uuid_column(bind, 'measurements', 'id'):
+        return
+    _convert_postgresql(bind, 'varchar', '::text')
@@ -0,0 +1,89 @@
+"""Add measurements.definition_values for the wide value layout
+
+Revision ID: e2b9f4a6c1d3
+Revises: d5a8c3f1e9b6
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b9f4a6c1d3'
+down_revision = 'd5a8c3f1e9b6'
+branch_labels = None
+depends_on = None
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, 'false').lower() in ('1', 'true', 'yes')
+
+
+def _sqlite_uuid_text(column: str) -> str:
+    # Compact keys are stored as 32 hex digits on SQLite, JSON keys keep the dashes
+    return (
+        f"substr({column}, 1, 8) || '-' || substr({column}, 9, 4) || '-' || substr({column}, 13, 4) "
+        f"|| '-' || substr({column}, 17, 4) || '-' || substr({column}, 21)"
+    )
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    postgres = bind.dialect.name == 'postgresql'
+    if 'definition_values' not in {column['name'] for column in sa.inspect(bind).get_columns('measurements')}:
+        op.add_column('measurements', sa.Column(
+            'definition_values', sa.JSON().with_variant(postgresql.JSONB(), 'postgresql'), nullable=True
+        ))
+
+    if os.getenv('DB_VALUE_LAYOUT', 'eav') != 'wide':
+        return
+
+    # Fold the values into their measurements, the value rows are no longer read
+    if postgres:
+        op.execute("""
+            UPDATE measurements m SET definition_values = v.definition_values
+            FROM (
+                SELECT measurement_id, measured_at, jsonb_object_agg(definition_id::text, value) AS definition_values
+                FROM measurement_values GROUP BY measurement_id, measured_at
+            ) v
+            WHERE v.measurement_id = m.id AND v.measured_at = m.measured_at
+        """)
+    else:
+        key = _sqlite_uuid_text('definition_id') if _env_flag('DB_COMPACT_KEYS') else 'definition_id'
+        op.execute(f"""
+            UPDATE measurements SET definition_values = (
+                SELECT json_group_object({key}, value) FROM measurement_values
+                WHERE measurement_id = measurements.id AND measured_at = measurements.measured_at
+            )
+        """)
+    op.execute("UPDATE measurements SET definition_values = '{}' WHERE definition_values IS NULL")
+    op.execute('DELETE FROM measurement_values')
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    compact = _env_flag('DB_COMPACT_KEYS')
+
+    # Move values of the wide layout back into measurement_values, value ids are new
+    if bind.dialect.name == 'postgresql':
+        # gen_random_uuid() is built in since PostgreSQL 13
+        key_type = 'uuid' if compact else 'text'
+        op.execute(f"""
+            INSERT INTO measurement_values (id, definition_id, measurement_id, measured_at, value)
+            SELECT gen_random_uuid()::{key_type}, e.key::{key_type}, m.id, m.measured_at, e.value::float
+            FROM measurements m, jsonb_each_text(m.definition_values) e
+        """)
+    else:
+        key = "replace(e.key, '-', '')" if compact else 'e.key'
+        op.execute(f"""
+            INSERT INTO measurement_values (id, definition_id, measurement_id, measured_at, value)
+            SELECT lower(hex(randomblob(16))), {key}, m.id, m.measured_at, e.value
+            FROM measurements m, json_each(m.definition_values) e
+        """)
+
+    with op.batch_alter_table('measurements') as batch:
+        batch.drop_column('definition_values')
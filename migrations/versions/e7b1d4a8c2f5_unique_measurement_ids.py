@@ -0,0 +1,41 @@
+"""Enforce unique measurement and value ids on unpartitioned tables
+
+Revision ID: e7b1d4a8c2f5
+Revises: c4e9a1b7d3f6
+Create Date: 2026-10-18 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b1d4a8c2f5'
+down_revision = 'c4e9a1b7d3f6'
+branch_labels = None
+depends_on = None
+
+
+# The primary keys include measured_at for partitioning, these keep ids unique on their own
+INDEXES = [
+    ("ix_measurements_id", "measurements"),
+    ("ix_measurement_values_id", "measurement_values"),
+]
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    # Partitioned tables on Postgres cannot have them, writers lock ids instead (db/partitions.py)
+    if bind.dialect.name == 'postgresql':
+        return
+    inspector = sa.inspect(bind)
+    for name, table in INDEXES:
+        if name not in {index['name'] for index in inspector.get_indexes(table)}:
+            op.create_index(name, table, ['id'], unique=True)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        return
+    for name, table in INDEXES:
+        op.drop_index(name, table_name=table, if_exists=True)
@@ -0,0 +1,53 @@
+"""Keep removed value definitions and make values unique per definition
+
+Revision ID: f3a7d2c9b4e1
+Revises: e2b9f4a6c1d3
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a7d2c9b4e1'
+down_revision = 'e2b9f4a6c1d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if 'is_active' not in {column['name'] for column in sa.inspect(bind).get_columns('value_definitions')}:
+        with op.batch_alter_table('value_definitions') as batch:
+            batch.add_column(sa.Column('is_active', sa.Boolean(), nullable=False, server_default=sa.true()))
+
+    # Measurements posted with the same definition twice kept both values, keep one.
+    # Their daily rollups still count both, db.rollups.rebuild_rollups recomputes them.
+    if bind.dialect.name == 'postgresql':
+        op.execute("""
+            DELETE FROM measurement_values a USING measurement_values b
+            WHERE a.measurement_id = b.measurement_id AND a.definition_id = b.definition_id
+            AND a.measured_at = b.measured_at AND a.id > b.id
+        """)
+    else:
+        op.execute("""
+            DELETE FROM measurement_values WHERE id NOT IN (
+                SELECT MIN(id) FROM measurement_values GROUP BY measurement_id, definition_id, measured_at
+            )
+        """)
+
+    op.drop_index('ix_measurement_values_measurement_id', table_name='measurement_values', if_exists=True)
+    op.create_index(
+        'ix_measurement_values_measurement_id_definition_id', 'measurement_values',
+        ['measurement_id', 'definition_id', 'measured_at'], unique=True, if_not_exists=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_measurement_values_measurement_id_definition_id', table_name='measurement_values')
+    op.create_index('ix_measurement_values_measurement_id', 'measurement_values', ['measurement_id'])
+
+    # Deactivated definitions become active again, they cannot be told apart without the column
+    with op.batch_alter_table('value_definitions') as batch:
+        batch.drop_column('is_active')
@@ -1,4 +1,5 @@
 from datetime import datetime
+from enum import Enum
 from typing import List, Optional
 from pydantic import BaseModel
 
@@ -41,4 +42,39 @@ class Measurement(BaseModel):
     measured_at: datetime  # Real time when measurement was taken
     recorded_at: datetime  # Time when measurement was recorded in system
     notes: Optional[str] = None
-    user_id: str
\ No newline at end of file
+    user_id: str
+
+class MeasurementPage(BaseModel):
+    items: List[Measurement]
+    next_cursor: Optional[str] = None  # Pass as ?cursor= to fetch the next page
+
+
+class BatchItemResult(BaseModel):
+    index: int  # Position of the item in the submitted batch
+    id: Optional[str] = None
+    status: str  # "created", "updated" or "error"
+    detail: Optional[str] = None
+
+
+class BatchResult(BaseModel):
+    created: int
+    updated: int
+    failed: int
+    results: List[BatchItemResult]
+
+
+class BucketSize(str, Enum):
+    hour = "hour"
+    day = "day"
+    week = "week"
+    month = "month"
+
+
+class SeriesMethod(str, Enum):
+    lttb = "lttb"  # Largest-Triangle-Three-Buckets, keeps the visual shape
+    minmax = "minmax"  # Lowest and highest value per slice, keeps every spike
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
@@ -8,8 +8,11 @@ from datetime import datetime
 import uuid
 
 from api.main import app
-from tests.test_config import TestSessionLocal, setup_test_db, teardown_test_db
-from db.storage import Database
+from api.auth import create_access_token
+from tests.test_config import TestSessionLocal, TestAsyncSessionLocal, setup_test_db, teardown_test_db
+from db.storage import AsyncDatabase
+from db.registry import template_registry
+from db.stats_cache import statistics_cache
 from models.measurement import MeasurementTemplate, ValueDefinition, Unit, Measurement, MeasurementValue
 
 # Override the get_db dependency
@@ -21,15 +24,17 @@ def override_get_db():
         db.close()
 
 # Override the get_storage dependency
-def override_get_storage():
-    db = next(override_get_db())
-    return Database(db)
+async def override_get_storage():
+    async with TestAsyncSessionLocal() as db:
+        yield AsyncDatabase(db)
 
 # Setup and teardown for each test
 @pytest.fixture(scope="function")
 def test_db():
     # Setup database
     setup_test_db()
+    template_registry.clear()
+    statistics_cache.clear()
     
     # Provide the database session
     db = TestSessionLocal()
@@ -51,8 +56,9 @@ def client(test_db):
     app.dependency_overrides[get_db] = override_get_db
     app.dependency_overrides[get_storage] = override_get_storage
     
-    # Create test client
+    # Create test client authenticated as the default user
     with TestClient(app) as client:
+        client.headers["Authorization"] = f"Bearer {create_access_token(data={'sub': 'admin'})}"
         yield client
     
     # Reset dependency overrides
@@ -4,7 +4,7 @@ Tests for the API endpoints
 import pytest
 from fastapi.testclient import TestClient
 import json
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 def test_root_endpoint(client):
     """Test the root endpoint returns a welcome message"""
@@ -96,7 +96,7 @@ def test_get_measurements(client, weight_template, weight_measurement,
     
     # Verify response
     assert response.status_code == 200
-    results = response.json()
+    results = response.json()["items"]
     assert len(results) == 2
     
     # Get measurements filtered by template
@@ -104,7 +104,7 @@ def test_get_measurements(client, weight_template, weight_measurement,
     
     # Verify response
     assert response.status_code == 200
-    results = response.json()
+    results = response.json()["items"]
     assert len(results) == 1
     assert results[0]["template_id"] == weight_template.id
 
@@ -158,4 +158,262 @@ def test_statistics(client, weight_template, weight_measurement):
     assert result["weight"]["min"] == 70.0
     assert result["weight"]["max"] == 74.0
     assert result["weight"]["avg"] == 72.0
-    assert result["weight"]["unit"] == "kg"
\ No newline at end of file
+    assert result["weight"]["unit"] == "kg"
+
+
+def test_create_measurements_batch(client, weight_template, weight_measurement):
+    """Test the batch measurement endpoint"""
+    # Create template
+    client.post("/templates", json=json.loads(weight_template.json()))
+    
+    # Build a batch with one invalid item
+    measurement1 = json.loads(weight_measurement.json())
+    measurement2 = json.loads(weight_measurement.json())
+    measurement2["id"] = "measurement-2"
+    measurement2["values"][0]["definition_name"] = "height"
+    measurement3 = json.loads(weight_measurement.json())
+    measurement3["id"] = ""
+    
+    response = client.post("/measurements/batch", json=[measurement1, measurement2, measurement3])
+    
+    # Verify response
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == 2
+    assert result["failed"] == 1
+    assert result["results"][1]["status"] == "error"
+    assert result["results"][2]["id"]
+    
+    # Verify the valid measurements were stored
+    response = client.get(f"/measurements?template_id={weight_template.id}")
+    assert len(response.json()["items"]) == 2
+
+def test_statistics_series(client, weight_template, weight_measurement):
+    """Test the bucketed statistics endpoint"""
+    # Create template and measurement
+    client.post("/templates", json=json.loads(weight_template.json()))
+    client.post("/measurements", json=json.loads(weight_measurement.json()))
+    
+    # Get hourly series
+    response = client.get(f"/statistics/{weight_template.id}/series?bucket=hour")
+    
+    # Verify response
+    assert response.status_code == 200
+    result = response.json()
+    assert result["weight"]["unit"] == "kg"
+    assert len(result["weight"]["buckets"]) == 1
+    assert result["weight"]["buckets"][0]["count"] == 1
+    
+    # Windows with a UTC offset, as sent by the web UI, are compared in UTC
+    offset = timezone(timedelta(hours=2))
+    now = datetime.now(offset)
+    for start_date, end_date in (
+        (now - timedelta(minutes=30), now + timedelta(minutes=30)),
+        ((now - timedelta(days=2)).astimezone(timezone.utc), (now + timedelta(days=1)).astimezone(timezone.utc)),
+    ):
+        for bucket in ("hour", "day"):
+            response = client.get(f"/statistics/{weight_template.id}/series", params={
+                "bucket": bucket,
+                "start_date": start_date.isoformat().replace("+00:00", "Z"),
+                "end_date": end_date.isoformat().replace("+00:00", "Z"),
+            })
+            assert response.status_code == 200
+            assert sum(b["count"] for b in response.json()["weight"]["buckets"]) == 1
+    
+    # Unsupported bucket sizes are rejected
+    response = client.get(f"/statistics/{weight_template.id}/series?bucket=minute")
+    assert response.status_code == 422
+
+def test_statistics_percentiles(client, weight_template, weight_measurement):
+    """Test that percentiles are only added to statistics on request"""
+    client.post("/templates", json=json.loads(weight_template.json()))
+    client.post("/measurements", json=json.loads(weight_measurement.json()))
+    
+    response = client.get(f"/statistics/{weight_template.id}")
+    assert "p50" not in response.json()["weight"]
+    
+    response = client.get(f"/statistics/{weight_template.id}?percentiles=true")
+    assert response.status_code == 200
+    stats = response.json()["weight"]
+    assert stats["p50"] == stats["p90"] == stats["p99"] == 75.5
+
+def test_statistics_cache_skips_windows_ending_now(client, weight_template, weight_measurement):
+    """Test that only statistics of explicit windows are cached"""
+    from db.stats_cache import statistics_cache
+    
+    client.post("/templates", json=json.loads(weight_template.json()))
+    client.post("/measurements", json=json.loads(weight_measurement.json()))
+    
+    for _ in range(2):
+        response = client.get(f"/statistics/{weight_template.id}")
+        assert response.json()["weight"]["count"] == 1
+    assert statistics_cache.stats()["size"] == 0
+    
+    window = {
+        "start_date": (datetime.utcnow() - timedelta(days=1)).isoformat(),
+        "end_date": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+    }
+    for _ in range(2):
+        response = client.get(f"/statistics/{weight_template.id}", params=window)
+        assert response.json()["weight"]["count"] == 1
+    assert statistics_cache.stats()["size"] == 1
+    assert statistics_cache.stats()["hits"] == 1
+
+def test_measurement_series(client, weight_template, weight_measurement):
+    """Test the downsampled chart series endpoint"""
+    client.post("/templates", json=json.loads(weight_template.json()))
+    client.post("/measurements", json=json.loads(weight_measurement.json()))
+    
+    response = client.get(f"/measurements/series?template_id={weight_template.id}&points=100&method=minmax")
+    assert response.status_code == 200
+    assert response.headers["etag"]
+    result = response.json()
+    assert result["weight"]["unit"] == "kg"
+    assert [point["value"] for point in result["weight"]["points"]] == [75.5]
+    
+    # Fewer than three points cannot keep both ends of the series
+    response = client.get(f"/measurements/series?template_id={weight_template.id}&points=2")
+    assert response.status_code == 422
+    response = client.get("/measurements/series?template_id=non-existent-id")
+    assert response.status_code == 404
+
+def test_get_measurements_pagination(client, weight_template, weight_measurement):
+    """Test paging through measurements with a cursor"""
+    # Create template and five measurements
+    client.post("/templates", json=json.loads(weight_template.json()))
+    for i in range(5):
+        measurement = json.loads(weight_measurement.json())
+        measurement["id"] = f"measurement-{i}"
+        measurement["measured_at"] = (datetime.utcnow() - timedelta(hours=i)).isoformat()
+        client.post("/measurements", json=measurement)
+    
+    # Walk through all pages
+    ids = []
+    url = "/measurements?limit=2"
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["items"]) <= 2
+        ids.extend(m["id"] for m in page["items"])
+        url = f"/measurements?limit=2&cursor={page['next_cursor']}" if page["next_cursor"] else None
+    
+    # Verify every measurement was returned once, most recent first
+    assert ids == [f"measurement-{i}" for i in range(5)]
+    
+    # Malformed cursors are rejected
+    response = client.get("/measurements?cursor=not-a-cursor")
+    assert response.status_code == 400
+
+def test_measurements_with_utc_offsets(client, weight_template, weight_measurement):
+    """Test that timestamps with a UTC offset are stored and filtered as UTC"""
+    from db.storage import encode_cursor
+    
+    client.post("/templates", json=json.loads(weight_template.json()))
+    for i, measured_at in enumerate(("2024-03-01T10:30:00+02:00", "2024-03-01T07:30:00Z")):
+        measurement = json.loads(weight_measurement.json())
+        measurement["id"] = f"measurement-{i}"
+        measurement["measured_at"] = measured_at
+        measurement["recorded_at"] = "2024-03-01T08:31:00Z"
+        response = client.post("/measurements", json=measurement)
+        assert response.status_code == 200
+    
+    response = client.get("/measurements/measurement-0")
+    assert response.json()["measured_at"] == "2024-03-01T08:30:00"
+    assert response.json()["recorded_at"] == "2024-03-01T08:31:00"
+    
+    # 08:00 to 09:00 UTC, in two different offsets
+    window = {"start_date": "2024-03-01T10:00:00+02:00", "end_date": "2024-03-01T09:00:00Z"}
+    response = client.get("/measurements", params=window)
+    assert [m["id"] for m in response.json()["items"]] == ["measurement-0"]
+    response = client.get("/export/measurements", params=window)
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == ["measurement-0"]
+    
+    # Cursors compare in UTC as well
+    cursor = encode_cursor(datetime(2024, 3, 1, 10, 0, tzinfo=timezone(timedelta(hours=2))), "measurement-9")
+    response = client.get("/measurements", params={"start_date": "2024-03-01T00:00:00Z", "cursor": cursor})
+    assert [m["id"] for m in response.json()["items"]] == ["measurement-1"]
+
+def test_export_measurements(client, blood_pressure_template, blood_pressure_measurement):
+    """Test streaming measurements as NDJSON and CSV"""
+    # Create template and two measurements
+    client.post("/templates", json=json.loads(blood_pressure_template.json()))
+    for i in range(2):
+        measurement = json.loads(blood_pressure_measurement.json())
+        measurement["id"] = f"measurement-{i}"
+        measurement["measured_at"] = (datetime.utcnow() - timedelta(hours=i)).isoformat()
+        client.post("/measurements", json=measurement)
+    
+    # NDJSON has one measurement per line, oldest first
+    response = client.get("/export/measurements")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == ["measurement-1", "measurement-0"]
+    assert len(lines[0]["values"]) == 3
+    
+    # CSV has a header and one line per value
+    response = client.get(f"/export/measurements?format=csv&template_id={blood_pressure_template.id}")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.splitlines()
+    assert lines[0].startswith("measurement_id,template_id")
+    assert len(lines) == 7
+
+def test_conditional_requests(client, weight_template, weight_measurement):
+    """Test that templates and statistics answer If-None-Match with 304 until their data changes"""
+    client.post("/templates", json=json.loads(weight_template.json()))
+    statistics_url = (
+        f"/statistics/{weight_template.id}"
+        f"?start_date=2000-01-01T00:00:00&end_date={(datetime.utcnow() + timedelta(days=1)).date()}T00:00:00"
+    )
+    urls = ["/templates", f"/templates/{weight_template.id}", statistics_url]
+    
+    etags = {}
+    for url in urls:
+        response = client.get(url)
+        assert response.status_code == 200
+        etags[url] = response.headers["etag"]
+        
+        response = client.get(url, headers={"If-None-Match": etags[url]})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etags[url]
+    
+    # A measurement changes the statistics only
+    client.post("/measurements", json=json.loads(weight_measurement.json()))
+    assert client.get(urls[0], headers={"If-None-Match": etags[urls[0]]}).status_code == 304
+    assert client.get(urls[1], headers={"If-None-Match": etags[urls[1]]}).status_code == 304
+    response = client.get(statistics_url, headers={"If-None-Match": etags[statistics_url]})
+    assert response.status_code == 200
+    assert response.json()["weight"]["count"] == 1
+    
+    # Posting the same measurement again changes nothing
+    etag = response.headers["etag"]
+    client.post("/measurements", json=json.loads(weight_measurement.json()))
+    assert client.get(statistics_url, headers={"If-None-Match": etag}).status_code == 304
+    
+    # A template edit changes all of them
+    weight_template.description = "Weight before breakfast"
+    client.post("/templates", json=json.loads(weight_template.json()))
+    for url in urls:
+        assert client.get(url, headers={"If-None-Match": etags[url]}).status_code == 200
+
+def test_measurements_are_scoped_to_user(client, weight_template, weight_measurement, monkeypatch):
+    """Test that users only see and replace their own measurements"""
+    from api.auth import PENDING_PASSWORDS, create_access_token
+    monkeypatch.setitem(PENDING_PASSWORDS, "other", "password")
+    other = {"Authorization": f"Bearer {create_access_token(data={'sub': 'other'})}"}
+    
+    client.post("/templates", json=json.loads(weight_template.json()))
+    response = client.post("/measurements", json=json.loads(weight_measurement.json()))
+    assert response.status_code == 200
+    assert response.json()["user_id"] == "admin"
+    
+    assert client.get(f"/measurements/{weight_measurement.id}", headers=other).status_code == 404
+    assert client.get("/measurements", headers=other).json()["items"] == []
+    statistics = client.get(f"/statistics/{weight_template.id}", headers=other).json()
+    assert statistics["weight"]["count"] == 0
+    assert client.post("/measurements", json=json.loads(weight_measurement.json()), headers=other).status_code == 400
+    
+    assert client.get(f"/statistics/{weight_template.id}").json()["weight"]["count"] == 1
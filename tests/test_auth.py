@@ -0,0 +1,123 @@
+"""
+Tests for authentication and the verified token cache
+"""
+import asyncio
+import time
+import pytest
+from datetime import timedelta
+from fastapi import HTTPException
+
+import api.auth
+from api.auth import (
+    TokenCache, User, authenticate_user, create_access_token, get_current_user,
+    load_users, pwd_context, token_cache
+)
+
+@pytest.fixture(autouse=True)
+def clear_token_cache():
+    token_cache.clear()
+    yield
+    token_cache.clear()
+
+def test_token_cache_skips_verification(monkeypatch):
+    """Test that a verified token is served from the cache"""
+    token = create_access_token(data={"sub": "admin"})
+
+    # Count JWT verifications
+    calls = []
+    decode = api.auth.jwt.decode
+    monkeypatch.setattr(api.auth.jwt, "decode", lambda *args, **kwargs: calls.append(1) or decode(*args, **kwargs))
+
+    first = asyncio.run(get_current_user(token))
+    second = asyncio.run(get_current_user(token))
+
+    # Verify result
+    assert first.username == second.username == "admin"
+    assert len(calls) == 1
+    assert token_cache.stats()["hits"] == 1
+
+def test_token_cache_rejects_invalid_tokens():
+    """Test that invalid tokens are neither accepted nor cached"""
+    with pytest.raises(HTTPException):
+        asyncio.run(get_current_user("not-a-token"))
+
+    expired = create_access_token(data={"sub": "admin"}, expires_delta=timedelta(minutes=-1))
+    with pytest.raises(HTTPException):
+        asyncio.run(get_current_user(expired))
+
+    assert token_cache.stats()["size"] == 0
+
+def test_token_cache_expiry_and_eviction():
+    """Test that cache entries respect exp and the size bound"""
+    cache = TokenCache(maxsize=2, ttl=60)
+    user = User(username="admin")
+
+    # Entries expire at the token's exp claim
+    cache.put("expired", user, time.time() - 1)
+    assert cache.get("expired") is None
+
+    # The least recently used entry is evicted first
+    cache.put("a", user, time.time() + 60)
+    cache.put("b", user, time.time() + 60)
+    assert cache.get("a") is user
+    cache.put("c", user, time.time() + 60)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is user
+    assert cache.get("c") is user
+    assert cache.stats()["evictions"] == 1
+
+def test_token_cache_without_exp(monkeypatch):
+    """Test that a valid token without an exp claim is cached for the ttl"""
+    token = api.auth.jwt.encode({"sub": "admin"}, api.auth.SECRET_KEY, algorithm=api.auth.ALGORITHM)
+
+    user = asyncio.run(get_current_user(token))
+    assert user.username == "admin"
+    assert token_cache.get(token) == user
+
+    # The entry is dropped after the ttl
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + token_cache.ttl + 1)
+    assert token_cache.get(token) is None
+
+def test_load_users_defers_hashing(monkeypatch):
+    """Test that plain-text passwords are hashed on first login and hashes are kept"""
+    prehashed = pwd_context.hash("secret")
+    monkeypatch.setenv("AUTH_USERS", f"alice:wonderland,bob:{prehashed}")
+    monkeypatch.setattr(api.auth, "USERS", {})
+    monkeypatch.setattr(api.auth, "PENDING_PASSWORDS", {})
+
+    load_users()
+
+    # Only the pre-hashed password is available without hashing
+    assert api.auth.USERS == {"bob": prehashed}
+    assert api.auth.PENDING_PASSWORDS == {"alice": "wonderland"}
+
+    # Verify logins
+    assert authenticate_user("bob", "secret").username == "bob"
+    assert authenticate_user("alice", "wrong") is False
+    assert authenticate_user("alice", "wonderland").username == "alice"
+    assert authenticate_user("carol", "secret") is False
+
+    # The plain-text password was replaced by its hash
+    assert "alice" not in api.auth.PENDING_PASSWORDS
+    assert pwd_context.verify("wonderland", api.auth.USERS["alice"])
+
+def test_token_does_not_hash_pending_password(monkeypatch):
+    """Test that validating a token never runs the password hash"""
+    monkeypatch.setattr(api.auth, "USERS", {})
+    monkeypatch.setattr(api.auth, "PENDING_PASSWORDS", {"alice": "wonderland"})
+
+    user = asyncio.run(get_current_user(create_access_token(data={"sub": "alice"})))
+
+    assert user.username == "alice"
+    assert api.auth.PENDING_PASSWORDS == {"alice": "wonderland"}
+
+def test_login(client):
+    """Test requesting a token with the default credentials"""
+    response = client.post("/token", data={"username": "admin", "password": "password"})
+    assert response.status_code == 200
+    assert response.json()["token_type"] == "bearer"
+
+    response = client.post("/token", data={"username": "admin", "password": "wrong"})
+    assert response.status_code == 401
@@ -3,7 +3,9 @@ Test configuration with database settings
 """
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from db.database import Base
 
 # Use an in-memory SQLite database for tests
@@ -14,9 +16,18 @@ test_engine = create_engine(
     TEST_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 
+# Create an async engine on the same file for the API handlers; without
+# pooling no connection outlives the test database file
+test_async_engine = create_async_engine(
+    TEST_DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://"), poolclass=NullPool
+)
+
 # Create test session
 TestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=test_engine)
 
+# Create async test session
+TestAsyncSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=test_async_engine)
+
 # Create test tables
 def setup_test_db():
     # Create tables
@@ -25,6 +36,7 @@ def setup_test_db():
 def teardown_test_db():
     # Drop tables
     Base.metadata.drop_all(bind=test_engine)
+    test_engine.dispose()
     
     # Remove test.db file if exists
     if os.path.exists("./test.db"):
@@ -1,17 +1,40 @@
 """
 Tests for the database models and storage layer
 """
+import asyncio
+import re
 import pytest
+from sqlalchemy import event, func
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
-from db.storage import Database
-from db.models import Unit, ValueDefinition, MeasurementTemplate, Measurement, MeasurementValue
+from db.storage import Database, AsyncDatabase, encode_cursor
+from db.stats_cache import StatisticsCache, MemoryBackend
+from db.models import Unit, ValueDefinition, MeasurementTemplate, Measurement, MeasurementValue, MeasurementDailyRollup
 from models.measurement import Unit as UnitSchema
 from models.measurement import ValueDefinition as ValueDefinitionSchema
 from models.measurement import MeasurementTemplate as MeasurementTemplateSchema
 from models.measurement import Measurement as MeasurementSchema
 from models.measurement import MeasurementValue as MeasurementValueSchema
+from models.measurement import BucketSize, SeriesMethod
+from tests.test_config import test_engine, TestAsyncSessionLocal
+
+class QueryCounter:
+    """Counts SQL statements executed on the test engine"""
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, *args, **kwargs):
+        self.count += 1
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(test_engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(test_engine, "before_cursor_execute", self)
 
 def test_create_template(test_db, weight_template):
     """Test creating a measurement template in the database"""
@@ -185,4 +208,827 @@ def test_filter_measurements_by_date(test_db, weight_template, weight_measuremen
     
     # Verify results
     assert len(results) == 1
-    assert results[0].id == "last-week-measurement"
\ No newline at end of file
+    assert results[0].id == "last-week-measurement"
+
+def test_get_measurements_query_count(test_db, blood_pressure_template, blood_pressure_measurement):
+    """Test that reading measurements does not issue a query per row"""
+    # Create storage instance
+    db = Database(test_db)
+    
+    # Create template and a batch of multi-value measurements
+    db.create_template(blood_pressure_template)
+    for i in range(20):
+        measurement = blood_pressure_measurement.copy(deep=True)
+        measurement.id = f"bp-{i}"
+        measurement.measured_at = datetime.utcnow() - timedelta(hours=i)
+        db.create_measurement(measurement)
+    
+    # Start from a clean session so nothing is served from the identity map
+    test_db.expire_all()
+    
+    with QueryCounter() as counter:
+        results = db.get_measurements(template_id=blood_pressure_template.id)
+    
+    # Verify results
+    assert len(results) == 20
+    assert all(len(m.values) == 3 for m in results)
+    assert [m.id for m in results[:2]] == ["bp-0", "bp-1"]
+    assert {v.definition_name for v in results[0].values} == {"systolic", "diastolic", "pulse"}
+    
+    # One statement regardless of the number of measurements and values
+    assert counter.count == 1
+    
+    with QueryCounter() as counter:
+        result = db.get_measurement("bp-5")
+    
+    assert result is not None
+    assert len(result.values) == 3
+    assert counter.count == 1
+
+def test_template_registry(test_db, blood_pressure_template, blood_pressure_measurement):
+    """Test that template metadata is cached and invalidated by create_template"""
+    # Create storage instance
+    db = Database(test_db)
+    db.create_template(blood_pressure_template)
+    
+    # First lookup loads the template, the second is served from the cache
+    assert db.get_template(blood_pressure_template.id) is not None
+    with QueryCounter() as counter:
+        template = db.get_template(blood_pressure_template.id)
+    assert counter.count == 0
+    assert template.name == "Blood Pressure"
+    
+    stats = db.registry.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+    
+    # Editing the template invalidates the cached entry
+    blood_pressure_template.name = "BP"
+    db.create_template(blood_pressure_template)
+    assert db.get_template(blood_pressure_template.id).name == "BP"
+    assert db.registry.stats()["misses"] == 2
+    
+    # Writing a measurement resolves definitions without per-value lookups
+    with QueryCounter() as counter:
+        db.create_measurement(blood_pressure_measurement)
+    assert not any("value_definitions" in statement for statement in counter.statements)
+    assert len(db.get_measurement(blood_pressure_measurement.id).values) == 3
+    
+    # Unknown value names are still rejected
+    blood_pressure_measurement.values[0].definition_name = "unknown"
+    with pytest.raises(ValueError):
+        db.create_measurement(blood_pressure_measurement)
+
+def test_create_measurements_bulk(test_db, weight_template, blood_pressure_template, blood_pressure_measurement):
+    """Test storing a batch of measurements with per-item results"""
+    # Create storage instance
+    db = Database(test_db)
+    db.create_template(weight_template)
+    db.create_template(blood_pressure_template)
+    db.create_measurement(blood_pressure_measurement)
+    
+    def weight(measurement_id, value, definition_name="weight", template_id=weight_template.id):
+        return MeasurementSchema(
+            id=measurement_id,
+            template_id=template_id,
+            values=[MeasurementValueSchema(definition_name=definition_name, value=value)],
+            measured_at=datetime.utcnow(),
+            recorded_at=datetime.utcnow(),
+            user_id="test-user"
+        )
+    
+    replaced = blood_pressure_measurement.copy(deep=True)
+    replaced.values[0].value = 130.0
+    missing = blood_pressure_measurement.copy(deep=True)
+    missing.id = "bp-missing"
+    missing.values = missing.values[:2]
+    
+    batch = [
+        weight("w-1", 70.0),
+        weight("w-2", 71.0, definition_name="height"),
+        weight("w-3", 72.0, template_id="non-existent-id"),
+        weight("w-1", 73.0),
+        replaced,
+        missing,
+        weight("w-4", 74.0),
+    ]
+    
+    result = db.create_measurements_bulk(batch)
+    
+    # Verify per-item results
+    assert result.created == 2
+    assert result.updated == 1
+    assert result.failed == 4
+    assert [r.status for r in result.results] == [
+        "created", "error", "error", "error", "updated", "error", "created"
+    ]
+    assert [r.index for r in result.results] == list(range(len(batch)))
+    assert "height" in result.results[1].detail
+    assert "Duplicate" in result.results[3].detail
+    assert "Missing" in result.results[5].detail
+    
+    # Verify database state
+    weights = db.get_measurements(template_id=weight_template.id)
+    assert {m.id: m.values[0].value for m in weights} == {"w-1": 70.0, "w-4": 74.0}
+    
+    stored = db.get_measurement(blood_pressure_measurement.id)
+    values = {v.definition_name: v.value for v in stored.values}
+    assert values == {"systolic": 130.0, "diastolic": 80.0, "pulse": 72.0}
+
+def test_get_statistics(test_db, weight_template, weight_measurement, blood_pressure_template):
+    """Test aggregating values per definition in the database"""
+    # Create storage instance
+    db = Database(test_db)
+    db.create_template(weight_template)
+    db.create_template(blood_pressure_template)
+    
+    # Create measurements over three days, one of them outside the window
+    for i, value in enumerate([70.0, 72.0, 74.0, 90.0]):
+        measurement = weight_measurement.copy(deep=True)
+        measurement.id = f"weight-{i}"
+        measurement.measured_at = datetime.utcnow() - timedelta(days=i * 2)
+        measurement.values[0].value = value
+        db.create_measurement(measurement)
+    
+    start_date = datetime.utcnow() - timedelta(days=5)
+    with QueryCounter() as counter:
+        stats = db.get_statistics(weight_template.id, start_date=start_date)
+    
+    # Verify result, full days come from the rollups and the partial first day from raw values
+    assert counter.count == 2
+    assert stats["weight"]["count"] == 3
+    assert stats["weight"]["min"] == 70.0
+    assert stats["weight"]["max"] == 74.0
+    assert stats["weight"]["avg"] == 72.0
+    assert stats["weight"]["sum"] == 216.0
+    assert stats["weight"]["stddev"] == pytest.approx(2.0)
+    assert stats["weight"]["unit"] == "kg"
+    
+    # Definitions without values are reported with a zero count
+    stats = db.get_statistics(blood_pressure_template.id)
+    assert stats["systolic"] == {"count": 0, "unit": "mmHg"}
+    
+    # Unknown templates have no statistics
+    assert db.get_statistics("non-existent-id") is None
+
+def test_get_statistics_series(test_db, weight_template, weight_measurement):
+    """Test aggregating values per time bucket in the database"""
+    # Create storage instance
+    db = Database(test_db)
+    db.create_template(weight_template)
+    
+    # Two readings on Monday and Tuesday of one week, one in the next week
+    times = [
+        datetime(2024, 5, 6, 8, 0),
+        datetime(2024, 5, 6, 20, 30),
+        datetime(2024, 5, 7, 9, 15),
+        datetime(2024, 5, 13, 7, 45),
+    ]
+    for i, (measured_at, value) in enumerate(zip(times, [70.0, 72.0, 71.0, 69.0])):
+        measurement = weight_measurement.copy(deep=True)
+        measurement.id = f"weight-{i}"
+        measurement.measured_at = measured_at
+        measurement.values[0].value = value
+        db.create_measurement(measurement)
+    
+    # Daily buckets
+    series = db.get_statistics_series(weight_template.id, BucketSize.day)
+    buckets = series["weight"]["buckets"]
+    assert series["weight"]["unit"] == "kg"
+    assert [b["start"] for b in buckets] == [
+        datetime(2024, 5, 6), datetime(2024, 5, 7), datetime(2024, 5, 13)
+    ]
+    assert buckets[0] == {"start": datetime(2024, 5, 6), "count": 2, "min": 70.0, "max": 72.0, "avg": 71.0}
+    
+    # Weekly buckets start on Monday
+    series = db.get_statistics_series(weight_template.id, BucketSize.week)
+    buckets = series["weight"]["buckets"]
+    assert [(b["start"], b["count"]) for b in buckets] == [
+        (datetime(2024, 5, 6), 3), (datetime(2024, 5, 13), 1)
+    ]
+    
+    # Monthly buckets honour the window
+    series = db.get_statistics_series(
+        weight_template.id, BucketSize.month, start_date=datetime(2024, 5, 7)
+    )
+    assert series["weight"]["buckets"] == [
+        {"start": datetime(2024, 5, 1), "count": 2, "min": 69.0, "max": 71.0, "avg": 70.0}
+    ]
+    
+    # Unknown templates have no series
+    assert db.get_statistics_series("non-existent-id", BucketSize.day) is None
+
+def test_get_measurements_page(test_db, weight_template, weight_measurement):
+    """Test keyset pagination over measurements"""
+    # Create storage instance
+    db = Database(test_db)
+    db.create_template(weight_template)
+    
+    # Two measurements share a timestamp, the id breaks the tie
+    measured_at = datetime.utcnow()
+    for i in range(5):
+        measurement = weight_measurement.copy(deep=True)
+        measurement.id = f"weight-{i}"
+        measurement.measured_at = measured_at - timedelta(hours=min(i, 3))
+        db.create_measurement(measurement)
+    
+    first, cursor = db.get_measurements_page(limit=2)
+    assert [m.id for m in first] == ["weight-0", "weight-1"]
+    assert cursor is not None
+    
+    second, cursor = db.get_measurements_page(limit=2, cursor=cursor)
+    assert [m.id for m in second] == ["weight-2", "weight-4"]
+    assert len(second[0].values) == 1
+    
+    third, cursor = db.get_measurements_page(limit=2, cursor=cursor)
+    assert [m.id for m in third] == ["weight-3"]
+    assert cursor is None
+    
+    # Filters apply to every page
+    page, cursor = db.get_measurements_page(template_id="non-existent-id")
+    assert page == []
+    assert cursor is None
+    
+    with pytest.raises(ValueError):
+        db.get_measurements_page(cursor="not-a-cursor")
+
+def test_async_database(test_db, weight_template, weight_measurement):
+    """Test the async storage API shares behaviour with the sync one"""
+    async def scenario():
+        async with TestAsyncSessionLocal() as session:
+            db = AsyncDatabase(session)
+            await db.create_template(weight_template)
+            await db.create_measurement(weight_measurement)
+            
+            measurements = await db.get_measurements(template_id=weight_template.id)
+            stats = await db.get_statistics(weight_template.id)
+            rows = [row async for row in db.iter_measurement_rows()]
+            return measurements, stats, rows
+    
+    measurements, stats, rows = asyncio.run(scenario())
+    
+    # Verify result
+    assert [m.id for m in measurements] == [weight_measurement.id]
+    assert stats["weight"]["count"] == 1
+    assert [(row[0], row[6], row[7]) for row in rows] == [(weight_measurement.id, "weight", 75.5)]
+    
+    # Verify the sync path sees the same data
+    assert Database(test_db).get_measurement(weight_measurement.id) is not None
+
+def test_pool_metrics(tmp_path):
+    """Test that pool checkouts, waits and timeouts are recorded"""
+    from sqlalchemy import create_engine, exc
+    from db.database import InstrumentedQueuePool
+    
+    pool_engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05
+    )
+    other_engine = create_engine(f"sqlite:///{tmp_path / 'other.db'}", poolclass=InstrumentedQueuePool)
+    metrics = pool_engine.pool.metrics
+    
+    try:
+        connection = pool_engine.connect()
+        stats = metrics.snapshot(pool_engine.pool)
+        assert stats["checkouts"] == 1
+        assert stats["in_use"] == 1
+        assert stats["waits"] == 0
+        
+        # The pool is saturated, a second checkout waits and times out
+        with pytest.raises(exc.TimeoutError):
+            pool_engine.connect()
+        
+        connection.close()
+        stats = metrics.snapshot(pool_engine.pool)
+        assert stats["waits"] == 1
+        assert stats["timeouts"] == 1
+        assert stats["in_use"] == 0
+        
+        # Every pool counts its own checkouts
+        assert other_engine.pool.metrics.snapshot(other_engine.pool)["checkouts"] == 0
+        metrics.reset()
+        assert metrics.snapshot(pool_engine.pool)["checkouts"] == 0
+        
+        # The configured limits survive a recreate, unbounded overflow never waits
+        assert pool_engine.pool.recreate().capacity == 1
+        assert other_engine.pool.capacity == 15
+        assert InstrumentedQueuePool(lambda: None, max_overflow=-1).capacity is None
+    finally:
+        pool_engine.dispose()
+        other_engine.dispose()
+
+def test_write_measurement_rows(test_db, weight_template):
+    """Test the ingestion backend selection and the INSERT fallback"""
+    from db.ingest import resolve_backend, write_measurement_rows, _copy_records, _csv_field
+    
+    Database(test_db).create_template(weight_template)
+    definition_id = test_db.query(ValueDefinition.id).filter(ValueDefinition.template_id == weight_template.id).scalar()
+    
+    # SQLite has no COPY
+    assert resolve_backend(test_db, "auto") == "insert"
+    with pytest.raises(ValueError):
+        resolve_backend(test_db, "copy")
+    with pytest.raises(ValueError):
+        resolve_backend(test_db, "bulk")
+    
+    backend = write_measurement_rows(
+        test_db,
+        [{"id": "m1", "template_id": weight_template.id, "measured_at": datetime(2024, 1, 1), "user_id": "test-user"}],
+        [{"id": "v1", "definition_id": definition_id, "measurement_id": "m1", "measured_at": datetime(2024, 1, 1), "value": 75.5}]
+    )
+    test_db.commit()
+    
+    # Verify result
+    assert backend == "insert"
+    measurement = Database(test_db).get_measurement("m1")
+    assert measurement.values[0].value == 75.5
+    assert measurement.recorded_at is not None
+    
+    # Aware timestamps are written as naive UTC
+    measured_at = datetime(2024, 3, 1, 23, 30, tzinfo=timezone(timedelta(hours=-5)))
+    write_measurement_rows(
+        test_db,
+        [{"id": "m3", "template_id": weight_template.id, "measured_at": measured_at, "user_id": "test-user"}],
+        [{"id": "v3", "definition_id": definition_id, "measurement_id": "m3", "measured_at": measured_at, "value": 75.5}]
+    )
+    test_db.commit()
+    assert Database(test_db).get_measurement("m3").measured_at == datetime(2024, 3, 2, 4, 30)
+    
+    # COPY rows get client-side defaults and distinguish NULL from empty strings
+    record = _copy_records(Measurement.__table__, [{"id": "m2", "measured_at": datetime(2024, 1, 1)}])[0]
+    assert isinstance(record[3], datetime)
+    assert [_csv_field(value) for value in (None, "", 'say "hi"', 1.5, datetime(2024, 1, 1))] == [
+        '', '""', '"say ""hi"""', '1.5', '"2024-01-01T00:00:00"'
+    ]
+
+def test_statistics_rollups(test_db, weight_template, weight_measurement):
+    """Test that rollup-backed statistics match aggregating the raw values"""
+    import random
+    import statistics
+    from db.rollups import rebuild_rollups, split_window
+    
+    db = Database(test_db)
+    db.create_template(weight_template)
+    rng = random.Random(3)
+    base = datetime(2024, 1, 1)
+    stored = {}
+    
+    def make(index):
+        measurement = weight_measurement.copy(deep=True)
+        measurement.id = f"weight-{index}"
+        measurement.measured_at = base + timedelta(hours=rng.randrange(24 * 40), minutes=rng.randrange(60))
+        measurement.values[0].value = float(rng.randrange(500, 1000)) / 10
+        stored[measurement.id] = measurement
+        return measurement
+    
+    # Single inserts, a bulk batch, then replacements through both paths
+    for index in range(40):
+        db.create_measurement(make(index))
+    db.create_measurements_bulk([make(index) for index in range(40, 80)])
+    for index in range(0, 10):
+        db.create_measurement(make(index))
+    db.create_measurements_bulk([make(index) for index in range(30, 50)])
+    
+    def expected(start_date=None, end_date=None):
+        return sorted(
+            m.values[0].value for m in stored.values()
+            if (start_date is None or m.measured_at >= start_date) and (end_date is None or m.measured_at <= end_date)
+        )
+    
+    windows = [
+        (None, None),
+        (base + timedelta(days=3, hours=5), base + timedelta(days=20, hours=7)),
+        (base + timedelta(days=3), base + timedelta(days=20)),
+        (base + timedelta(days=10, hours=1), base + timedelta(days=11, hours=20)),
+        (base + timedelta(days=15, hours=12), None),
+    ]
+    for start_date, end_date in windows:
+        values = expected(start_date, end_date)
+        stats = db.get_statistics(weight_template.id, start_date, end_date)["weight"]
+        assert stats["count"] == len(values) > 0
+        assert stats["min"] == values[0]
+        assert stats["max"] == values[-1]
+        assert stats["sum"] == pytest.approx(sum(values))
+        assert stats["stddev"] == pytest.approx(statistics.stdev(values))
+        assert "p50" not in stats
+        
+        # Percentiles are within the relative error of the sketches
+        stats = db.get_statistics(weight_template.id, start_date, end_date, percentiles=True)["weight"]
+        for field, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+            assert stats[field] == pytest.approx(values[int(q * (len(values) - 1))], rel=0.01)
+        
+        series = db.get_statistics_series(weight_template.id, BucketSize.week, start_date, end_date)["weight"]
+        assert sum(b["count"] for b in series["buckets"]) == len(values)
+        assert [b["start"] for b in series["buckets"]] == sorted(b["start"] for b in series["buckets"])
+    
+    # Aware windows, as sent by the web UI, select the same naive UTC values
+    start_date, end_date = windows[1]
+    aware = (
+        start_date.replace(tzinfo=timezone.utc),
+        (end_date + timedelta(hours=2)).replace(tzinfo=timezone(timedelta(hours=2)))
+    )
+    assert split_window(*aware) == split_window(start_date, end_date)
+    stats = StatisticsCache(MemoryBackend(0))
+    assert Database(test_db, stats_cache=stats).get_statistics(weight_template.id, *aware)["weight"]["count"] == len(expected(start_date, end_date))
+    
+    # The incrementally maintained rollups equal a rebuild from raw values
+    def snapshot():
+        return sorted(
+            (r.definition_id, r.day, r.count, round(r.total, 6), round(r.total_sq, 6), r.minimum, r.maximum, r.sketch)
+            for r in test_db.query(MeasurementDailyRollup)
+        )
+    incremental = snapshot()
+    rebuild_rollups(test_db)
+    test_db.commit()
+    assert snapshot() == incremental
+    
+    # A rollup without a sketch leaves the percentiles out
+    test_db.query(MeasurementDailyRollup).filter(
+        MeasurementDailyRollup.day == (base + timedelta(days=5)).date()
+    ).update({"sketch": None})
+    test_db.commit()
+    db = Database(test_db, stats_cache=StatisticsCache(MemoryBackend()))
+    stats = db.get_statistics(weight_template.id, percentiles=True)["weight"]
+    assert stats["count"] == len(expected())
+    assert "p50" not in stats
+    stats = db.get_statistics(weight_template.id, base + timedelta(days=6), percentiles=True)["weight"]
+    assert "p50" in stats
+
+def test_rollups_use_utc_days(test_db, weight_template):
+    """Test that values with an aware measured_at are rolled up on their UTC day"""
+    from db.rollups import add_to_rollups
+    
+    Database(test_db).create_template(weight_template)
+    definition_id = test_db.query(ValueDefinition.id).filter(ValueDefinition.name == "weight").scalar()
+    measured_at = datetime(2024, 3, 1, 23, 30, tzinfo=timezone(timedelta(hours=-5)))
+    add_to_rollups(
+        test_db,
+        [{"id": "weight-0", "template_id": weight_template.id, "user_id": "test-user", "measured_at": measured_at}],
+        [{"measurement_id": "weight-0", "definition_id": definition_id, "value": 75.5}]
+    )
+    
+    assert [r.day for r in test_db.query(MeasurementDailyRollup)] == [datetime(2024, 3, 2).date()]
+
+def test_measurement_partition_key(test_db, weight_template, weight_measurement):
+    """Test that values carry their measurement's measured_at across replacements"""
+    from db.partitions import month_of, next_month, partition_name
+    
+    db = Database(test_db)
+    db.create_template(weight_template)
+    
+    weight_measurement.measured_at = datetime(2024, 1, 31, 23, 30)
+    db.create_measurement(weight_measurement)
+    
+    # Replacing with a new measured_at moves the measurement and its values to February
+    weight_measurement.measured_at = datetime(2024, 2, 1, 8, 0)
+    weight_measurement.values[0].value = 80.0
+    db.create_measurement(weight_measurement)
+    
+    # Verify result
+    values = test_db.query(MeasurementValue).all()
+    assert [(v.measured_at, v.value) for v in values] == [(datetime(2024, 2, 1, 8, 0), 80.0)]
+    assert test_db.query(Measurement).count() == 1
+    
+    february = db.get_measurements(start_date=datetime(2024, 2, 1), end_date=datetime(2024, 2, 29))
+    assert [m.values[0].value for m in february] == [80.0]
+    assert db.get_measurements(start_date=datetime(2024, 1, 1), end_date=datetime(2024, 1, 31, 23, 59)) == []
+    
+    # Monthly partition naming
+    assert month_of(datetime(2024, 12, 31, 23, 59)) == datetime(2024, 12, 1).date()
+    assert next_month(datetime(2024, 12, 1).date()) == datetime(2025, 1, 1).date()
+    assert partition_name("measurements", datetime(2024, 2, 1).date()) == "measurements_y2024m02"
+
+def test_measurement_ids_unique(test_db, weight_template, weight_measurement):
+    """Test that unpartitioned tables reject a second row with a stored id"""
+    from sqlalchemy.exc import IntegrityError
+    
+    db = Database(test_db)
+    db.create_template(weight_template)
+    db.create_measurement(weight_measurement)
+    
+    stored = test_db.query(Measurement).one()
+    test_db.expunge(stored)
+    with pytest.raises(IntegrityError):
+        test_db.execute(Measurement.__table__.insert().values(
+            id=stored.id, template_id=stored.template_id, measured_at=stored.measured_at + timedelta(days=40),
+            recorded_at=stored.recorded_at, user_id=stored.user_id
+        ))
+    test_db.rollback()
+    assert test_db.query(Measurement).count() == 1
+
+def test_compact_keys_reject_invalid_ids(monkeypatch, test_db, weight_template, weight_measurement):
+    """Test that ids which cannot be stored as UUIDs are rejected or not found"""
+    from db.models import is_valid_key
+    
+    db = Database(test_db)
+    db.create_template(weight_template)
+    db.create_measurement(weight_measurement)
+    
+    monkeypatch.setattr("db.models.DB_COMPACT_KEYS", True)
+    assert is_valid_key(weight_measurement.id)
+    assert not is_valid_key("weight-0")
+    
+    # Lookups of malformed ids never reach the UUID columns
+    assert db.get_measurement("weight-0") is None
+    assert db.get_template("weight-template") is None
+    assert db.get_measurements(template_id="weight-template") == []
+    with pytest.raises(ValueError):
+        db.get_measurements_page(cursor=encode_cursor(datetime.utcnow(), "weight-0"))
+    
+    weight_measurement.id = "weight-0"
+    with pytest.raises(ValueError):
+        db.create_measurement(weight_measurement)
+    result = db.create_measurements_bulk([weight_measurement])
+    assert result.failed == 1
+    assert "UUID" in result.results[0].detail
+
+def test_compact_keys_canonical_ids(monkeypatch, test_db, weight_template, weight_measurement):
+    """Test that other spellings of a stored UUID address the same measurement"""
+    import uuid
+    
+    monkeypatch.setattr("db.models.DB_COMPACT_KEYS", True)
+    db = Database(test_db)
+    db.create_template(weight_template)
+    db.create_measurement(weight_measurement)
+    stored_id = weight_measurement.id
+    
+    # Uppercase and hex re-posts update the stored measurement
+    for index, spelling in enumerate((stored_id.upper(), uuid.UUID(stored_id).hex)):
+        measurement = weight_measurement.copy(deep=True)
+        measurement.id = spelling
+        measurement.template_id = weight_template.id.upper()
+        measurement.values[0].value = 80.0 + index
+        db.create_measurement(measurement)
+        assert measurement.id == stored_id
+        result = db.create_measurements_bulk([measurement.copy(update={"id": spelling})])
+        assert result.updated == 1
+    
+    assert test_db.query(Measurement).count() == 1
+    assert [m.id for m in db.get_measurements(template_id=weight_template.id.upper())] == [stored_id]
+    assert db.get_measurement(uuid.UUID(stored_id).hex).values[0].value == 81.0
+    assert db.get_statistics(weight_template.id.upper())["weight"]["count"] == 1
+
+@pytest.mark.parametrize("layout", ["eav", "wide"])
+def test_value_layouts(monkeypatch, test_db, blood_pressure_template, blood_pressure_measurement, layout):
+    """Test that both value layouts store and read measurements the same way"""
+    from db.rollups import rebuild_rollups
+    
+    monkeypatch.setattr("db.models.DB_VALUE_LAYOUT", layout)
+    db = Database(test_db)
+    db.create_template(blood_pressure_template)
+    
+    def reading(measurement_id, days_ago, systolic):
+        measurement = blood_pressure_measurement.copy(deep=True)
+        measurement.id = measurement_id
+        measurement.measured_at = datetime(2024, 3, 10, 12, 0) - timedelta(days=days_ago)
+        measurement.values[0].value = systolic
+        return measurement
+    
+    db.create_measurement(reading("bp-0", 0, 120.0))
+    db.create_measurement(reading("bp-0", 1, 125.0))
+    result = db.create_measurements_bulk([reading("bp-1", 2, 130.0), reading("bp-0", 3, 118.0)])
+    assert (result.created, result.updated) == (1, 1)
+    
+    # Verify result
+    stored = db.get_measurement("bp-0")
+    assert stored.measured_at == datetime(2024, 3, 7, 12, 0)
+    assert sorted((v.definition_name, v.value) for v in stored.values) == [
+        ("diastolic", 80.0), ("pulse", 72.0), ("systolic", 118.0)
+    ]
+    assert [m.id for m in db.get_measurements(blood_pressure_template.id)] == ["bp-1", "bp-0"]
+    assert len(list(db.iter_measurement_rows(blood_pressure_template.id))) == 6
+    
+    stats = db.get_statistics(blood_pressure_template.id, start_date=datetime(2024, 3, 7, 6, 0))
+    assert stats["systolic"]["count"] == 2
+    assert stats["systolic"]["sum"] == 248.0
+    assert stats["pulse"]["avg"] == 72.0
+    series = db.get_measurement_series(blood_pressure_template.id, datetime(2024, 3, 1), datetime(2024, 3, 11), 10)
+    assert [point["value"] for point in series["systolic"]["points"]] == [118.0, 130.0]
+    
+    # Rebuilt rollups match the incrementally maintained ones
+    snapshot = lambda: sorted((r.definition_id, r.day, r.count, r.total) for r in test_db.query(MeasurementDailyRollup))
+    incremental = snapshot()
+    rebuild_rollups(test_db)
+    assert snapshot() == incremental
+    
+    # The wide layout keeps values in the measurement row only
+    expected_rows = 0 if layout == "wide" else 6
+    assert test_db.query(MeasurementValue).count() == expected_rows
+    assert all(
+        (m.definition_values is not None) == (layout == "wide") for m in test_db.query(Measurement)
+    )
+
+def test_update_template_keeps_definition_ids(test_db, blood_pressure_template, blood_pressure_measurement):
+    """Test that template edits keep the ids of the definitions they do not remove"""
+    db = Database(test_db)
+    db.create_template(blood_pressure_template)
+    db.create_measurement(blood_pressure_measurement)
+    ids = dict(test_db.query(ValueDefinition.name, ValueDefinition.id).all())
+    
+    # Drop pulse and rename the display name of systolic
+    edited = blood_pressure_template.copy(deep=True)
+    edited.value_definitions = edited.value_definitions[:2]
+    edited.value_definitions[0].display_name = "Systolic pressure"
+    result = db.create_template(edited)
+    
+    # Verify result
+    assert [d.name for d in result.value_definitions] == ["systolic", "diastolic"]
+    assert db.get_template(edited.id).value_definitions[0].display_name == "Systolic pressure"
+    assert dict(test_db.query(ValueDefinition.name, ValueDefinition.id).all()) == ids
+    assert set(db.get_statistics(edited.id)) == {"systolic", "diastolic"}
+    
+    # Stored values still point at their definitions, including the removed one
+    stored = db.get_measurement(blood_pressure_measurement.id)
+    assert sorted(v.definition_name for v in stored.values) == ["diastolic", "pulse", "systolic"]
+    
+    # Adding the definition back reactivates it
+    db.create_template(blood_pressure_template)
+    assert dict(test_db.query(ValueDefinition.name, ValueDefinition.id).all()) == ids
+    assert db.get_statistics(blood_pressure_template.id)["pulse"]["count"] == 1
+
+def test_replace_measurement_writes_changes_only(test_db, blood_pressure_template, blood_pressure_measurement):
+    """Test that re-posting a measurement only writes what changed"""
+    db = Database(test_db)
+    db.create_template(blood_pressure_template)
+    db.create_measurement(blood_pressure_measurement)
+    
+    def writes(counter):
+        matches = (re.match(r"(INSERT INTO|UPDATE|DELETE FROM) (\w+)", statement) for statement in counter.statements)
+        return [" ".join(match.groups()) for match in matches if match]
+    
+    # An identical re-post writes nothing
+    with QueryCounter() as counter:
+        db.create_measurement(blood_pressure_measurement)
+    assert writes(counter) == []
+    
+    # Also when its timestamps come with a UTC offset, as sent by the web UI
+    offset = timezone(timedelta(hours=-5))
+    for create in (db.create_measurement, lambda m: db.create_measurements_bulk([m])):
+        aware = blood_pressure_measurement.copy(deep=True)
+        aware.measured_at = aware.measured_at.replace(tzinfo=timezone.utc).astimezone(offset)
+        aware.recorded_at = aware.recorded_at.replace(tzinfo=timezone.utc)
+        with QueryCounter() as counter:
+            create(aware)
+        assert writes(counter) == []
+    
+    # One changed value is upserted and its day recomputed, the others stay
+    value_ids = dict(test_db.query(MeasurementValue.definition_id, MeasurementValue.id).all())
+    blood_pressure_measurement.values[0].value = 135.0
+    with QueryCounter() as counter:
+        result = db.create_measurements_bulk([blood_pressure_measurement])
+    assert result.updated == 1
+    assert writes(counter) == [
+        "INSERT INTO measurement_values", "DELETE FROM measurement_daily_rollups",
+        "INSERT INTO measurement_daily_rollups", "INSERT INTO data_versions"
+    ]
+    assert dict(test_db.query(MeasurementValue.definition_id, MeasurementValue.id).all()) == value_ids
+    stored = db.get_measurement(blood_pressure_measurement.id)
+    assert sorted(v.value for v in stored.values) == [72.0, 80.0, 135.0]
+    assert db.get_statistics(blood_pressure_template.id)["systolic"]["max"] == 135.0
+    
+    # Dropped values are deleted, repeated definitions are rejected
+    blood_pressure_measurement.values = blood_pressure_measurement.values[:2]
+    db.create_measurement(blood_pressure_measurement)
+    assert test_db.query(MeasurementValue).count() == 2
+    blood_pressure_measurement.values.append(blood_pressure_measurement.values[0])
+    with pytest.raises(ValueError):
+        db.create_measurement(blood_pressure_measurement)
+
+def test_statistics_cache(test_db, weight_template, weight_measurement):
+    """Test that cached statistics are only invalidated by writes inside their window"""
+    cache = StatisticsCache(MemoryBackend(maxsize=2))
+    db = Database(test_db, stats_cache=cache)
+    db.create_template(weight_template)
+    db.create_measurement(weight_measurement)
+    
+    now = datetime.utcnow()
+    recent = (now - timedelta(days=7), now + timedelta(days=1))
+    older = (now - timedelta(days=60), now - timedelta(days=30))
+    assert db.get_statistics(weight_template.id, *recent)["weight"]["count"] == 1
+    assert db.get_statistics(weight_template.id, *older)["weight"]["count"] == 0
+    
+    # Hits run no SQL
+    with QueryCounter() as counter:
+        assert db.get_statistics(weight_template.id, *recent)["weight"]["count"] == 1
+    assert counter.count == 0
+    
+    # A measurement in the older window leaves the recent one cached
+    measurement = weight_measurement.copy(deep=True)
+    measurement.id = "weight-old"
+    measurement.measured_at = now - timedelta(days=45)
+    db.create_measurement(measurement)
+    assert cache.stats()["invalidations"] == 1
+    with QueryCounter() as counter:
+        db.get_statistics(weight_template.id, *recent)
+    assert counter.count == 0
+    assert db.get_statistics(weight_template.id, *older)["weight"]["count"] == 1
+    
+    # Moving it into the recent window invalidates both
+    measurement.measured_at = now - timedelta(days=1)
+    db.create_measurement(measurement)
+    assert db.get_statistics(weight_template.id, *recent)["weight"]["count"] == 2
+    assert db.get_statistics(weight_template.id, *older)["weight"]["count"] == 0
+    
+    # Template edits drop all windows, the least recently used window is evicted
+    db.create_template(weight_template)
+    assert cache.stats()["size"] == 0
+    for window in (recent, older, (now - timedelta(days=90), now)):
+        db.get_statistics(weight_template.id, *window)
+    stats = cache.stats()
+    assert stats["size"] == 2
+    assert stats["evictions"] == 1
+    assert stats["hit_ratio"] == stats["hits"] / (stats["hits"] + stats["misses"])
+
+def test_statistics_cache_drops_results_raced_by_writes(weight_template):
+    """Test that a result computed while a write committed is not kept"""
+    cache = StatisticsCache(MemoryBackend())
+    
+    def compute(start, end):
+        cache.invalidate(weight_template.id, [datetime(2026, 1, 1)])
+        return {"weight": {"count": 0}}
+    
+    assert cache.get_or_compute(weight_template.id, None, None, None, compute) == {"weight": {"count": 0}}
+    assert cache.stats()["size"] == 0
+
+def test_user_scoped_queries(test_db, weight_template, weight_measurement):
+    """Test that scoped reads only see the user's own measurements"""
+    cache = StatisticsCache(MemoryBackend())
+    db = Database(test_db, stats_cache=cache)
+    db.create_template(weight_template)
+    for i, (user_id, value) in enumerate([("alice", 70.0), ("alice", 72.0), ("bob", 90.0)]):
+        measurement = weight_measurement.copy(deep=True)
+        measurement.id = f"weight-{i}"
+        measurement.user_id = user_id
+        measurement.measured_at = datetime.utcnow() - timedelta(days=i)
+        measurement.values[0].value = value
+        db.create_measurement(measurement)
+    
+    assert [m.id for m in db.get_measurements(weight_template.id, user_id="alice")] == ["weight-0", "weight-1"]
+    assert [m.id for m in db.get_measurements_page(weight_template.id, user_id="bob")[0]] == ["weight-2"]
+    assert [row[0] for row in db.iter_measurement_rows(user_id="bob")] == ["weight-2"]
+    assert db.get_measurement("weight-2", user_id="alice") is None
+    assert db.get_measurement("weight-2", user_id="bob").values[0].value == 90.0
+    
+    # Rollups are kept per user, so full days and edges are both scoped
+    start_date = datetime.utcnow() - timedelta(days=5)
+    assert db.get_statistics(weight_template.id, start_date, user_id="alice")["weight"]["max"] == 72.0
+    assert db.get_statistics(weight_template.id, start_date, user_id="bob")["weight"]["count"] == 1
+    assert db.get_statistics(weight_template.id, start_date)["weight"]["count"] == 3
+    series = db.get_statistics_series(weight_template.id, BucketSize.month, start_date, user_id="bob")
+    assert sum(bucket["count"] for bucket in series["weight"]["buckets"]) == 1
+    assert dict(test_db.query(MeasurementDailyRollup.user_id, func.sum(MeasurementDailyRollup.count)).group_by(
+        MeasurementDailyRollup.user_id
+    ).all()) == {"alice": 2, "bob": 1}
+    
+    # A write of bob keeps alice's cached windows
+    measurement = weight_measurement.copy(deep=True)
+    measurement.id = "weight-3"
+    measurement.user_id = "bob"
+    db.create_measurement(measurement)
+    with QueryCounter() as counter:
+        db.get_statistics(weight_template.id, start_date, user_id="alice")
+    assert counter.count == 0
+    assert db.get_statistics(weight_template.id, start_date, user_id="bob")["weight"]["count"] == 2
+    
+    # Measurements of another user cannot be replaced
+    measurement.user_id = "alice"
+    with pytest.raises(ValueError):
+        db.create_measurement(measurement)
+    result = db.create_measurements_bulk([measurement])
+    assert result.failed == 1
+    assert "another user" in result.results[0].detail
+
+@pytest.mark.parametrize("method", [SeriesMethod.lttb, SeriesMethod.minmax])
+def test_get_measurement_series(test_db, weight_template, weight_measurement, method):
+    """Test downsampling a dense series to a bounded number of chart points"""
+    db = Database(test_db)
+    db.create_template(weight_template)
+    
+    # Hourly readings on a slow ramp with a single spike
+    start = datetime(2024, 5, 1)
+    readings = []
+    for i in range(240):
+        measurement = weight_measurement.copy(deep=True)
+        measurement.id = f"weight-{i}"
+        measurement.measured_at = start + timedelta(hours=i)
+        measurement.values[0].value = 200.0 if i == 137 else 70.0 + (i % 24) / 10
+        readings.append(measurement)
+    db.create_measurements_bulk(readings)
+    end = start + timedelta(hours=239)
+    
+    series = db.get_measurement_series(weight_template.id, start, end, 20, method)
+    points = series["weight"]["points"]
+    assert series["weight"]["unit"] == "kg"
+    assert 2 < len(points) <= 20
+    times = [point["measured_at"] for point in points]
+    assert times == sorted(set(times))
+    assert {"measured_at": start + timedelta(hours=137), "value": 200.0} in points
+    if method == SeriesMethod.lttb:
+        assert times[0] == start and times[-1] == end
+    
+    # Windows with fewer readings than points are returned unchanged
+    series = db.get_measurement_series(weight_template.id, start, end, 500, method)
+    assert len(series["weight"]["points"]) == 240
+    
+    # Unknown templates have no series
+    assert db.get_measurement_series("non-existent-id", start, end, 20, method) is None
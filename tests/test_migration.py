@@ -5,11 +5,16 @@ import pytest
 import os
 import json
 import tempfile
+import tracemalloc
 from datetime import datetime
 import uuid
 
-from db.migrate_data import migrate_data, load_json_file
+from db.migrate_data import (
+    migrate_data, migrate_measurements, migrate_templates, load_json_file, iter_json_records
+)
+from db.models import ValueDefinition
 from db.storage import Database
+from tests.test_database import QueryCounter
 
 def test_load_json_file():
     """Test loading data from a JSON file"""
@@ -112,4 +117,143 @@ def test_migration(test_db):
         # Clean up
         for filename in os.listdir(temp_dir):
             os.unlink(os.path.join(temp_dir, filename))
-        os.rmdir(temp_dir)
\ No newline at end of file
+        os.rmdir(temp_dir)
+
+def _weight_template_data():
+    return {
+        "id": str(uuid.uuid4()),
+        "name": "Weight",
+        "value_definitions": [
+            {"name": "weight", "display_name": "Weight", "unit": {"name": "kg", "display_name": "kilogram"}}
+        ]
+    }
+
+def _weight_measurements(template_id, count):
+    return [
+        {
+            "id": f"m{index:03d}",
+            "template_id": template_id,
+            "values": [{"definition_name": "weight", "value": 70.0 + index}],
+            "measured_at": datetime(2024, 1, 1, index // 60, index % 60).isoformat(),
+            "user_id": "test-user"
+        }
+        for index in range(count)
+    ]
+
+def test_migrate_measurements_in_chunks(test_db):
+    """Test that measurements are inserted per chunk with one definition lookup per template"""
+    template = _weight_template_data()
+    migrate_templates([template], test_db)
+    reports = []
+
+    with QueryCounter() as counter:
+        result = migrate_measurements(
+            _weight_measurements(template["id"], 25), test_db, chunk_size=10, progress=reports.append
+        )
+
+    # Verify result
+    assert result.processed == result.inserted == 25
+    assert [report.processed for report in reports] == [10, 20, 25]
+    definition_lookups = [s for s in counter.statements if "FROM value_definitions" in s]
+    assert len(definition_lookups) == 1
+
+    measurements = Database(test_db).get_measurements()
+    assert len(measurements) == 25
+    assert all(len(m.values) == 1 for m in measurements)
+
+def test_migrate_measurements_resumes_from_checkpoint(test_db, tmp_path):
+    """Test that a rerun continues after the last committed chunk"""
+    template = _weight_template_data()
+    migrate_templates([template], test_db)
+    measurements = _weight_measurements(template["id"], 25)
+    checkpoint = str(tmp_path / "checkpoint.json")
+
+    # Fail in the third chunk, the first two stay committed
+    def interrupted():
+        for index, measurement in enumerate(measurements):
+            if index == 22:
+                raise RuntimeError("connection lost")
+            yield measurement
+
+    with pytest.raises(RuntimeError):
+        migrate_measurements(interrupted(), test_db, chunk_size=10, checkpoint_path=checkpoint)
+    assert len(Database(test_db).get_measurements()) == 20
+    with open(checkpoint) as f:
+        assert json.load(f)["processed"] == 20
+
+    # Resume, then rerun the whole input without a checkpoint
+    result = migrate_measurements(measurements, test_db, chunk_size=10, checkpoint_path=checkpoint)
+    assert result.processed == 25
+    assert result.inserted == 5
+
+    result = migrate_measurements(measurements, test_db, chunk_size=10)
+    assert result.inserted == 0
+    assert result.skipped == 25
+    assert len(Database(test_db).get_measurements()) == 25
+
+def test_migrate_measurements_drops_unusable_values(test_db):
+    """Test that values of inactive definitions and repeated values do not abort a chunk"""
+    template = _weight_template_data()
+    template["value_definitions"].append(
+        {"name": "fat", "display_name": "Body fat", "unit": {"name": "percent", "display_name": "percent"}}
+    )
+    migrate_templates([template], test_db)
+    test_db.query(ValueDefinition).filter(ValueDefinition.name == "fat").update({"is_active": False})
+    test_db.commit()
+
+    measurements = _weight_measurements(template["id"], 3)
+    measurements[0]["values"].append({"definition_name": "weight", "value": 99.0})
+    measurements[1]["values"].append({"definition_name": "fat", "value": 20.0})
+    result = migrate_measurements(measurements, test_db, chunk_size=10)
+
+    # Verify result
+    assert result.inserted == 3
+    assert result.dropped_values == 2
+    stored = {m.id: [(v.definition_name, v.value) for v in m.values] for m in Database(test_db).get_measurements()}
+    assert stored == {"m000": [("weight", 70.0)], "m001": [("weight", 71.0)], "m002": [("weight", 72.0)]}
+
+def test_iter_json_records(tmp_path):
+    """Test streaming records from JSON array and NDJSON files"""
+    records = [
+        {"id": f"m{index}", "notes": 'brackets ], braces } and "quotes"', "values": [{"value": index * 1.5}]}
+        for index in range(20)
+    ]
+
+    array_file = tmp_path / "measurements.json"
+    array_file.write_text(json.dumps(records, indent=2))
+    ndjson_file = tmp_path / "measurements.ndjson"
+    ndjson_file.write_text("\n".join(json.dumps(record) for record in records) + "\n\n")
+
+    # Small reads split records, strings and numbers across reads
+    for read_size in (1, 7, 4096):
+        assert list(iter_json_records(str(array_file), read_size=read_size)) == records
+    assert list(iter_json_records(str(ndjson_file))) == records
+
+    # Empty, missing and malformed input
+    array_file.write_text(" [ ] ")
+    assert list(iter_json_records(str(array_file))) == []
+    assert list(iter_json_records(str(tmp_path / "missing.json"))) == []
+    array_file.write_text('[{"id": "m1"} {"id": "m2"}]')
+    with pytest.raises(ValueError):
+        list(iter_json_records(str(array_file), read_size=4))
+
+def test_iter_json_records_memory(tmp_path):
+    """Test that streaming a large array does not hold the file in memory"""
+    array_file = tmp_path / "measurements.json"
+    with open(array_file, "w") as f:
+        f.write("[")
+        for index in range(50000):
+            f.write("," if index else "")
+            json.dump({"id": f"m{index}", "values": [{"definition_name": "weight", "value": index}]}, f)
+        f.write("]")
+
+    tracemalloc.start()
+    try:
+        count = sum(1 for _ in iter_json_records(str(array_file)))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # Verify result
+    assert count == 50000
+    assert peak < os.path.getsize(array_file) / 4
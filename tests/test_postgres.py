@@ -0,0 +1,90 @@
+"""
+Tests that need PostgreSQL, run against a scratch database at TEST_POSTGRES_URL
+Note: The tables of that database are dropped and recreated.
+"""
+import asyncio
+import os
+import pytest
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session
+
+from db.database import Base, to_async_url
+from db.ingest import write_measurement_rows
+from db.models import Measurement, MeasurementValue, ValueDefinition
+from db.partitions import ensure_partitions, forget_partitions, partition_name
+from db.storage import Database
+
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+pytestmark = [
+    pytest.mark.postgres,
+    pytest.mark.skipif(not TEST_POSTGRES_URL, reason="Set TEST_POSTGRES_URL to run PostgreSQL tests"),
+]
+
+@pytest.fixture
+def pg_engine():
+    engine = create_engine(TEST_POSTGRES_URL)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    forget_partitions()
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+def _rows(template_id, definition_id, measurement_id, measured_at):
+    return (
+        [{"id": measurement_id, "template_id": template_id, "measured_at": measured_at,
+          "recorded_at": measured_at, "user_id": "test-user"}],
+        [{"id": f"{measurement_id}-v", "definition_id": definition_id, "measurement_id": measurement_id,
+          "measured_at": measured_at, "value": 75.5}],
+    )
+
+def test_copy_ingests_aware_timestamps(pg_engine, weight_template):
+    """Test that both COPY paths store aware timestamps as naive UTC"""
+    with Session(pg_engine) as session:
+        Database(session).create_template(weight_template)
+        definition_id = session.scalar(select(ValueDefinition.id).where(ValueDefinition.name == "weight"))
+    measured_at = datetime(2024, 3, 1, 23, 30, tzinfo=timezone(timedelta(hours=-5)))
+    with Session(pg_engine) as session:
+        ensure_partitions(session, [measured_at])
+
+    # psycopg2, with a CSV buffer
+    with Session(pg_engine) as session:
+        assert write_measurement_rows(
+            session, *_rows(weight_template.id, definition_id, "copy-sync", measured_at), backend="copy"
+        ) == "copy"
+        session.commit()
+
+    # asyncpg, with copy_records_to_table inside the session's transaction
+    async def copy_async():
+        engine = create_async_engine(to_async_url(TEST_POSTGRES_URL))
+        try:
+            async with AsyncSession(engine) as session:
+                backend = await session.run_sync(
+                    write_measurement_rows, *_rows(weight_template.id, definition_id, "copy-async", measured_at), "copy"
+                )
+                await session.commit()
+            return backend
+        finally:
+            await engine.dispose()
+    assert asyncio.run(copy_async()) == "copy"
+
+    # Verify result
+    expected = datetime(2024, 3, 2, 4, 30)
+    with Session(pg_engine) as session:
+        measurements = session.execute(select(Measurement.id, Measurement.measured_at, Measurement.recorded_at)).all()
+        assert sorted(measurements) == [("copy-async", expected, expected), ("copy-sync", expected, expected)]
+        assert set(session.scalars(select(MeasurementValue.measured_at))) == {expected}
+
+def test_ensure_partitions_commits_on_its_own(pg_engine):
+    """Test that partitions are committed apart from the session's transaction"""
+    with Session(pg_engine) as session:
+        ensure_partitions(session, [datetime(2023, 7, 14, 12, 0)])
+        session.rollback()
+
+    # Visible to other connections without the session committing
+    tables = set(inspect(pg_engine).get_table_names())
+    assert {partition_name("measurements", date(2023, 7, 1)), partition_name("measurement_values", date(2023, 7, 1))} <= tables
@@ -18,8 +18,14 @@ function generateUUID() {
 let templates = [];
 let currentTemplate = null;
 let measurements = [];
+let measurementsQuery = '';
+let measurementsCursor = null;
 let charts = {};
 
+// Last GET response per endpoint and its ETag, sent back as If-None-Match
+const etagCache = new Map();
+const ETAG_CACHE_SIZE = 100;
+
 // DOM Elements
 const navLinks = document.querySelectorAll('.nav-link');
 const pages = document.querySelectorAll('.page');
@@ -36,6 +42,7 @@ const saveMeasurementBtn = document.getElementById('save-measurement-btn');
 const addValueBtn = document.getElementById('add-value-btn');
 const valueDefinitionsContainer = document.getElementById('value-definitions-container');
 const measurementValuesContainer = document.getElementById('measurement-values-container');
+const loadMoreMeasurementsBtn = document.getElementById('load-more-measurements');
 
 // Bootstrap modals
 const addMeasurementModal = new bootstrap.Modal(document.getElementById('add-measurement-modal'));
@@ -89,6 +96,7 @@ document.addEventListener('DOMContentLoaded', () => {
     
     // Initialize event listeners
     document.getElementById('apply-measurement-filter').addEventListener('click', loadMeasurements);
+    loadMoreMeasurementsBtn.addEventListener('click', loadMoreMeasurements);
     dashboardTemplateSelect.addEventListener('change', loadDashboard);
     addMeasurementBtn.addEventListener('click', showAddMeasurementModal);
     addTemplateBtn.addEventListener('click', showAddTemplateModal);
@@ -176,6 +184,16 @@ async function fetchAPI(endpoint, options = {}) {
         }
         options.headers['Accept'] = 'application/json';
         
+        // Revalidate GETs ourselves, a 304 reuses the body we kept
+        const isGet = !options.method || options.method.toUpperCase() === 'GET';
+        const cached = isGet ? etagCache.get(endpoint) : null;
+        if (cached) {
+            options.headers['If-None-Match'] = cached.etag;
+        }
+        if (isGet) {
+            options.cache = 'no-store';
+        }
+        
         const response = await fetch(`${API_URL}${endpoint}`, options);
         
         // Handle authentication errors
@@ -186,11 +204,24 @@ async function fetchAPI(endpoint, options = {}) {
             return null;
         }
         
+        if (response.status === 304 && cached) {
+            return cached.data;
+        }
+        
         if (!response.ok) {
             throw new Error(`API error: ${response.status}`);
         }
         
-        return await response.json();
+        const data = await response.json();
+        const etag = response.headers.get('ETag');
+        if (isGet && etag) {
+            etagCache.delete(endpoint);
+            if (etagCache.size >= ETAG_CACHE_SIZE) {
+                etagCache.delete(etagCache.keys().next().value);
+            }
+            etagCache.set(endpoint, { etag, data });
+        }
+        return data;
     } catch (error) {
         console.error('API Error:', error);
         console.error('API URL:', `${API_URL}${endpoint}`);
@@ -387,7 +418,6 @@ async function loadMeasurements() {
     const startDate = measurementStartDate.value;
     const endDate = measurementEndDate.value;
     
-    let url = '/measurements';
     const params = new URLSearchParams();
     
     if (templateId) params.append('template_id', templateId);
@@ -399,12 +429,24 @@ async function loadMeasurements() {
         params.append('end_date', endDateTime.toISOString());
     }
     
-    if (params.toString()) {
-        url += `?${params.toString()}`;
-    }
+    measurementsQuery = params.toString();
+    measurementsCursor = null;
+    measurements = [];
+    
+    await loadMoreMeasurements();
+}
+
+async function loadMoreMeasurements() {
+    // Pages are fetched with the cursor returned by the previous page
+    const params = new URLSearchParams(measurementsQuery);
+    if (measurementsCursor) params.append('cursor', measurementsCursor);
+    
+    const page = await fetchAPI(`/measurements?${params.toString()}`);
+    if (!page) return;
     
-    measurements = await fetchAPI(url);
-    if (!measurements) return;
+    measurements = measurements.concat(page.items);
+    measurementsCursor = page.next_cursor;
+    loadMoreMeasurementsBtn.classList.toggle('d-none', !measurementsCursor);
     
     displayMeasurements();
 }
@@ -530,7 +572,7 @@ async function saveMeasurement() {
         measured_at: measuredAt,
         recorded_at: new Date().toISOString(),
         notes,
-        user_id: 'user-1' // In a real app, this would be the logged-in user's ID
+        user_id: 'user-1' // Replaced by the logged-in user on the server
     };
     
     // Save measurement
@@ -565,19 +607,22 @@ async function loadDashboard() {
     const activeTimeFilter = document.querySelector('.time-filter.active');
     const days = activeTimeFilter ? parseInt(activeTimeFilter.getAttribute('data-days')) : 30;
     
-    // Calculate date range
+    // Calculate date range in whole UTC days up to the end of today, so the URLs stay
+    // the same between polls and can be revalidated with their ETags
     const endDate = new Date();
-    const startDate = new Date();
-    startDate.setDate(endDate.getDate() - days);
+    endDate.setUTCHours(24, 0, 0, 0);
+    const startDate = new Date(endDate);
+    startDate.setUTCDate(endDate.getUTCDate() - days);
     
     // Get statistics
     const statsUrl = `/statistics/${templateId}?start_date=${startDate.toISOString()}&end_date=${endDate.toISOString()}`;
     const statistics = await fetchAPI(statsUrl);
     if (!statistics) return;
     
-    // Get measurements for charts
-    const measurementsUrl = `/measurements?template_id=${templateId}&start_date=${startDate.toISOString()}&end_date=${endDate.toISOString()}`;
-    const chartData = await fetchAPI(measurementsUrl);
+    // Get downsampled readings for charts, never more points than a chart has pixels
+    const points = chartPointsForWidth(document.getElementById('chart-container').clientWidth);
+    const seriesUrl = `/measurements/series?template_id=${templateId}&points=${points}&start_date=${startDate.toISOString()}&end_date=${endDate.toISOString()}`;
+    const chartData = await fetchAPI(seriesUrl);
     if (!chartData) return;
     
     // Display statistics and charts
@@ -585,6 +630,13 @@ async function loadDashboard() {
     displayCharts(chartData, template);
 }
 
+function chartPointsForWidth(containerWidth) {
+    // Charts take half of the container on wide screens. Rounded to steps of 50 so
+    // small resizes keep the URL, and its ETag, unchanged
+    const chartWidth = containerWidth >= 768 ? containerWidth / 2 : containerWidth;
+    return Math.max(50, Math.floor(chartWidth * (window.devicePixelRatio || 1) / 50) * 50);
+}
+
 function displayStatistics(statistics, template) {
     const statsContainer = document.getElementById('stats-container');
     statsContainer.innerHTML = '<h3 class="col-12 mb-3">Statistics</h3>';
@@ -621,7 +673,7 @@ function displayStatistics(statistics, template) {
     statsContainer.appendChild(row);
 }
 
-function displayCharts(measurements, template) {
+function displayCharts(series, template) {
     const chartContainer = document.getElementById('chart-container');
     chartContainer.innerHTML = '<h3 class="col-12 mb-3">Charts</h3>';
     
@@ -629,9 +681,6 @@ function displayCharts(measurements, template) {
     Object.values(charts).forEach(chart => chart.destroy());
     charts = {};
     
-    // Sort measurements by date
-    measurements.sort((a, b) => new Date(a.measured_at) - new Date(b.measured_at));
-    
     // Prepare data for each value definition
     template.value_definitions.forEach(valueDef => {
         const chartDiv = document.createElement('div');
@@ -648,27 +697,19 @@ function displayCharts(measurements, template) {
         `;
         chartContainer.appendChild(chartDiv);
         
-        // Extract data for this value
-        const dates = [];
-        const values = [];
-        
-        measurements.forEach(measurement => {
-            const value = measurement.values.find(v => v.definition_name === valueDef.name);
-            if (value) {
-                dates.push(new Date(measurement.measured_at).toLocaleDateString());
-                values.push(value.value);
-            }
-        });
+        // Readings arrive sorted by time and are placed by timestamp, since
+        // downsampled points are not evenly spaced
+        const points = series[valueDef.name] ? series[valueDef.name].points : [];
+        const data = points.map(p => ({ x: Date.parse(p.measured_at + 'Z'), y: p.value }));
         
         // Create chart
         const ctx = document.getElementById(`chart-${valueDef.name}`).getContext('2d');
         charts[valueDef.name] = new Chart(ctx, {
             type: 'line',
             data: {
-                labels: dates,
                 datasets: [{
                     label: `${valueDef.display_name} (${valueDef.unit.display_name})`,
-                    data: values,
+                    data: data,
                     borderColor: 'rgba(13, 110, 253, 1)',
                     backgroundColor: 'rgba(13, 110, 253, 0.1)',
                     borderWidth: 2,
@@ -680,9 +721,22 @@ function displayCharts(measurements, template) {
                 responsive: true,
                 maintainAspectRatio: false,
                 scales: {
+                    x: {
+                        type: 'linear',
+                        ticks: {
+                            callback: value => new Date(value).toLocaleDateString()
+                        }
+                    },
                     y: {
                         beginAtZero: false
                     }
+                },
+                plugins: {
+                    tooltip: {
+                        callbacks: {
+                            title: items => new Date(items[0].parsed.x).toLocaleString()
+                        }
+                    }
                 }
             }
         });